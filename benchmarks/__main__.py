@@ -0,0 +1,228 @@
+# Replays synthetic or recorded event traces through the hook callbacks with stubbed
+# OS modules and reports per event cost. Run from the repository root:
+#   python -m benchmarks [suite ...] [--events N] [--save FILE] [--compare FILE]
+from argparse import ArgumentParser
+from functools import partial
+from time import perf_counter_ns
+from tempfile import gettempdir, TemporaryDirectory
+import ctypes
+import gc
+import json
+import os
+import sys
+
+from . import stubs, traces
+
+SUITES = {
+    'mouse_motion': ('darwin', traces.mouse_motion),
+    'modifier_chording': ('darwin', traces.modifier_chording),
+    'passthrough_bursts': ('darwin', traces.passthrough_bursts),
+    'win_remap_stream': ('win32', traces.win_remap_stream),
+    # The same trace through a hook procedure, pynput's exception path against our own verdict path.
+    'win_hook_exception': ('win32', traces.win_remap_stream),
+    'win_hook_dispatch': ('win32', traces.win_remap_stream),
+}
+
+MOONLIGHT_BOUNDS = {'X': 0, 'Y': 0, 'Width': 1920, 'Height': 1080}
+
+class _HookData:
+    __slots__ = ('vkCode', 'flags', 'dwExtraInfo')
+
+    def __init__(self, vk):
+        self.vkCode = vk
+        self.flags = 0
+        self.dwExtraInfo = 0
+
+def create_app(platform):
+    stubs.install(platform)
+    log_file_path = gettempdir() + '/moonlight-desktop-benchmark.log'
+    if platform == 'darwin':
+        from moonlight_desktop.mac_app import MacApp
+        from moonlight_desktop.window_tracker import WindowState
+        app = MacApp(log_file_path, ['main', 'config/mac-client.yaml'])
+        app._load_config()
+        app._on_moonlight_window_changed(WindowState(True, MOONLIGHT_BOUNDS, 1))
+    else:
+        from moonlight_desktop.win_app import WinApp
+        app = WinApp(log_file_path, ['main', 'config/win-server.yaml'])
+        app._load_config()
+        app._create_key_listener()
+    # Tracing is on by default, so the hooks pay for it here too.
+    from moonlight_desktop.trace import TraceRecorder
+    app._trace = TraceRecorder(gettempdir() + '/moonlight-desktop-benchmark-trace.bin')
+    return app
+
+# Mirrors the hook procedure of pynput's SystemHook: the filter swallows an event by raising.
+class _PynputHook:
+    def __init__(self, event_filter, user32, suppress_exception):
+        from moonlight_desktop.win_hook import KBDLLHOOKSTRUCT
+        self._event_filter = event_filter
+        self._user32 = user32
+        self._suppress_exception = suppress_exception
+        self._pointer_type = ctypes.POINTER(KBDLLHOOKSTRUCT)
+
+    def dispatch(self, code, msg, lpdata):
+        suppress = False
+        try:
+            self._event_filter(msg, ctypes.cast(lpdata, self._pointer_type).contents)
+        except self._suppress_exception:
+            suppress = True
+        finally:
+            if suppress:
+                return 1
+            return self._user32.CallNextHookEx(None, code, msg, lpdata)
+
+# Turns trace tuples into (callback, args) pairs so the timed loop does no decoding.
+# With a hook_mode, Windows events are passed to a hook procedure as a real KBDLLHOOKSTRUCT.
+def compile_trace(app, events, hook_mode=None):
+    if hook_mode is not None:
+        from moonlight_desktop.win_hook import KeyboardHook, HC_ACTION, KBDLLHOOKSTRUCT
+        fake_user32 = stubs.FakeUser32()
+        if hook_mode == 'exception':
+            hook = _PynputHook(app._win32_key_event_listener, fake_user32, sys.modules['pynput.keyboard'].Listener.SuppressException)
+        else:
+            hook = KeyboardHook(app._handle_key_event, fake_user32, fake_user32)
+        dispatch = partial(hook.dispatch, HC_ACTION)
+    calls = []
+    for event in events:
+        if event[0] == 'mouse':
+            fake_event = stubs.FakeEvent(location=(event[1], event[2]))
+            calls.append((app._darwin_mouse_event_listener, stubs.QUARTZ_CONSTANTS['kCGEventMouseMoved'], fake_event, None))
+        elif event[0] == 'key':
+            fake_event = stubs.FakeEvent(keycode=event[2], flags=event[3])
+            calls.append((app._darwin_key_event_listener, event[1], fake_event, event[3]))
+        elif event[0] == 'win' and hook_mode is not None:
+            # Keep the struct alive, only its address is passed.
+            data = KBDLLHOOKSTRUCT(event[2], 0, 0, 0, 0)
+            calls.append((dispatch, event[1], ctypes.addressof(data), data))
+        elif event[0] == 'win':
+            calls.append((app._win32_key_event_listener, event[1], _HookData(event[2]), None))
+        else:
+            raise ValueError('Unknown event: {}'.format(event))
+    return calls
+
+def replay(calls, suppress_exception):
+    timings = []
+    for callback, event_type, event, flags in calls:
+        # The listeners filter flags in place, restore them for every replay.
+        if type(flags) is int:
+            event.flags = flags
+        start_time = perf_counter_ns()
+        try:
+            callback(event_type, event)
+        except suppress_exception:
+            pass
+        timings.append(perf_counter_ns() - start_time)
+    return timings
+
+def percentile(sorted_values, percent):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100.0))]
+
+def run_suite(name, events=None, event_count=1000, rounds=20):
+    platform, generate = SUITES.get(name, (None, None))
+    if platform is None:
+        platform = 'win32' if any(event[0] == 'win' for event in events) else 'darwin'
+    app = create_app(platform)
+    suppress_exception = sys.modules['pynput.keyboard'].Listener.SuppressException
+    hook_mode = {'win_hook_exception': 'exception', 'win_hook_dispatch': 'dispatch'}.get(name)
+    calls = compile_trace(app, events if events is not None else generate(event_count), hook_mode)
+
+    # Warm up, then time every event of every round.
+    replay(calls, suppress_exception)
+    timings = []
+    gc.disable()
+    try:
+        start_time = perf_counter_ns()
+        for _ in range(rounds):
+            timings.extend(replay(calls, suppress_exception))
+        elapsed = perf_counter_ns() - start_time
+
+        # Blocks still allocated after a round, i.e. what the hooks retain per event.
+        blocks_before = sys.getallocatedblocks()
+        for callback, event_type, event, flags in calls:
+            if type(flags) is int:
+                event.flags = flags
+            try:
+                callback(event_type, event)
+            except suppress_exception:
+                pass
+        blocks_after = sys.getallocatedblocks()
+    finally:
+        gc.enable()
+
+    timings.sort()
+    return {
+        'events': len(timings),
+        'events_per_second': len(timings) * 1e9 / elapsed,
+        'p50_ns': percentile(timings, 50),
+        'p99_ns': percentile(timings, 99),
+        'max_ns': timings[-1],
+        'retained_blocks_per_event': (blocks_after - blocks_before) / len(calls),
+    }
+
+def run_config_compilation(rounds=50, use_cache=False):
+    app = create_app('darwin')
+    timings = []
+    for _ in range(rounds):
+        start_time = perf_counter_ns()
+        app._apply_compiled_config(app._compile_config(use_cache))
+        timings.append(perf_counter_ns() - start_time)
+    timings.sort()
+    return {'rounds': rounds, 'p50_ns': percentile(timings, 50), 'p99_ns': percentile(timings, 99)}
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and 'p99_ns' in result:
+            limit = baseline[name]['p99_ns'] * (1 + tolerance)
+            if result['p99_ns'] > limit:
+                regressions.append('{}: p99 {} ns > {:.0f} ns'.format(name, result['p99_ns'], limit))
+    return regressions
+
+def run_suites(args):
+    results = {}
+    if args.trace:
+        results['trace'] = run_suite('trace', traces.load_trace(args.trace), rounds=args.rounds)
+    else:
+        for name in args.suites or list(SUITES) + ['config_compilation', 'config_cache']:
+            if name == 'config_compilation':
+                results[name] = run_config_compilation()
+            elif name == 'config_cache':
+                results[name] = run_config_compilation(use_cache=True)
+            else:
+                results[name] = run_suite(name, event_count=args.events, rounds=args.rounds)
+    return results
+
+def main(argv):
+    parser = ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('suites', nargs='*', help='suites to run: {}, config_compilation or config_cache'.format(', '.join(SUITES)))
+    parser.add_argument('--events', type=int, default=1000, help='events per generated trace')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--trace', help='replay a recorded JSON trace instead of the generated ones')
+    parser.add_argument('--save', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', help='fail if p99 regressed against a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed p99 regression ratio')
+    args = parser.parse_args(argv)
+
+    # The configs compiled against the stubs must not land in the user's config cache.
+    with TemporaryDirectory(prefix='moonlight-desktop-benchmark-') as cache_home:
+        os.environ['XDG_CACHE_HOME'] = os.environ['LOCALAPPDATA'] = cache_home
+        results = run_suites(args)
+
+    for name, result in results.items():
+        print('{:<20} {}'.format(name, '  '.join('{}={:.4g}'.format(k, v) for k, v in result.items())))
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
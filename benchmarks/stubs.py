@@ -0,0 +1,338 @@
+# Stand-ins for the OS and GUI modules imported by moonlight_desktop, so the hook
+# callbacks can be driven on a Linux box without a display.
+from enum import Enum
+from queue import Queue
+from types import ModuleType
+import ctypes
+import os
+import sys
+
+MAC_KEYS = {
+    'alt': 0x3A, 'alt_l': 0x3A, 'alt_r': 0x3D,
+    'cmd': 0x37, 'cmd_l': 0x37, 'cmd_r': 0x36,
+    'ctrl': 0x3B, 'ctrl_l': 0x3B, 'ctrl_r': 0x3E,
+    'shift': 0x38, 'shift_l': 0x38, 'shift_r': 0x3C,
+    'end': 0x77, 'home': 0x73, 'delete': 0x75, 'esc': 0x35, 'tab': 0x30, 'space': 0x31,
+    'f17': 0x40, 'f18': 0x4F, 'f19': 0x50, 'f20': 0x5A,
+}
+
+WIN_KEYS = {
+    'alt': 0x12, 'alt_l': 0xA4, 'alt_r': 0xA5,
+    'cmd': 0x5B, 'cmd_l': 0x5B, 'cmd_r': 0x5C,
+    'ctrl': 0x11, 'ctrl_l': 0xA2, 'ctrl_r': 0xA3,
+    'shift': 0x10, 'shift_l': 0xA0, 'shift_r': 0xA1,
+    'end': 0x23, 'home': 0x24, 'delete': 0x2E, 'esc': 0x1B, 'tab': 0x09, 'space': 0x20,
+    'f17': 0x80, 'f18': 0x81, 'f19': 0x82, 'f20': 0x83,
+}
+
+MAC_CHARS = {
+    'a': 0, 's': 1, 'd': 2, 'f': 3, 'h': 4, 'g': 5, 'z': 6, 'x': 7, 'c': 8, 'v': 9,
+    'b': 11, 'q': 12, 'w': 13, 'e': 14, 'r': 15, 'y': 16, 't': 17, '1': 18, '2': 19,
+    '3': 20, '4': 21, '6': 22, '5': 23, '9': 25, '7': 26, '8': 28, '0': 29, 'o': 31,
+    'u': 32, 'i': 34, 'p': 35, 'l': 37, 'j': 38, 'k': 40, 'n': 45, 'm': 46,
+}
+
+# Quartz constants, the values match the real framework.
+QUARTZ_CONSTANTS = {
+    'kCGEventKeyDown': 10,
+    'kCGEventKeyUp': 11,
+    'kCGEventFlagsChanged': 12,
+    'kCGEventMouseMoved': 5,
+    'kCGEventTapDisabledByTimeout': 0xFFFFFFFE,
+    'kCGEventTapDisabledByUserInput': 0xFFFFFFFF,
+    'kCGKeyboardEventKeycode': 9,
+    'kCGKeyboardEventKeyboardType': 10,
+    'kCGEventFlagMaskShift': 0x20000,
+    'kCGEventFlagMaskControl': 0x40000,
+    'kCGEventFlagMaskAlternate': 0x80000,
+    'kCGEventFlagMaskCommand': 0x100000,
+    'kCGWindowListOptionOnScreenOnly': 1,
+    'kCGWindowListExcludeDesktopElements': 16,
+    'kCGNullWindowID': 0,
+    'kCGHIDEventTap': 0,
+    'kCGEventSourceStateHIDSystemState': 1,
+}
+
+class FakeEvent:
+    __slots__ = ('keycode', 'flags', 'keyboard_type', 'location')
+
+    def __init__(self, keycode=0, flags=0, keyboard_type=40, location=(0.0, 0.0)):
+        self.keycode = keycode
+        self.flags = flags
+        self.keyboard_type = keyboard_type
+        self.location = location
+
+def _quartz_module():
+    quartz = ModuleType('Quartz')
+    quartz.__dict__.update(QUARTZ_CONSTANTS)
+    quartz.warp_count = 0
+
+    def CGEventGetIntegerValueField(event, field):
+        if field == QUARTZ_CONSTANTS['kCGKeyboardEventKeycode']:
+            return event.keycode
+        return event.keyboard_type
+
+    def CGEventSetIntegerValueField(event, field, value):
+        if field == QUARTZ_CONSTANTS['kCGKeyboardEventKeycode']:
+            event.keycode = value
+        else:
+            event.keyboard_type = value
+
+    def CGEventGetFlags(event):
+        return event.flags
+
+    def CGEventSetFlags(event, flags):
+        event.flags = flags
+
+    def CGEventGetLocation(event):
+        return event.location
+
+    def CGEventSetLocation(event, location):
+        event.location = location
+
+    def CGWarpMouseCursorPosition(location):
+        quartz.warp_count += 1
+
+    def CGEventCreateKeyboardEvent(source, keycode, is_down):
+        return FakeEvent(keycode)
+
+    quartz.CGEventGetIntegerValueField = CGEventGetIntegerValueField
+    quartz.CGEventSetIntegerValueField = CGEventSetIntegerValueField
+    quartz.CGEventGetFlags = CGEventGetFlags
+    quartz.CGEventSetFlags = CGEventSetFlags
+    quartz.CGEventGetLocation = CGEventGetLocation
+    quartz.CGEventSetLocation = CGEventSetLocation
+    quartz.CGWarpMouseCursorPosition = CGWarpMouseCursorPosition
+    quartz.CGSetLocalEventsSuppressionInterval = lambda interval: None
+    quartz.CGWindowListCopyWindowInfo = lambda options, window_id: []
+    quartz.CGEventCreateKeyboardEvent = CGEventCreateKeyboardEvent
+    quartz.CGEventSourceCreate = lambda state: object()
+    quartz.CGEventPost = lambda tap, event: None
+    quartz.CGEventTapEnable = lambda tap, enable: None
+    quartz.CGEventTapIsEnabled = lambda tap: True
+    return quartz
+
+def _pynput_modules(key_table):
+    class KeyCode:
+        __slots__ = ('vk', 'char')
+
+        def __init__(self, vk=None, char=None):
+            self.vk = vk
+            self.char = char
+
+        @classmethod
+        def from_vk(cls, vk):
+            return cls(vk=vk)
+
+        @classmethod
+        def from_char(cls, char):
+            return cls(char=char)
+
+        def __eq__(self, other):
+            return isinstance(other, KeyCode) and (self.vk, self.char) == (other.vk, other.char)
+
+        def __hash__(self):
+            return hash((self.vk, self.char))
+
+        def __repr__(self):
+            return '<{}>'.format(self.vk) if self.vk is not None else repr(self.char)
+
+    Key = Enum('Key', {name: KeyCode.from_vk(vk) for name, vk in key_table.items()})
+
+    class HotKey:
+        @staticmethod
+        def parse(keys):
+            parsed = []
+            for part in keys.split('+'):
+                if len(part) > 2 and part[0] == '<' and part[-1] == '>':
+                    name = part[1:-1]
+                    parsed.append(KeyCode.from_vk(int(name)) if name.isdigit() else Key[name])
+                elif len(part) == 1:
+                    parsed.append(KeyCode.from_char(part.lower()))
+                else:
+                    raise ValueError(keys)
+            return parsed
+
+    class Controller:
+        def __init__(self):
+            self.touch_count = 0
+
+        def touch(self, key, is_press):
+            self.touch_count += 1
+
+    class _SuppressException(Exception):
+        pass
+
+    class Listener:
+        SuppressException = _SuppressException
+
+        def __init__(self, *args, **kwargs):
+            self.kwargs = kwargs
+
+        def start(self):
+            pass
+
+        def stop(self):
+            pass
+
+        def suppress_event(self):
+            raise _SuppressException()
+
+    keyboard = ModuleType('pynput.keyboard')
+    keyboard.Key = Key
+    keyboard.KeyCode = KeyCode
+    keyboard.HotKey = HotKey
+    keyboard.Controller = Controller
+    keyboard.Listener = Listener
+
+    mouse = ModuleType('pynput.mouse')
+    mouse.Listener = Listener
+
+    darwin = ModuleType('pynput._util.darwin')
+    darwin.get_unicode_to_keycode_map = lambda: dict(MAC_CHARS)
+
+    util = ModuleType('pynput._util')
+    util.darwin = darwin
+
+    pynput = ModuleType('pynput')
+    pynput.keyboard = keyboard
+    pynput.mouse = mouse
+    pynput._util = util
+
+    return {
+        'pynput': pynput,
+        'pynput.keyboard': keyboard,
+        'pynput.mouse': mouse,
+        'pynput._util': util,
+        'pynput._util.darwin': darwin,
+    }
+
+def _gui_modules():
+    class _Anything:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __call__(self, *args, **kwargs):
+            return _Anything()
+
+        def __getattr__(self, name):
+            return _Anything()
+
+        def __iter__(self):
+            return iter(())
+
+    image = ModuleType('PIL.Image')
+    image.open = lambda path: None
+    pil = ModuleType('PIL')
+    pil.Image = image
+
+    pystray = ModuleType('pystray')
+    pystray.Icon = _Anything
+    pystray.Menu = _Anything
+    pystray.MenuItem = _Anything
+
+    appkit = ModuleType('AppKit')
+    appkit.NSWorkspace = _Anything()
+    appkit.NSRunningApplication = _Anything()
+    for name in ('NSWorkspaceDidActivateApplicationNotification',
+                 'NSWorkspaceActiveSpaceDidChangeNotification',
+                 'NSWorkspaceDidTerminateApplicationNotification'):
+        setattr(appkit, name, name)
+
+    foundation = ModuleType('Foundation')
+    foundation.NSAppleScript = _Anything()
+    foundation.CFPreferencesCopyAppValue = lambda key, app_id: 'com.apple.keylayout.US'
+
+    psutil = ModuleType('psutil')
+    psutil.pid_exists = lambda pid: False
+
+    win32api = ModuleType('win32api')
+    win32api.VkKeyScan = lambda char: ord(char.upper())
+    win32api.GetKeyboardLayoutName = lambda: '00000409'
+
+    win32con = ModuleType('win32con')
+    win32con.WM_KEYDOWN = 0x100
+    win32con.WM_KEYUP = 0x101
+    win32con.WM_SYSKEYDOWN = 0x104
+    win32con.WM_SYSKEYUP = 0x105
+
+    return {
+        'PIL': pil,
+        'PIL.Image': image,
+        'pystray': pystray,
+        'AppKit': appkit,
+        'Foundation': foundation,
+        'psutil': psutil,
+        'win32api': win32api,
+        'win32con': win32con,
+    }
+
+class _User32:
+    def __init__(self):
+        self.send_input_count = 0
+
+    def MapVirtualKeyW(self, code, map_type):
+        return 0
+
+    def SendInput(self, count, inputs, size):
+        self.send_input_count += 1
+        return count
+
+# Stands in for user32 and kernel32 so the hook can be driven without Windows. send() calls the
+# installed hook like the OS would and returns whether it swallowed the event.
+class FakeUser32:
+    def __init__(self):
+        self._messages = Queue()
+        self.proc = None
+        self.next_hook_calls = 0
+
+    def GetCurrentThreadId(self):
+        return 1
+
+    def SetWindowsHookExW(self, hook_id, proc, module, thread_id):
+        self.proc = proc
+        return 1
+
+    def UnhookWindowsHookEx(self, hook):
+        self.proc = None
+        return 1
+
+    def CallNextHookEx(self, hook, n_code, w_param, l_param):
+        self.next_hook_calls += 1
+        return 0
+
+    def GetMessageW(self, message, hwnd, min_filter, max_filter):
+        from moonlight_desktop.win_hook import WM_QUIT
+        return 0 if self._messages.get() == WM_QUIT else 1
+
+    def PostThreadMessageW(self, thread_id, msg, w_param, l_param):
+        self._messages.put(msg)
+        return 1
+
+    def send(self, msg, vk, flags=0, extra_info=0):
+        from moonlight_desktop.win_hook import KBDLLHOOKSTRUCT, HC_ACTION
+        data = KBDLLHOOKSTRUCT(vk, 0, flags, 0, extra_info)
+        return self.proc(HC_ACTION, msg, ctypes.addressof(data)) != 0
+
+def _windll():
+    windll = ModuleType('windll')
+    windll.user32 = _User32()
+    return windll
+
+# Installs the stubs for the given platform ('darwin' or 'win32') and drops any
+# moonlight_desktop module imported against the previous platform.
+def install(platform):
+    modules = _gui_modules()
+    modules.update(_pynput_modules(MAC_KEYS if platform == 'darwin' else WIN_KEYS))
+    modules['Quartz'] = _quartz_module()
+    # win_app imports os.startfile, which only exists on Windows.
+    if not hasattr(os, 'startfile'):
+        os.startfile = lambda path, operation=None: None
+    if not hasattr(ctypes, 'windll'):
+        ctypes.windll = _windll()
+
+    for name in list(sys.modules):
+        if name.startswith('moonlight_desktop.'):
+            del sys.modules[name]
+    sys.modules.update(modules)
+    return modules
@@ -0,0 +1,80 @@
+# Synthetic event traces. Each event is a tuple:
+#   ('mouse', x, y)
+#   ('key', event_type, keycode, flags)   Quartz key event on the Mac client
+#   ('win', msg, vk)                      low level keyboard hook message on the Windows server
+import json
+import math
+import random
+
+from .stubs import MAC_KEYS, MAC_CHARS, WIN_KEYS, QUARTZ_CONSTANTS
+
+KEY_DOWN = QUARTZ_CONSTANTS['kCGEventKeyDown']
+KEY_UP = QUARTZ_CONSTANTS['kCGEventKeyUp']
+FLAGS_CHANGED = QUARTZ_CONSTANTS['kCGEventFlagsChanged']
+FLAG_CTRL = QUARTZ_CONSTANTS['kCGEventFlagMaskControl']
+FLAG_ALT = QUARTZ_CONSTANTS['kCGEventFlagMaskAlternate']
+FLAG_CMD = QUARTZ_CONSTANTS['kCGEventFlagMaskCommand']
+FLAG_SHIFT = QUARTZ_CONSTANTS['kCGEventFlagMaskShift']
+
+WM_KEYDOWN = 0x100
+WM_KEYUP = 0x101
+
+# One second of 1 kHz mouse motion sweeping across and past a 1920x1080 window.
+def mouse_motion(count=1000, width=1920, height=1080):
+    events = []
+    for i in range(count):
+        angle = 2 * math.pi * i / count
+        x = width / 2 + width * 0.6 * math.cos(angle)
+        y = height / 2 + height * 0.6 * math.sin(angle)
+        events.append(('mouse', x, y))
+    return events
+
+# Rapidly chorded remapped modifiers with letters typed in between.
+def modifier_chording(count=1000, seed=1):
+    rng = random.Random(seed)
+    modifiers = (('ctrl_l', FLAG_CTRL), ('cmd_l', FLAG_CMD), ('alt_l', FLAG_ALT), ('ctrl_r', FLAG_CTRL))
+    letters = [MAC_CHARS[c] for c in 'asdfjkl']
+    events = []
+    while len(events) < count:
+        name, flag = rng.choice(modifiers)
+        keycode = MAC_KEYS[name]
+        letter = rng.choice(letters)
+        events.append(('key', FLAGS_CHANGED, keycode, flag))
+        events.append(('key', KEY_DOWN, letter, flag))
+        events.append(('key', KEY_UP, letter, flag))
+        events.append(('key', FLAGS_CHANGED, keycode, 0))
+    return events[:count]
+
+# Bursts of the <ctrl>+<number> passthrough hotkeys.
+def passthrough_bursts(count=1000):
+    numbers = [MAC_CHARS[c] for c in '1234567890']
+    events = []
+    while len(events) < count:
+        events.append(('key', FLAGS_CHANGED, MAC_KEYS['ctrl_l'], FLAG_CTRL))
+        for keycode in numbers:
+            events.append(('key', KEY_DOWN, keycode, FLAG_CTRL))
+            events.append(('key', KEY_UP, keycode, FLAG_CTRL))
+        events.append(('key', FLAGS_CHANGED, MAC_KEYS['ctrl_l'], 0))
+    return events[:count]
+
+# Remapped F17-F19 on the server, held with OS auto-repeat, mixed with plain typing.
+def win_remap_stream(count=1000, repeats=10, seed=1):
+    rng = random.Random(seed)
+    remapped = [WIN_KEYS['f17'], WIN_KEYS['f18'], WIN_KEYS['f19']]
+    events = []
+    while len(events) < count:
+        vk = rng.choice(remapped)
+        events.extend([('win', WM_KEYDOWN, vk)] * repeats)
+        letter = ord(rng.choice('ASDFJKL'))
+        events.append(('win', WM_KEYDOWN, letter))
+        events.append(('win', WM_KEYUP, letter))
+        events.append(('win', WM_KEYUP, vk))
+    return events[:count]
+
+def load_trace(path):
+    with open(path, 'r') as trace_file:
+        return [tuple(event) for event in json.load(trace_file)]
+
+def save_trace(path, events):
+    with open(path, 'w') as trace_file:
+        json.dump(events, trace_file)
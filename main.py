@@ -1,6 +1,9 @@
 import sys
 from moonlight_desktop.__init__ import main
 from sys import exit
+from multiprocessing import freeze_support
 
 if __name__ == '__main__':
+    # The hook process is spawned from this executable in frozen apps.
+    freeze_support()
     exit(main(sys.argv))
@@ -1,7 +1,10 @@
 from sys import platform
 from os import path
 from tempfile import gettempdir
+from queue import SimpleQueue
 import logging
+import logging.handlers
+import atexit
 import traceback
 import sys
 
@@ -11,38 +14,66 @@ def is_windows():
 def is_mac():
     return platform in ['Mac', 'darwin', 'os2', 'os2emx']
 
+def is_linux():
+    return platform.startswith('linux')
+
 def check_argv_for_non_positional_flag(flag, argv):
     value = flag in argv
     if value:
         argv.remove(flag)
     return value
 
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    # Unlike QueueHandler, leave the formatting to the listener thread.
+    # Records are never pickled, the queue stays in process.
+    def prepare(self, record):
+        return record
+
 def setup_logger(log_file_path, is_debug=False):
     logger = logging.getLogger('moonlight-desktop')
     logger.setLevel(logging.DEBUG if is_debug else logging.INFO)
 
+    # The hooks log from the OS event tap thread, keep file I/O off it.
     fileHandler = logging.FileHandler(log_file_path)
     fileHandler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
-    logger.addHandler(fileHandler)
+    handlers = [fileHandler]
     if not hasattr(sys,"frozen"):
-        logger.addHandler(logging.StreamHandler())
+        handlers.append(logging.StreamHandler())
+
+    log_queue = SimpleQueue()
+    logger.addHandler(_LazyQueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
 
     logger.info('Log file is at {}'.format(log_file_path))
     return logger
 
 def main(argv=None):
     try:
+        from . import startup_profile
+        if check_argv_for_non_positional_flag('--profile-startup', argv):
+            startup_profile.enable()
+
         log_file_path = gettempdir() + '/moonlight-desktop.log'
         logger = setup_logger(log_file_path, check_argv_for_non_positional_flag('--debug', argv))
+        compile_config_only = check_argv_for_non_positional_flag('--compile-config', argv)
+
+        with startup_profile.phase('create app'):
+            if is_windows():
+                from .win_app import WinApp
+                app = WinApp(log_file_path, argv)
+            elif is_mac():
+                from .mac_app import MacApp
+                app = MacApp(log_file_path, argv)
+            elif is_linux():
+                from .linux_app import LinuxApp
+                app = LinuxApp(log_file_path, argv)
+            else:
+                raise RuntimeError('Unsupported platform')
 
-        if is_windows():
-            from .win_app import WinApp
-            app = WinApp(log_file_path, argv)
-        elif is_mac():
-            from .mac_app import MacApp
-            app = MacApp(log_file_path, argv)
-        else:
-            raise RuntimeError('Unsupported platform')
+        if compile_config_only:
+            return app.compile_config()
 
         return app.start()
     except Exception as ex:
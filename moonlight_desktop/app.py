@@ -1,16 +1,30 @@
+from os import path
+from tempfile import gettempdir
+from time import strftime
+from threading import Thread, Lock
 import logging
-from PIL import Image
 
-from yaml import safe_load
-
-from pynput import keyboard
-from pynput.keyboard import Key, KeyCode
-
-import pystray
+from .injector import ControllerInjector, QueuedInjector
+from .keymap import Keymap, PASS, MACRO, MOD_CTRL, MOD_ALT, MOD_CMD, MOD_SHIFT
+from .key_state import KeyState
+from .stats import Stats, StatsDumper
+from .hotkey_trie import parse_hotkey, split_hotkeys
+from .config_cache import CompiledConfig, Profile, ConfigCache, get_cache_key, get_cache_path
+from .config_watcher import ConfigWatcher
+from .input_state import InputState, DISABLED_INPUT_STATE, NO_MARGINS
+from .latency_probe import ProbeClient, ProbeServer, DEFAULT_PORT
+from .supervisor import EventLoopThread
+from .macro import MacroScheduler, compile_macro
+from .hook_process import HookProcess, MSG_CONFIG, MSG_INPUT_STATE, MSG_RELEASE_KEYS, MSG_RELEASE_ALL_KEYS, \
+    MSG_GET_STATS, MSG_STOP
+from .trace import TraceRecorder, NullTraceRecorder, get_trace_path, save_trace
+from . import startup_profile
 
 logger = logging.getLogger('moonlight-desktop')
 
 def parse_single_key(key_name):
+    from pynput import keyboard
+    from pynput.keyboard import Key
     try:
         key_sets = keyboard.HotKey.parse(key_name)
         if len(key_sets) > 1:
@@ -28,87 +42,515 @@ def parse_single_key(key_name):
 class App:
     def __init__(self, log_file_path, systray_icon_path, argv):
         if '--help' in argv:
-            raise RuntimeError('usage: {} [--debug] [config yaml path] [moonlight path]'.format(argv[0]))
+            raise RuntimeError('usage: {} [--debug] [--compile-config] [--profile-startup] [config yaml path] [moonlight path]'.format(argv[0]))
         
         self._log_file_path = log_file_path
         self._config_filename = argv[1] if len(argv) > 1 else None
 
         self._remap_keys = {}
         self._passthrough_hotkeys = set()
+        self._keymap = Keymap()
+        # Every profile is compiled up front, a focus change only swaps self._keymap.
+        self._default_keymap = self._keymap
+        self._profiles = []
+        self._profile_keymaps = {}
+        self._macros = []
+        self._compiled_config = None
+        self._input_state = DISABLED_INPUT_STATE
+
+        self._base_injector = self._create_base_injector()
+        self._injector = self._base_injector
+        self._injected_keys = KeyState()
+        # Trigger keys of the macros being held, their repeats and ups are swallowed.
+        self._macro_triggers = KeyState()
+        # Plays the macros where the hooks run, the hooks only hand them over.
+        self._macro_scheduler = MacroScheduler(lambda batch: self._injector.send(batch))
+
+        self._stats = Stats()
+        self._stats_dumper = StatsDumper(self._get_stats, gettempdir() + '/moonlight-desktop-stats.json')
+
+        self._config_watcher = None
+        self._reload_lock = Lock()
+        self._workers_started = False
+
+        self._latency_probe = None
+        # The server hook swallows this key and reports it to the probe, -1 when there is none.
+        self._probe_marker_keycode = -1
+
+        # Recorded into by the hooks, see trace.
+        self._trace = NullTraceRecorder()
+
+        # Runs and watches child processes, started on first use.
+        self._supervisor_loop = EventLoopThread()
+
+        self._use_hook_process = False
+        self._hook_process = None
+        # Set in the hook process, which leaves the config file and the UI to its parent.
+        self._hook_only = False
 
-        self._kb_controller = keyboard.Controller()
+        self._systray_icon_path = systray_icon_path
+        self.systray = None
 
-        self._init_systray(systray_icon_path)
+    # Loads the icon image and pystray, only once the hooks are live.
+    def _init_systray(self):
+        from PIL import Image
+        import pystray
 
-    def _init_systray(self, systray_icon_path):
-        icon = Image.open(systray_icon_path)
+        icon = Image.open(self._systray_icon_path)
         menu_open_log = pystray.MenuItem('View log', lambda: self._open_file_with_associated_app(self._log_file_path))
+        menu_open_stats = pystray.MenuItem('View stats', lambda: self._open_stats())
+        menu_save_trace = pystray.MenuItem('Save trace', lambda: self._save_trace())
+        menu_reload_config = pystray.MenuItem('Reload config', lambda: self.reload_config())
         menu_quit = pystray.MenuItem('Quit', lambda: self.stop())
 
-        menu = self._create_pystray_menu(menu_open_log, menu_quit)
+        menu = self._create_pystray_menu(menu_open_log, menu_open_stats, menu_save_trace, menu_reload_config, menu_quit)
 
         self.systray = pystray.Icon('Moonlight Desktop', icon=icon, title='Moonlight Desktop', menu=menu)
 
     def _create_pystray_menu(self, *items):
+        import pystray
         return pystray.Menu(*items)
 
     def _load_config(self):
         logger.info('Loading config from %s.', self._config_filename)
-        with open(self._config_filename, 'r') as config_file:
-            config = safe_load(config_file)
-            for remap_entry in config.get('remap_keys', {}):
-                from_key = parse_single_key(remap_entry['from'])
-                to_key = parse_single_key(remap_entry['to'])
-                self._remap_keys[from_key] = to_key
+        with startup_profile.phase('load config'):
+            self._apply_compiled_config(self._compile_config())
+
+    # Compiles the config, or loads it from the cache if neither the file nor the keyboard layout changed.
+    def _compile_config(self, use_cache=True):
+        with open(self._config_filename, 'rb') as config_file:
+            config_data = config_file.read()
+
+        cache = ConfigCache(get_cache_path(self._config_filename),
+                            get_cache_key(config_data, self._get_keyboard_layout_id(), type(self).__name__))
+        compiled_config = cache.load() if use_cache else None
+        if compiled_config is not None:
+            logger.debug('Loaded compiled config from %s.', cache.cache_path)
+            return compiled_config
+
+        from yaml import safe_load
+        config = safe_load(config_data)
+        self._check_latency_probe_config(config.get('latency_probe'))
+        remap_keys = self._parse_remap_keys(config.get('remap_keys', {}))
+        passthrough_hotkeys = self._parse_passthrough_hotkeys(config.get('passthrough_hotkeys', []))
+
+        # A profile replaces the key lists it has and keeps the others.
+        profiles = []
+        for profile_entry in config.get('profiles', []):
+            name = profile_entry.get('name')
+            if not name or name in [profile.name for profile in profiles]:
+                raise RuntimeError('Profiles need a unique name: {}'.format(profile_entry))
+            profiles.append(Profile(
+                name, profile_entry.get('bundle_id'), profile_entry.get('window_title'),
+                self._parse_remap_keys(profile_entry['remap_keys']) if 'remap_keys' in profile_entry else remap_keys,
+                self._parse_passthrough_hotkeys(profile_entry['passthrough_hotkeys'])
+                if 'passthrough_hotkeys' in profile_entry else passthrough_hotkeys))
+
+        macros = []
+        for macro_entry in config.get('macros', []):
+            name = macro_entry.get('name')
+            if not name or name in [macro.name for macro in macros]:
+                raise RuntimeError('Macros need a unique name: {}'.format(macro_entry))
+            macros.append(compile_macro(name, self._parse_hotkey(macro_entry['hotkey']), macro_entry['steps'], self._parse_key))
+
+        compiled_config = CompiledConfig(remap_keys, passthrough_hotkeys, config, profiles, macros,
+                                         self._get_modifier_keycodes())
+        if cache.save(compiled_config):
+            logger.debug('Saved compiled config to %s.', cache.cache_path)
+        return compiled_config
+
+    def _parse_remap_keys(self, remap_entries):
+        remap_keys = {}
+        for remap_entry in remap_entries:
+            from_key = self._parse_key(remap_entry['from'])
+            to_key = self._parse_key(remap_entry['to'])
+            remap_keys[from_key] = to_key
+        return remap_keys
+
+    # Returns the (modifier mask, keycode) pairs for the keymap table. A passthrough hotkey is
+    # replayed to the host as the modifiers plus its key, so chords and sequences are macro only.
+    def _parse_passthrough_hotkeys(self, passthrough_hotkey_strings):
+        passthrough_hotkeys = set()
+        for passthrough_hotkey_string in passthrough_hotkey_strings:
+            hotkeys, sequences = split_hotkeys([self._parse_hotkey(passthrough_hotkey_string)])
+            if sequences:
+                raise RuntimeError('Passthrough hotkeys take a single key, use a macro for chords and sequences: {}'.format(
+                    passthrough_hotkey_string))
+            passthrough_hotkeys.update(hotkeys)
+        return passthrough_hotkeys
+
+    def _apply_compiled_config(self, compiled_config):
+        config = compiled_config.options
+        self._compiled_config = compiled_config
+        self._remap_keys = compiled_config.remap_keys
+        self._passthrough_hotkeys = compiled_config.passthrough_hotkeys
+        self._profiles = compiled_config.profiles
+        self._macros = compiled_config.macros
+
+        logger.debug('remap_keys: %s', self._remap_keys)
+        logger.debug('passthrough_hotkeys: %s', self._passthrough_hotkeys)
+        logger.debug('profiles: %s', [profile.name for profile in self._profiles])
+        logger.debug('macros: %s', [macro.name for macro in self._macros])
+
+        # Built before the platform config, which may republish the input state with a profile.
+        self._default_keymap, self._profile_keymaps = compiled_config.create_keymaps()
+        # The hooks pick up the new keymap with the next event.
+        self._keymap = self._profile_keymaps.get(self._input_state.profile, self._default_keymap)
+
+        self._load_platform_config(config)
+
+        self._set_injection_queue_size(config.get('injection_queue_size', 0))
+        self._base_injector.prepare(self._get_injected_keycodes())
+
+        # Only read at start.
+        self._use_hook_process = config.get('hook_process', False)
+        if self._hook_process is not None:
+            self._hook_process.send_config(compiled_config)
+
+        if config.get('watch_config', True) and not self._hook_only:
+            if self._config_watcher is None:
+                self._config_watcher = ConfigWatcher(self._config_filename, self._reload_config)
+                if self._workers_started:
+                    self._config_watcher.start()
+        elif self._config_watcher is not None:
+            # Cleared first, this may run on the watcher's own thread through _reload_config.
+            config_watcher, self._config_watcher = self._config_watcher, None
+            config_watcher.stop()
+
+    # Inject keys from a worker thread if a queue size is given.
+    def _set_injection_queue_size(self, injection_queue_size):
+        current_size = self._injector.maxsize if isinstance(self._injector, QueuedInjector) else 0
+        if injection_queue_size == current_size:
+            return
+
+        old_injector = self._injector
+        if injection_queue_size > 0:
+            injector = QueuedInjector(self._base_injector, injection_queue_size)
+        else:
+            injector = self._base_injector
+        if self._workers_started:
+            injector.start()
+        self._injector = injector
+        if self._workers_started:
+            old_injector.stop()
+
+    # Recompiles the config on a background thread, safe to call from the systray or the watcher.
+    def reload_config(self):
+        Thread(target=self._reload_config, daemon=True).start()
+
+    def _reload_config(self):
+        with self._reload_lock:
+            logger.info('Reloading config from %s.', self._config_filename)
+            try:
+                compiled_config = self._compile_config()
+            except Exception:
+                logger.exception('Failed to reload config, keeping the current one.')
+                return
+            self._apply_compiled_config(compiled_config)
+            self._release_injected_keys()
+
+    # Releases keys injected on behalf of held keys, so nothing sticks across a keymap change,
+    # a focus change or shutdown. Macros being played are cancelled along with them.
+    def _release_injected_keys(self):
+        if self._hook_process is not None:
+            self._hook_process.release_keys()
+            return
+        self._macro_scheduler.cancel_all()
+        self._macro_triggers.release_all()
+        self._reset_hotkey_matchers()
+        injected_keys = self._injected_keys.release_all()
+        if injected_keys:
+            self._injector.send([(injected_key, False) for injected_key in injected_keys])
+
+    # Drops the chords and sequences in progress in every keymap, the hooks may not see the
+    # ups of their keys, e.g. after a focus change.
+    def _reset_hotkey_matchers(self):
+        for keymap in [self._default_keymap] + list(self._profile_keymaps.values()):
+            if keymap.hotkey_matcher is not None:
+                keymap.hotkey_matcher.reset()
+
+    # Sends an up for every key the config may inject, whether or not it is down. For when
+    # the state of the keys was lost, e.g. with a hook process which died.
+    def _release_all_injected_keycodes(self):
+        self._injected_keys.release_all()
+        self._injector.send([(keycode, False) for keycode in sorted(self._get_injected_keycodes())])
+
+    # Tracks the target of a remapped key, returns whether to inject it. Drops the OS
+    # auto-repeat of held modifiers and ups without a matching down.
+    def _track_remapped_key(self, keymap, keycode, to, is_key_down):
+        if is_key_down:
+            if self._injected_keys.press(to) or not keymap.is_modifier_remap(keycode):
+                return True
+        elif self._injected_keys.release(to):
+            return True
+        self._stats.suppressed += 1
+        return False
+
+    # Starts the macro of action on the trigger's down, swallows its auto-repeat and up.
+    # Only called for macro actions and the ups of held triggers, returns MACRO or PASS.
+    def _handle_macro_key(self, action, keycode, is_key_down):
+        if not is_key_down:
+            return MACRO if self._macro_triggers.release(keycode) else PASS
+        if self._macro_triggers.press(keycode):
+            self._macro_scheduler.play(self._macros[action - MACRO])
+        return MACRO
+
+    # Returns the name of the first profile matching the focused app, or None.
+    def _match_profile(self, app_id, title):
+        for profile in self._profiles:
+            if profile.matches(app_id, title):
+                return profile.name
+        return None
 
-            for passthrough_hotkey_string in config.get('passthrough_hotkeys', []):
-                passthrough_hotkey = keyboard.HotKey.parse(passthrough_hotkey_string)
-                self._passthrough_hotkeys.add(self._pack_hotkey_set_to_tuple(passthrough_hotkey))
+    # Input state for a window tracker state. Keys are handled in a full screen Moonlight and
+    # in any other app a profile matches, the mouse is only clipped to Moonlight.
+    def _input_state_for_window(self, state, margins=NO_MARGINS):
+        profile = self._match_profile(state.app_id, state.title)
+        if state.pid is None and profile is not None:
+            return InputState(True, clipping=False, profile=profile)
+        return InputState.from_bounds(state.enabled, state.bounds, margins, profile)
 
-            logger.debug('remap_keys: {}'.format(self._remap_keys))
-            logger.debug('passthrough_hotkeys: {}'.format(self._passthrough_hotkeys))
+    # Publishes the state of the Moonlight window to the hooks, wherever they run.
+    def _publish_input_state(self, input_state):
+        profile_changed = input_state.profile != self._input_state.profile
+        # Keymap first, the hooks check the state before they use the keymap.
+        self._keymap = self._profile_keymaps.get(input_state.profile, self._default_keymap)
+        self._input_state = input_state
+        if profile_changed and not self._hook_only:
+            logger.info('Switched to the %s keymap profile.', input_state.profile or 'default')
+        if self._hook_process is not None:
+            self._hook_process.send_input_state(input_state)
+        elif not input_state.enabled or profile_changed:
+            # Keys injected for the old keymap would be released through the new one.
+            self._release_injected_keys()
+
+    # Starts the hooks, in a hook process if the config asks for it.
+    def _launch_hooks(self):
+        if not self._use_hook_process:
+            self._start_hooks()
+            return
+        hook_process = HookProcess(type(self), self._log_file_path, ['moonlight-desktop-hooks', self._config_filename])
+        hook_process.send_config(self._compiled_config)
+        hook_process.send_input_state(self._input_state)
+        hook_process.start()
+        self._hook_process = hook_process
+
+    def _shutdown_hooks(self):
+        hook_process, self._hook_process = self._hook_process, None
+        if hook_process is not None:
+            hook_process.stop()
+        else:
+            self._stop_hooks()
+
+    # Body of the hook process: applies what the UI process sends until it says stop or goes away.
+    def run_hooks(self, conn):
+        self._hook_only = True
+        self._start_workers()
+        hooks_started = False
+        try:
+            while True:
+                try:
+                    kind, payload = conn.recv()
+                except EOFError:
+                    break
+                if kind == MSG_CONFIG:
+                    self._apply_compiled_config(CompiledConfig.from_dict(payload))
+                    if not hooks_started:
+                        self._start_config_workers()
+                        self._start_hooks()
+                        hooks_started = True
+                elif kind == MSG_INPUT_STATE:
+                    self._publish_input_state(InputState(*payload))
+                elif kind == MSG_RELEASE_KEYS:
+                    self._release_injected_keys()
+                elif kind == MSG_RELEASE_ALL_KEYS:
+                    self._release_all_injected_keycodes()
+                elif kind == MSG_GET_STATS:
+                    conn.send((payload, self._get_stats()))
+                elif kind == MSG_STOP:
+                    break
+        finally:
+            if hooks_started:
+                self._stop_hooks()
+            self._stop_workers()
+        return 0
+
+    def compile_config(self):
+        cache_path = get_cache_path(self._config_filename)
+        self._compile_config(use_cache=False)
+        if cache_path is None:
+            logger.info('Compiled %s, the cache is unavailable.', self._config_filename)
+        else:
+            logger.info('Compiled %s to %s.', self._config_filename, cache_path)
+        return 0
+
+    def _create_base_injector(self):
+        from pynput import keyboard
+        return ControllerInjector(keyboard.Controller(), keyboard.KeyCode.from_vk)
+
+    # Every keycode the hooks may inject with the current config.
+    def _get_injected_keycodes(self):
+        keycodes = set(self._remap_keys.values())
+        keycodes.update(keycode for _, keycode in self._passthrough_hotkeys)
+        for profile in self._profiles:
+            keycodes.update(profile.remap_keys.values())
+            keycodes.update(keycode for _, keycode in profile.passthrough_hotkeys)
+        for macro in self._macros:
+            keycodes.update(macro.keycodes())
+        keycodes.update(self._get_modifier_keycodes())
+        return keycodes
+
+    # Returns the keycode of a single key in the config.
+    def _parse_key(self, key_name):
+        from pynput.keyboard import KeyCode
+        key = parse_single_key(key_name)
+        if isinstance(key, KeyCode):
+            keycode = key.vk if key.vk is not None else self._char_to_keycode(key.char)
+            if keycode is None:
+                raise RuntimeError('Faild to translate key to physical key code: {}'.format(key_name))
+            return keycode
+        return key
+
+    def _get_keyboard_layout_id(self):
+        return ''
+
+    def _load_platform_config(self, config):
+        pass
+
+    # Returns the hotkey_trie rule of a hotkey in the config.
+    def _parse_hotkey(self, hotkey_string):
+        return parse_hotkey(hotkey_string, self._parse_key, self._get_modifier_keycodes())
+
+    def _get_modifier_keycodes(self):
+        from pynput.keyboard import Key
+        modifier_keycodes = {}
+        for keys, mod in (((Key.ctrl, Key.ctrl_l, Key.ctrl_r), MOD_CTRL),
+                          ((Key.alt, Key.alt_l, Key.alt_r), MOD_ALT),
+                          ((Key.cmd, Key.cmd_l, Key.cmd_r), MOD_CMD),
+                          ((Key.shift, Key.shift_l, Key.shift_r), MOD_SHIFT)):
+            for key in keys:
+                modifier_keycodes[key.value.vk] = mod
+        return modifier_keycodes
+
+    def _get_stats(self):
+        if self._hook_process is not None:
+            # The counters live in the hook process.
+            stats = self._hook_process.get_stats() or {}
+            stats['hook_process'] = {'alive': self._hook_process.is_alive(), 'restarts': self._hook_process.restarts}
+            return stats
+        stats = self._stats.to_dict()
+        if isinstance(self._latency_probe, ProbeClient):
+            stats['latency_probe'] = self._latency_probe.to_dict()
+        if self._macros:
+            stats['macros'] = self._macro_scheduler.to_dict()
+        if isinstance(self._injector, QueuedInjector):
+            stats['injection_queue'] = {
+                'sent': self._injector.sent,
+                'dropped': self._injector.dropped,
+                'overflowed': self._injector.overflowed,
+                'overflows': self._injector.overflows,
+            }
+        return stats
+
+    def _open_stats(self):
+        self._stats_dumper.dump()
+        self._open_file_with_associated_app(self._stats_dumper.file_path)
+
+    # Copies the ring the hooks record into, which may live in the hook process, to a file of its own.
+    def _save_trace(self):
+        file_path = path.join(gettempdir(), 'moonlight-desktop-trace-{}.bin'.format(strftime('%Y%m%d-%H%M%S')))
+        try:
+            save_trace(file_path)
+        except (OSError, RuntimeError):
+            logger.exception('Failed to save the trace.')
+            return
+        logger.info('Saved the trace to %s.', file_path)
+        self._open_file_with_associated_app(gettempdir())
+
+    # Measures the key latency from the client aide to the server aide, see latency_probe.
+    # It runs where the hooks run.
+    def _start_latency_probe(self, probe_config):
+        role = probe_config.get('role')
+        port = probe_config.get('port', DEFAULT_PORT)
+        marker_keycode = self._parse_key(probe_config.get('marker_key', '<f20>'))
+        if role == 'server':
+            self._latency_probe = ProbeServer(port, probe_config.get('bind', '127.0.0.1'), probe_config.get('client'))
+            self._probe_marker_keycode = marker_keycode
+        else:
+            # Sends through the current injector, a reload may replace it.
+            self._latency_probe = ProbeClient(lambda batch: self._injector.send(batch), marker_keycode,
+                                              (probe_config['server'], port), rate=probe_config.get('rate', 5),
+                                              is_active=lambda: self._input_state.enabled)
+        self._latency_probe.start()
+        logger.info('Started the latency probe %s on port %d.', role, port)
+
+    # Raises at compile time, a bad probe config would otherwise only fail when the workers start.
+    def _check_latency_probe_config(self, probe_config):
+        if not probe_config:
+            return
+        role = probe_config.get('role')
+        if role not in ('client', 'server'):
+            raise RuntimeError('Invalid latency probe role: {}'.format(role))
+        if role == 'client' and not probe_config.get('server'):
+            raise RuntimeError('The latency probe client needs the server address.')
+
+    def _stop_latency_probe(self):
+        latency_probe, self._latency_probe = self._latency_probe, None
+        if latency_probe is not None:
+            self._probe_marker_keycode = -1
+            latency_probe.stop()
+            if isinstance(latency_probe, ProbeClient):
+                logger.info(latency_probe.format_report())
+
+    def _start_workers(self):
+        self._workers_started = True
+        self._injector.start()
+        if not self._hook_only:
+            self._stats_dumper.start()
+        if self._config_watcher is not None:
+            self._config_watcher.start()
+        hooks_run_here = self._hook_only or not self._use_hook_process
+        # The hook process gets its config after its workers started, see run_hooks.
+        if hooks_run_here and not self._hook_only:
+            self._start_config_workers()
+        if hooks_run_here:
+            self._macro_scheduler.start()
+
+    # Starts the workers of the hooks that are set up by the config, once there is one.
+    def _start_config_workers(self):
+        probe_config = self._compiled_config.options.get('latency_probe')
+        if probe_config:
+            self._start_latency_probe(probe_config)
+        if self._compiled_config.options.get('trace_events', True):
+            self._trace = TraceRecorder(get_trace_path())
+
+    def _stop_workers(self):
+        self._stop_latency_probe()
+        self._macro_scheduler.stop()
+        # Not closed, a hook callback may still be recording. The ring goes with its last reference.
+        self._trace = NullTraceRecorder()
+        self._workers_started = False
+        if self._config_watcher is not None:
+            self._config_watcher.stop()
+        self._stats_dumper.stop()
+        self._supervisor_loop.stop()
+        self._injector.stop()
 
     def start(self):
         raise NotImplementedError()
 
     def stop(self):
         raise NotImplementedError()
+
+    # Starts and stops the input hooks in this process.
+    def _start_hooks(self):
+        raise NotImplementedError()
+
+    def _stop_hooks(self):
+        raise NotImplementedError()
     
     def _char_to_keycode(self, char):
         raise NotImplementedError()
 
     def _open_file_with_associated_app(self, path):
         raise NotImplementedError()
-
-    def _pack_hotkey_set_to_tuple(self, hotkey_set):
-        is_ctrl_down = False
-        is_alt_down = False
-        is_cmd_down = False
-        is_shift_down = False
-        main_key = None
-
-        for key in hotkey_set:
-            if key == Key.ctrl: is_ctrl_down = True
-            elif key == Key.alt: is_alt_down = True
-            elif key == Key.cmd: is_cmd_down = True
-            elif key == Key.shift: is_shift_down = True
-            else:
-                if main_key is not None: raise RuntimeError('Only one modifier key in hotkey is allowed: {}'.format(hotkey_set))
-                main_key = key
-
-        if main_key is None:
-            raise RuntimeError('Cannot find a non modifier key in hotkey: {}'.format(hotkey_set))
-        
-        if isinstance(main_key, Key):
-            main_keycode = main_key.value.vk
-
-        if isinstance(main_key, KeyCode):
-            if main_key.vk is not None:
-                main_keycode = main_key.vk
-            else:
-                main_keycode = self._char_to_keycode(main_key.char)
-
-        if main_keycode is None:
-            raise RuntimeError('Faild to translate non modifier key to physical key code: {}'.format(main_key))
-
-        return (is_ctrl_down, is_alt_down, is_cmd_down, is_shift_down, main_keycode)
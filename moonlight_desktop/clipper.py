@@ -0,0 +1,145 @@
+from threading import Thread, Event
+from time import monotonic
+
+# Clip policies.
+# hard: clip the event and warp the cursor back whenever it leaves the clip rectangle.
+# soft: clip the event, but only warp once the cursor is more than soft_margin past the rectangle.
+CLIP_HARD = 'hard'
+CLIP_SOFT = 'soft'
+
+# Clip verdicts.
+CLIP_NONE = 0
+CLIP_MOVE = 1
+CLIP_WARP = 2
+
+class ClipConfig:
+    def __init__(self, mode=CLIP_HARD, margin_left=0, margin_right=0, margin_top=0, margin_bottom=0,
+                 soft_margin=0, max_warp_rate=60):
+        if mode not in (CLIP_HARD, CLIP_SOFT):
+            raise RuntimeError('Invalid mouse clip mode: {}'.format(mode))
+        self.mode = mode
+        self.margins = (margin_left, margin_right, margin_top, margin_bottom)
+        self.soft_margin = soft_margin
+        # At most one warp per display frame.
+        self.warp_interval = 1.0 / max_warp_rate if max_warp_rate > 0 else 0
+
+    # Parses the mouse_clip section of the config, e.g.
+    #   mouse_clip:
+    #     mode: soft
+    #     margins: {left: 50, right: 50, top: 0, bottom: 0}
+    #     soft_margin: 20
+    #     max_warp_rate: 60
+    @staticmethod
+    def from_config(config, default_x_margin=0):
+        margins = config.get('margins', {})
+        return ClipConfig(
+            mode=config.get('mode', CLIP_HARD),
+            margin_left=margins.get('left', default_x_margin),
+            margin_right=margins.get('right', default_x_margin),
+            margin_top=margins.get('top', 0),
+            margin_bottom=margins.get('bottom', 0),
+            soft_margin=config.get('soft_margin', 0),
+            max_warp_rate=config.get('max_warp_rate', 60))
+
+# Returns (min_x, max_x, min_y, max_y) of a window bounds dict extended by the margins.
+# The top edge is always the screen top, since the window is full screen.
+def clip_rect(bounds, margins):
+    margin_left, margin_right, margin_top, margin_bottom = margins
+    min_x = bounds['X'] - margin_left
+    max_x = bounds['X'] + bounds['Width'] + margin_right
+    min_y = min(0, bounds['Y'] - margin_top)
+    max_y = bounds['Y'] + bounds['Height'] + margin_bottom
+    return (min_x, max_x, min_y, max_y)
+
+# Clips mouse positions against the rectangle of an InputState. Only called from the
+# mouse hook thread. The clipped position is left in x and y to avoid allocating a tuple.
+class MouseClipper:
+    def __init__(self, config=None, clock=monotonic):
+        self.config = config or ClipConfig()
+        self._is_soft = self.config.mode == CLIP_SOFT
+        self._soft_margin = self.config.soft_margin
+        self._warp_interval = self.config.warp_interval
+        self._clock = clock
+        self._last_warp_time = None
+
+        self.x = 0
+        self.y = 0
+        # Set while the cursor is left outside after a coalesced warp.
+        self.pending_warp = False
+        self.coalesced_warps = 0
+        # Only incremented by the trailing warp thread, Stats.warps only by the mouse hook thread.
+        self.trailing_warps = 0
+
+    def clip(self, state, x, y):
+        clipped_x = state.min_x if x < state.min_x else state.max_x if x > state.max_x else x
+        clipped_y = state.min_y if y < state.min_y else state.max_y if y > state.max_y else y
+        if clipped_x == x and clipped_y == y:
+            self.pending_warp = False
+            return CLIP_NONE
+
+        self.x = clipped_x
+        self.y = clipped_y
+        if self._is_soft and abs(x - clipped_x) <= self._soft_margin and abs(y - clipped_y) <= self._soft_margin:
+            self.pending_warp = False
+            return CLIP_MOVE
+
+        # Coalesce warps of a fast flick. The event itself is still clipped, and the next
+        # move event after the interval, or the trailing warp if none comes, warps the cursor back.
+        now = self._clock()
+        if self._last_warp_time is not None and now - self._last_warp_time < self._warp_interval:
+            self.coalesced_warps += 1
+            self.pending_warp = True
+            return CLIP_MOVE
+        self._last_warp_time = now
+        self.pending_warp = False
+        return CLIP_WARP
+
+    # The trailing warp of a flick which stopped within the coalescing interval. Returns None
+    # if there is none, the seconds until it is due, or 0 if the cursor is to be warped to
+    # (x, y) now, in which case it counts as the last warp.
+    def take_trailing_warp(self):
+        if not self.pending_warp:
+            return None
+        now = self._clock()
+        remaining = self._last_warp_time + self._warp_interval - now
+        if remaining > 0:
+            return remaining
+        self.pending_warp = False
+        self._last_warp_time = now
+        return 0
+
+# Runs trailing warps off the mouse hook, which only sets an event with arm().
+# warp() returns like MouseClipper.take_trailing_warp() and warps on 0.
+class TrailingWarpTimer:
+    def __init__(self, warp):
+        self._warp = warp
+        self._armed = Event()
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._armed.set()
+        if self._thread is not None:
+            self._thread.join(1)
+            self._thread = None
+
+    def arm(self):
+        self._armed.set()
+
+    def _run(self):
+        while True:
+            self._armed.wait()
+            self._armed.clear()
+            while not self._stopped.is_set():
+                delay = self._warp()
+                if not delay:
+                    break
+                self._stopped.wait(delay)
+            if self._stopped.is_set():
+                return
@@ -0,0 +1,176 @@
+from hashlib import sha256
+from os import replace, path
+from tempfile import gettempdir
+from time import monotonic
+import os
+import json
+import logging
+import sys
+
+from .keymap import Keymap
+from .macro import Macro, macro_triggers
+
+logger = logging.getLogger('moonlight-desktop')
+
+# Bump whenever the compiled format or the key resolution changes.
+CACHE_VERSION = 6
+
+# Keymap of the apps matching bundle_id and window_title, None matches anything.
+# The bundle ID (the window class on Linux) must be equal, the title only contain window_title.
+class Profile:
+    def __init__(self, name, bundle_id, window_title, remap_keys, passthrough_hotkeys):
+        self.name = name
+        self.bundle_id = bundle_id
+        self.window_title = window_title
+        self.remap_keys = remap_keys
+        self.passthrough_hotkeys = passthrough_hotkeys
+
+    def matches(self, app_id, title):
+        if self.bundle_id is not None and app_id != self.bundle_id:
+            return False
+        return self.window_title is None or (title is not None and self.window_title in title)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'bundle_id': self.bundle_id,
+            'window_title': self.window_title,
+            'remap_keys': sorted(self.remap_keys.items()),
+            'passthrough_hotkeys': sorted(self.passthrough_hotkeys),
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return Profile(
+            data['name'], data['bundle_id'], data['window_title'],
+            {from_key: to_key for from_key, to_key in data['remap_keys']},
+            {tuple(hotkey) for hotkey in data['passthrough_hotkeys']})
+
+# Resolved keymap of a config file. Only holds plain ints, so it can be cached as JSON
+# and loaded without yaml or pynput.
+class CompiledConfig:
+    def __init__(self, remap_keys, passthrough_hotkeys, options, profiles=(), macros=(), modifier_keys=None):
+        self.remap_keys = remap_keys
+        # Single key hotkeys as (modifier mask, keycode).
+        self.passthrough_hotkeys = passthrough_hotkeys
+        # The raw config, for the non key settings.
+        self.options = options
+        # In config order, the first match wins.
+        self.profiles = list(profiles)
+        # Compiled macro.Macro, the keymap actions index them.
+        self.macros = list(macros)
+        # {keycode: MOD_*} of the modifier keys of the platform it was compiled for.
+        self.modifier_keys = modifier_keys or {}
+
+    # Returns the default keymap and {profile name: keymap}, the hooks swap between them.
+    def create_keymaps(self, clock=monotonic):
+        sequence_timeout = self.options.get('hotkey_sequence_timeout', 1.0)
+        # The macros trigger in every profile.
+        macro_hotkeys, macro_sequences = macro_triggers(self.macros)
+        default_keymap = Keymap(self.remap_keys, self.passthrough_hotkeys, self.modifier_keys, sequence_timeout,
+                                macro_hotkeys, macro_sequences, clock=clock)
+        profile_keymaps = {profile.name: Keymap(profile.remap_keys, profile.passthrough_hotkeys, self.modifier_keys,
+                                                sequence_timeout, macro_hotkeys, macro_sequences, index + 1, clock)
+                           for index, profile in enumerate(self.profiles)}
+        return default_keymap, profile_keymaps
+
+    def to_dict(self):
+        return {
+            'remap_keys': sorted(self.remap_keys.items()),
+            'passthrough_hotkeys': sorted(self.passthrough_hotkeys),
+            'options': self.options,
+            'profiles': [profile.to_dict() for profile in self.profiles],
+            'macros': [macro.to_dict() for macro in self.macros],
+            'modifier_keys': sorted(self.modifier_keys.items()),
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return CompiledConfig(
+            {from_key: to_key for from_key, to_key in data['remap_keys']},
+            {tuple(hotkey) for hotkey in data['passthrough_hotkeys']},
+            data['options'],
+            [Profile.from_dict(profile) for profile in data['profiles']],
+            [Macro.from_dict(macro) for macro in data['macros']],
+            {keycode: mod for keycode, mod in data['modifier_keys']})
+
+def get_cache_key(config_data, keyboard_layout_id, platform):
+    digest = sha256(config_data)
+    digest.update('\0{}\0{}\0{}'.format(CACHE_VERSION, keyboard_layout_id, platform).encode('utf-8'))
+    return digest.hexdigest()
+
+# A directory only the current user can write to. The cache is loaded without re-checking
+# the keymap, so it must not sit under a name any local user can plant in the shared temp dir.
+# None if it can't be created, the config is compiled every time then.
+def get_cache_dir():
+    if not hasattr(os, 'getuid'):
+        # The Windows temp dir is already per user.
+        cache_root = os.environ.get('LOCALAPPDATA') or gettempdir()
+    elif os.environ.get('XDG_CACHE_HOME'):
+        cache_root = os.environ['XDG_CACHE_HOME']
+    elif sys.platform == 'darwin':
+        cache_root = path.join(path.expanduser('~'), 'Library', 'Caches')
+    else:
+        cache_root = path.join(path.expanduser('~'), '.cache')
+    cache_dir = path.join(cache_root, 'moonlight-desktop')
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    except OSError:
+        logger.warning('Not caching the compiled config, failed to create %s.', cache_dir, exc_info=True)
+        return None
+    return cache_dir
+
+def get_cache_path(config_filename):
+    cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return None
+    name = sha256(path.abspath(config_filename).encode('utf-8')).hexdigest()[:16]
+    return path.join(cache_dir, 'config-{}.json'.format(name))
+
+# Whether the file is owned by the current user and nobody else can write to it.
+def _is_private(file_descriptor):
+    if not hasattr(os, 'getuid'):
+        return True
+    stat = os.fstat(file_descriptor)
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+# A None key loads whatever is cached, for tools reading the cache offline. A None
+# cache_path caches nothing.
+class ConfigCache:
+    def __init__(self, cache_path, key):
+        self.cache_path = cache_path
+        self._key = key
+
+    def load(self):
+        if self.cache_path is None:
+            return None
+        try:
+            with open(self.cache_path, 'r') as cache_file:
+                if not _is_private(cache_file.fileno()):
+                    logger.warning('Ignoring config cache %s, it is writable by another user.', self.cache_path)
+                    return None
+                data = json.load(cache_file)
+            if self._key is not None and data.get('key') != self._key:
+                return None
+            return CompiledConfig.from_dict(data['config'])
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning('Ignoring invalid config cache %s.', self.cache_path, exc_info=True)
+            return None
+
+    # Returns whether it was written.
+    def save(self, compiled_config):
+        if self.cache_path is None:
+            return False
+        temp_path = self.cache_path + '.tmp'
+        try:
+            if path.exists(temp_path):
+                os.remove(temp_path)
+            with os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as cache_file:
+                json.dump({'key': self._key, 'config': compiled_config.to_dict()}, cache_file, separators=(',', ':'))
+            replace(temp_path, self.cache_path)
+        except Exception:
+            logger.warning('Failed to write config cache %s.', self.cache_path, exc_info=True)
+            return False
+        return True
@@ -0,0 +1,118 @@
+from threading import Thread, Event, current_thread
+from select import select
+from sys import platform
+import logging
+import os
+import struct
+
+logger = logging.getLogger('moonlight-desktop')
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# Calls on_change from a background thread after the config file was written.
+# Uses inotify on Linux, and polls the file stat elsewhere or if inotify is unavailable.
+class ConfigWatcher:
+    def __init__(self, file_path, on_change, poll_interval=1.0, debounce=0.1):
+        self._file_path = os.path.abspath(file_path)
+        self._on_change = on_change
+        self._poll_interval = poll_interval
+        self._debounce = debounce
+        self._stopped = Event()
+        self._thread = None
+        self._wakeup_pipe = None
+
+    def start(self):
+        # A thread of its own, a watcher stopped from on_change may still be on its way out.
+        stopped = self._stopped = Event()
+        inotify_fd = self._init_inotify() if platform.startswith('linux') else None
+        if inotify_fd is not None:
+            wakeup_pipe = self._wakeup_pipe = os.pipe()
+            target = lambda: self._run_inotify(inotify_fd, wakeup_pipe)
+        else:
+            target = lambda: self._run_polling(stopped)
+        self._thread = Thread(target=target, daemon=True)
+        self._thread.start()
+
+    # May be called from on_change, e.g. by a reload turning watch_config off. The watcher
+    # thread is then only told to exit, it can't join itself.
+    def stop(self):
+        self._stopped.set()
+        if self._wakeup_pipe is not None:
+            os.write(self._wakeup_pipe[1], b'\0')
+            self._wakeup_pipe = None
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not current_thread():
+            thread.join(1)
+
+    def _notify(self):
+        try:
+            self._on_change()
+        except Exception:
+            logger.exception('Failed to handle the config change.')
+
+    def _init_inotify(self):
+        import ctypes
+        import ctypes.util
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            inotify_fd = libc.inotify_init1(IN_CLOEXEC)
+            if inotify_fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+            # Watch the directory, editors often replace the file instead of writing it.
+            directory = os.path.dirname(self._file_path).encode('utf-8')
+            if libc.inotify_add_watch(inotify_fd, directory, IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY) < 0:
+                os.close(inotify_fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+            return inotify_fd
+        except Exception:
+            logger.exception('Failed to set up inotify, falling back to polling.')
+            return None
+
+    def _run_inotify(self, inotify_fd, wakeup_pipe):
+        file_name = os.path.basename(self._file_path).encode('utf-8')
+        wakeup_fd = wakeup_pipe[0]
+        try:
+            changed = False
+            # Only exits on the wakeup byte, so stop() never writes to a closed pipe.
+            while True:
+                # Wait for the writes to settle before notifying.
+                readable, _, _ = select([inotify_fd, wakeup_fd], [], [], self._debounce if changed else None)
+                if wakeup_fd in readable:
+                    break
+                if not readable:
+                    changed = False
+                    self._notify()
+                    continue
+                buffer = os.read(inotify_fd, 4096)
+                offset = 0
+                while offset < len(buffer):
+                    _, _, _, name_length = INOTIFY_EVENT.unpack_from(buffer, offset)
+                    offset += INOTIFY_EVENT.size
+                    name = buffer[offset:offset + name_length].rstrip(b'\0')
+                    offset += name_length
+                    if name == file_name:
+                        changed = True
+        finally:
+            os.close(inotify_fd)
+            os.close(wakeup_pipe[0])
+            os.close(wakeup_pipe[1])
+
+    def _get_stat(self):
+        try:
+            stat = os.stat(self._file_path)
+            return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except OSError:
+            return None
+
+    def _run_polling(self, stopped):
+        last_stat = self._get_stat()
+        while not stopped.wait(self._poll_interval):
+            stat = self._get_stat()
+            if stat is not None and stat != last_stat:
+                last_stat = stat
+                self._notify()
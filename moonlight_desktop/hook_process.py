@@ -0,0 +1,155 @@
+from multiprocessing import get_context
+from threading import Thread, Lock, Event
+from time import monotonic
+import logging
+
+logger = logging.getLogger('moonlight-desktop')
+
+# Messages to the hook process, (kind, payload) tuples of plain data so they pickle cheaply.
+MSG_CONFIG = 'config'
+MSG_INPUT_STATE = 'input_state'
+MSG_RELEASE_KEYS = 'release_keys'
+# The payload is a request id, the reply (request id, stats).
+MSG_GET_STATS = 'get_stats'
+# Sent to a restarted hook process: release every key the config injects, its predecessor
+# may have died holding some.
+MSG_RELEASE_ALL_KEYS = 'release_all_keys'
+MSG_STOP = 'stop'
+
+# Entry point of the hook process.
+def run_hook_process(app_class, log_file_path, argv, is_debug, conn):
+    from . import setup_logger
+    setup_logger(log_file_path, is_debug)
+    try:
+        app_class(log_file_path, argv).run_hooks(conn)
+    except Exception:
+        logger.exception('The hook process failed.')
+        raise
+
+# Runs the input hooks of app_class in a child process, so nothing the UI process does
+# holds the GIL while a hook callback waits. The UI process feeds it the compiled config
+# and the window state, and restarts it if it dies, replaying the last of both.
+class HookProcess:
+    def __init__(self, app_class, log_file_path, argv, restart_delay=1.0, max_restarts=10):
+        self._app_class = app_class
+        self._log_file_path = log_file_path
+        self._argv = argv
+        self._restart_delay = restart_delay
+        self._max_restarts = max_restarts
+        self._context = get_context('spawn')
+        # Guards _conn and the sends on it.
+        self._lock = Lock()
+        # Held while waiting for a stats reply, so the sends don't wait with it. Taken before _lock.
+        self._reply_lock = Lock()
+        self._process = None
+        self._conn = None
+        self._thread = None
+        self._stopping = Event()
+        self._config = None
+        self._input_state = None
+        self._request_id = 0
+        self.restarts = 0
+
+    def start(self):
+        self._stopping.clear()
+        self._spawn()
+        self._thread = Thread(target=self._monitor, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._send((MSG_STOP, None))
+        process = self._process
+        if process is not None:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        if self._thread is not None:
+            self._thread.join(1)
+            self._thread = None
+
+    def is_alive(self):
+        process = self._process
+        return process is not None and process.is_alive()
+
+    def send_config(self, compiled_config):
+        self._config = compiled_config.to_dict()
+        self._send((MSG_CONFIG, self._config))
+
+    def send_input_state(self, input_state):
+        self._input_state = input_state.to_tuple()
+        self._send((MSG_INPUT_STATE, self._input_state))
+
+    def release_keys(self):
+        self._send((MSG_RELEASE_KEYS, None))
+
+    # Returns the stats of the hook process, or None if it doesn't answer in time. The replies
+    # of requests which timed out are still in the pipe, they are skipped by their id.
+    def get_stats(self, timeout=1.0):
+        with self._reply_lock:
+            with self._lock:
+                conn = self._conn
+                if conn is None:
+                    return None
+                self._request_id += 1
+                request_id = self._request_id
+                try:
+                    conn.send((MSG_GET_STATS, request_id))
+                except OSError:
+                    return None
+            deadline = monotonic() + timeout
+            try:
+                while conn.poll(max(deadline - monotonic(), 0)):
+                    reply_id, stats = conn.recv()
+                    if reply_id == request_id:
+                        return stats
+                return None
+            except (OSError, EOFError):
+                return None
+
+    def _send(self, message):
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                self._conn.send(message)
+            except OSError:
+                # The monitor restarts the process and replays the state.
+                logger.warning('The hook process is gone, dropping %s.', message[0])
+
+    def _spawn(self, restarted=False):
+        conn, child_conn = self._context.Pipe()
+        is_debug = logger.isEnabledFor(logging.DEBUG)
+        process = self._context.Process(target=run_hook_process, name='moonlight-desktop-hooks', daemon=True,
+                                        args=(self._app_class, self._log_file_path, self._argv, is_debug, child_conn))
+        process.start()
+        child_conn.close()
+        with self._lock:
+            self._process = process
+            self._conn = conn
+            if self._config is not None:
+                conn.send((MSG_CONFIG, self._config))
+            if self._input_state is not None:
+                conn.send((MSG_INPUT_STATE, self._input_state))
+            if restarted:
+                conn.send((MSG_RELEASE_ALL_KEYS, None))
+        logger.info('Started the hook process %d.', process.pid)
+
+    def _monitor(self):
+        while True:
+            process = self._process
+            process.join()
+            # Not while get_stats() polls it.
+            with self._reply_lock, self._lock:
+                self._conn.close()
+                self._conn = None
+            if self._stopping.is_set():
+                return
+            logger.error('The hook process exited with code %s.', process.exitcode)
+            if self.restarts >= self._max_restarts:
+                logger.error('The hook process died %d times, not restarting it.', self.restarts)
+                return
+            self.restarts += 1
+            if self._stopping.wait(self._restart_delay):
+                return
+            self._spawn(restarted=True)
@@ -0,0 +1,197 @@
+# Compiles hotkey rules into a state machine the key hook advances with one dict lookup
+# per event, however many rules there are. Steps are separated by spaces, keys of a step
+# by '+':
+#   <ctrl>+<alt>+q     a hotkey
+#   <ctrl>+a+s         a chord, a and s held down together, in any order
+#   <ctrl>+b c         a leader sequence, ctrl+b then c within the timeout
+#   <ctrl>+<18..23>    a keycode range, any keycode from 18 to 23
+# Key names are resolved by the caller, so this stays pure Python like the keymap.
+from itertools import permutations, product
+from time import monotonic
+
+NO_MATCH = 0
+
+KEYCODE_BITS = 8
+KEYCODE_COUNT = 1 << KEYCODE_BITS
+MODS_BITS = 4
+STATE_SHIFT = KEYCODE_BITS + MODS_BITS
+
+MAX_CHORD_KEYS = 4
+# Chords, ranges and steps multiply into concrete key paths, keep a typo from blowing up the trie.
+MAX_PATHS_PER_RULE = 4096
+
+def _parse_range(token):
+    if len(token) > 2 and token[0] == '<' and token[-1] == '>' and '..' in token:
+        first, last = token[1:-1].split('..', 1)
+        first, last = int(first), int(last)
+        if first < 0 or last >= KEYCODE_COUNT or first > last:
+            raise RuntimeError('Invalid key code range: {}'.format(token))
+        return tuple(range(first, last + 1))
+    return None
+
+# Parses a hotkey string into a rule, a tuple of steps. A step is (modifier mask, keysets),
+# a keyset the alternative keycodes of one key of the step.
+# resolve_key: returns the keycode of a key name.
+# modifier_keys: {keycode: MOD_*} of the modifier keys.
+def parse_hotkey(hotkey_string, resolve_key, modifier_keys):
+    steps = []
+    for step_string in hotkey_string.split():
+        mods = 0
+        keysets = []
+        for token in step_string.split('+'):
+            if not token:
+                raise RuntimeError('Empty key in hotkey: {}'.format(hotkey_string))
+            keyset = _parse_range(token)
+            if keyset is None:
+                keycode = resolve_key(token)
+                modifier = modifier_keys.get(keycode, 0)
+                if modifier:
+                    mods |= modifier
+                    continue
+                keyset = (keycode,)
+            keysets.append(keyset)
+        if not keysets:
+            raise RuntimeError('Cannot find a non modifier key in hotkey: {}'.format(hotkey_string))
+        if len(keysets) > MAX_CHORD_KEYS:
+            raise RuntimeError('Only {} keys in a chord are allowed: {}'.format(MAX_CHORD_KEYS, hotkey_string))
+        steps.append((mods, tuple(keysets)))
+    if not steps:
+        raise RuntimeError('Empty hotkey: {}'.format(hotkey_string))
+    return tuple(steps)
+
+def is_single_key(rule):
+    return len(rule) == 1 and len(rule[0][1]) == 1
+
+# Splits rules into the (modifier mask, keycode) pairs of the single key ones, which fit the
+# flat keymap table, and the rules which need the state machine.
+def split_hotkeys(rules):
+    hotkeys = set()
+    sequences = []
+    for rule in rules:
+        if is_single_key(rule):
+            mods, (keyset,) = rule[0]
+            hotkeys.update((mods, keycode) for keycode in keyset)
+        else:
+            sequences.append(rule)
+    return hotkeys, sequences
+
+# Concrete paths of a rule: lists of (mods, keycode, in_chord), in_chord being set on the
+# keys after which the step still waits for more held keys.
+def _rule_paths(rule):
+    step_paths = []
+    for mods, keysets in rule:
+        paths = []
+        for ordered_keysets in permutations(keysets):
+            for keycodes in product(*ordered_keysets):
+                paths.append([(mods, keycode, index < len(keycodes) - 1) for index, keycode in enumerate(keycodes)])
+        step_paths.append(paths)
+    count = 1
+    for paths in step_paths:
+        count *= len(paths)
+    if count > MAX_PATHS_PER_RULE:
+        raise RuntimeError('Hotkey expands to {} key paths, more than {}: {}'.format(count, MAX_PATHS_PER_RULE, rule))
+    for steps in product(*step_paths):
+        yield [key for step in steps for key in step]
+
+# The compiled rules and the match in progress. A node is an int, its transitions are keyed
+# by node << STATE_SHIFT | mods << KEYCODE_BITS | keycode in a single dict. Only advanced
+# from the key hook thread.
+class HotkeyMatcher:
+    # rules: iterable of (rule, action), action being anything but NO_MATCH.
+    def __init__(self, rules, timeout=1.0, clock=monotonic):
+        self._transitions = {}
+        self._actions = [NO_MATCH]
+        self._in_chord = [False]
+        self._has_children = [False]
+        self._timeout = timeout
+        self._clock = clock
+        for rule, action in rules:
+            for path in _rule_paths(rule):
+                self._add_path(path, action, rule)
+
+        self.matches = 0
+        self.reset()
+
+    @property
+    def node_count(self):
+        return len(self._actions)
+
+    def _add_path(self, path, action, rule):
+        node = 0
+        for mods, keycode, in_chord in path:
+            if not 0 <= keycode < KEYCODE_COUNT:
+                raise RuntimeError('Key code out of range: {}'.format(keycode))
+            if self._actions[node] != NO_MATCH:
+                raise RuntimeError('A hotkey is a prefix of another: {}'.format(rule))
+            key = node << STATE_SHIFT | mods << KEYCODE_BITS | keycode
+            next_node = self._transitions.get(key)
+            if next_node is None:
+                next_node = len(self._actions)
+                self._transitions[key] = next_node
+                self._actions.append(NO_MATCH)
+                self._in_chord.append(in_chord)
+                self._has_children.append(False)
+                self._has_children[node] = True
+            node = next_node
+        if self._has_children[node]:
+            raise RuntimeError('A hotkey is a prefix of another: {}'.format(rule))
+        if self._actions[node] not in (NO_MATCH, action):
+            raise RuntimeError('A hotkey has two actions: {}'.format(rule))
+        self._actions[node] = action
+
+    def reset(self):
+        self._node = 0
+        self._last_keycode = -1
+        self._last_time = 0
+        self._matched_keycode = -1
+        self._matched_mods = 0
+        self._matched_action = NO_MATCH
+
+    # Advances the machine with a key event, returns the action of the rule the key completes,
+    # NO_MATCH otherwise. The auto-repeat of the completing key with the same modifiers and its
+    # up get the action too.
+    def feed(self, mods, keycode, is_down):
+        if not is_down:
+            if keycode == self._matched_keycode:
+                self._matched_keycode = -1
+                return self._matched_action
+            # A chord key was let go before the chord was complete.
+            if self._in_chord[self._node]:
+                self._node = 0
+                self._last_keycode = -1
+            elif keycode == self._last_keycode:
+                # Pressed again it is a new key, not an auto-repeat.
+                self._last_keycode = -1
+            return NO_MATCH
+
+        if keycode == self._matched_keycode and mods == self._matched_mods:
+            return self._matched_action
+        if keycode >= KEYCODE_COUNT or keycode == self._last_keycode:
+            return NO_MATCH
+
+        node = self._node
+        now = self._clock()
+        if node and now - self._last_time > self._timeout:
+            node = 0
+        next_node = self._transitions.get(node << STATE_SHIFT | mods << KEYCODE_BITS | keycode)
+        if next_node is None and node:
+            # The key may start another rule.
+            next_node = self._transitions.get(mods << KEYCODE_BITS | keycode)
+        if next_node is None:
+            self._node = 0
+            self._last_keycode = -1
+            return NO_MATCH
+
+        action = self._actions[next_node]
+        if action != NO_MATCH:
+            self._node = 0
+            self._last_keycode = -1
+            self._matched_keycode = keycode
+            self._matched_mods = mods
+            self._matched_action = action
+            self.matches += 1
+            return action
+        self._node = next_node
+        self._last_keycode = keycode
+        self._last_time = now
+        return NO_MATCH
@@ -0,0 +1,132 @@
+from collections import deque
+from queue import Queue, Full, Empty
+from threading import Thread
+import logging
+
+logger = logging.getLogger('moonlight-desktop')
+
+# Injectors send batches of (keycode, is_down) pairs to the OS. A batch is one chord,
+# injectors submit it in one go where the OS allows, so the host never sees it half pressed.
+# prepare() is called with every keycode of the config at load time, so the per key
+# objects are built once instead of on every injection.
+
+class ControllerInjector:
+    def __init__(self, controller, key_factory):
+        self._controller = controller
+        self._key_factory = key_factory
+        self._keys = {}
+
+    def prepare(self, keycodes):
+        for keycode in keycodes:
+            self._get_key(keycode)
+
+    def _get_key(self, keycode):
+        key = self._keys.get(keycode)
+        if key is None:
+            key = self._keys[keycode] = self._key_factory(keycode)
+        return key
+
+    def send(self, batch):
+        touch = self._controller.touch
+        get_key = self._get_key
+        for keycode, is_down in batch:
+            touch(get_key(keycode), is_down)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+# Moves injection off the event tap thread onto a worker.
+# When the queue is full, press only batches are dropped. Batches releasing a key go
+# to an unbounded overflow queue, so the hook never waits and nothing is left stuck
+# down. Until the overflow queue is empty again, the main queue is skipped: presses are
+# dropped and releases overflow too. The worker drains the overflow after the main queue,
+# so batches are always injected in order.
+class QueuedInjector:
+    def __init__(self, injector, maxsize):
+        self._injector = injector
+        self.maxsize = maxsize
+        self._queue = Queue(maxsize)
+        # deque append() and popleft() are atomic, the hook and the worker share it without a lock.
+        self._overflow = deque()
+        self._thread = None
+        self._stopping = False
+        self._is_full = False
+
+        self.sent = 0
+        self.dropped = 0
+        self.overflowed = 0
+        self.overflows = 0
+
+    def prepare(self, keycodes):
+        self._injector.prepare(keycodes)
+
+    def send(self, batch):
+        if not self._overflow:
+            try:
+                self._queue.put_nowait(batch)
+                self._is_full = False
+                return
+            except Full:
+                pass
+        if not self._is_full:
+            self._is_full = True
+            self.overflows += 1
+        for _, is_down in batch:
+            if not is_down:
+                self.overflowed += 1
+                self._overflow.append(batch)
+                self._wake()
+                return
+        self.dropped += 1
+
+    # The worker may be waiting on an empty main queue while the overflow queue fills.
+    def _wake(self):
+        try:
+            self._queue.put_nowait(None)
+        except Full:
+            # The worker has a full queue to get through, it gets to the overflow after that.
+            pass
+
+    def start(self):
+        self._stopping = False
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping = True
+            self._wake()
+            self._thread.join(1)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            # Drain whatever piled up meanwhile and send it in one go.
+            batches = [batch]
+            try:
+                while True:
+                    batches.append(self._queue.get_nowait())
+            except Empty:
+                pass
+            for batch in batches:
+                if batch is not None:
+                    self._inject(batch)
+            # Only once the older batches of the main queue are out.
+            if self._queue.empty():
+                overflow = self._overflow
+                while overflow:
+                    self._inject(overflow.popleft())
+
+            if self._stopping and self._queue.empty():
+                return
+
+    def _inject(self, batch):
+        try:
+            self._injector.send(batch)
+            self.sent += 1
+        except Exception:
+            logger.exception('Failed to inject keys.')
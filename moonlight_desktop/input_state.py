@@ -0,0 +1,48 @@
+from itertools import count
+
+from .clipper import clip_rect
+
+NO_MARGINS = (0, 0, 0, 0)
+
+# Snapshot of everything the hook callbacks need to know about the Moonlight window.
+# The poller builds a new instance and publishes it with a single attribute assignment,
+# the hooks read the attribute once per event, so they never see a half updated state.
+# enabled turns the key handling on, clipping the mouse clipping. profile names the keymap
+# profile of the focused app, None for the default keymap.
+class InputState:
+    __slots__ = ('enabled', 'min_x', 'max_x', 'min_y', 'max_y', 'clipping', 'profile', 'generation')
+
+    _generations = count()
+
+    def __init__(self, enabled, min_x=0, max_x=0, min_y=0, max_y=0, clipping=None, profile=None):
+        object.__setattr__(self, 'enabled', enabled)
+        object.__setattr__(self, 'min_x', min_x)
+        object.__setattr__(self, 'max_x', max_x)
+        object.__setattr__(self, 'min_y', min_y)
+        object.__setattr__(self, 'max_y', max_y)
+        object.__setattr__(self, 'clipping', enabled if clipping is None else clipping)
+        object.__setattr__(self, 'profile', profile)
+        object.__setattr__(self, 'generation', next(InputState._generations))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('InputState is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('InputState is immutable')
+
+    # margins: (left, right, top, bottom) added around the window bounds.
+    @staticmethod
+    def from_bounds(enabled, bounds, margins=NO_MARGINS, profile=None):
+        if not enabled or bounds is None:
+            return InputState(False, profile=profile)
+        return InputState(True, *clip_rect(bounds, margins), profile=profile)
+
+    # Plain values to rebuild it with InputState(*values), e.g. in another process.
+    def to_tuple(self):
+        return (self.enabled, self.min_x, self.max_x, self.min_y, self.max_y, self.clipping, self.profile)
+
+    def __repr__(self):
+        return 'InputState(enabled={}, x=[{}, {}], y=[{}, {}], clipping={}, profile={}, generation={})'.format(
+            self.enabled, self.min_x, self.max_x, self.min_y, self.max_y, self.clipping, self.profile, self.generation)
+
+DISABLED_INPUT_STATE = InputState(False)
@@ -0,0 +1,52 @@
+from threading import Lock
+
+# Pressed state of the keys we injected, one bit per keycode.
+# press() and release() report whether the state changed, so the hooks inject exactly
+# one up per down and can drop the OS auto-repeat downs of a key already held.
+class KeyState:
+    __slots__ = ('_bits', '_lock')
+
+    def __init__(self):
+        self._bits = 0
+        # The hook presses keys while the window tracker or a reload may release them all.
+        self._lock = Lock()
+
+    def press(self, keycode):
+        bit = 1 << keycode
+        with self._lock:
+            bits = self._bits
+            if bits & bit:
+                return False
+            self._bits = bits | bit
+            return True
+
+    def release(self, keycode):
+        bit = 1 << keycode
+        with self._lock:
+            bits = self._bits
+            if not bits & bit:
+                return False
+            self._bits = bits & ~bit
+            return True
+
+    def is_down(self, keycode):
+        return self._bits >> keycode & 1 == 1
+
+    # Marks every key released and returns the keycodes that were down.
+    def release_all(self):
+        with self._lock:
+            bits, self._bits = self._bits, 0
+        keycodes = []
+        keycode = 0
+        while bits:
+            if bits & 1:
+                keycodes.append(keycode)
+            bits >>= 1
+            keycode += 1
+        return keycodes
+
+    def __bool__(self):
+        return self._bits != 0
+
+    def __repr__(self):
+        return 'KeyState({})'.format([keycode for keycode in range(self._bits.bit_length()) if self.is_down(keycode)])
@@ -0,0 +1,88 @@
+# Platform neutral key event decision engine.
+# The hook callbacks run on the OS event tap thread, so everything here is
+# precompiled into flat lists at config load time and a decision is a single
+# list index. Don't import any OS or pynput module here.
+from time import monotonic
+
+# Action codes.
+PASS = 0
+SUPPRESS = 1
+REMAP = 2
+PASSTHROUGH = 3
+# Starts a macro, the action is MACRO + the index of the macro.
+MACRO = 16
+
+# Modifier bitmask. The bit order matches the Quartz event flags (shift, ctrl,
+# alt, cmd from bit 17) so the Mac listener can convert flags with one shift.
+MOD_SHIFT = 1
+MOD_CTRL = 2
+MOD_ALT = 4
+MOD_CMD = 8
+MOD_COUNT = 16
+
+KEYCODE_BITS = 8
+KEYCODE_COUNT = 1 << KEYCODE_BITS
+
+def modifier_mask(is_ctrl_down, is_alt_down, is_cmd_down, is_shift_down):
+    return (MOD_CTRL if is_ctrl_down else 0) | (MOD_ALT if is_alt_down else 0) | \
+        (MOD_CMD if is_cmd_down else 0) | (MOD_SHIFT if is_shift_down else 0)
+
+def check_keycode(keycode):
+    if not isinstance(keycode, int) or keycode < 0 or keycode >= KEYCODE_COUNT:
+        raise RuntimeError('Key code out of range: {}'.format(keycode))
+    return keycode
+
+class Keymap:
+    # remap_keys: {from keycode: to keycode}
+    # passthrough_hotkeys: iterable of (modifier mask, keycode)
+    # modifier_keys: {keycode: MOD_*} of the physical modifier keys.
+    # macro_hotkeys: {(modifier mask, keycode): macro index}
+    # macro_sequences: iterable of (hotkey_trie rule, macro index) of the chords and sequences,
+    # they are matched by hotkey_matcher, which keeps the match in progress for the key hook.
+    # profile_index: 0 for the default keymap, 1 + the index of its profile otherwise, the
+    # hooks record it in the trace.
+    def __init__(self, remap_keys=None, passthrough_hotkeys=(), modifier_keys=None, sequence_timeout=1.0, macro_hotkeys=None, macro_sequences=(), profile_index=0, clock=monotonic):
+        self.profile_index = profile_index
+        self._actions = [PASS] * (MOD_COUNT * KEYCODE_COUNT)
+        self._targets = [0] * KEYCODE_COUNT
+        self._modifiers = [0] * KEYCODE_COUNT
+        # Remaps from or to a modifier, their OS auto-repeat is dropped.
+        self._modifier_remaps = [False] * KEYCODE_COUNT
+
+        for keycode, mod in (modifier_keys or {}).items():
+            self._modifiers[check_keycode(keycode)] = mod
+
+        for from_key, to_key in (remap_keys or {}).items():
+            from_key = check_keycode(from_key)
+            self._targets[from_key] = check_keycode(to_key)
+            self._modifier_remaps[from_key] = self._modifiers[from_key] != 0 or self._modifiers[to_key] != 0
+            for mods in range(MOD_COUNT):
+                self._actions[mods << KEYCODE_BITS | from_key] = REMAP
+
+        for mods, keycode in passthrough_hotkeys:
+            self._actions[mods << KEYCODE_BITS | check_keycode(keycode)] = PASSTHROUGH
+
+        for (mods, keycode), index in (macro_hotkeys or {}).items():
+            self._actions[mods << KEYCODE_BITS | check_keycode(keycode)] = MACRO + index
+
+        self.hotkey_matcher = None
+        rules = [(rule, MACRO + index) for rule, index in macro_sequences]
+        if rules:
+            from .hotkey_trie import HotkeyMatcher
+            self.hotkey_matcher = HotkeyMatcher(rules, sequence_timeout, clock)
+
+    def decide(self, mods, keycode):
+        if keycode >= KEYCODE_COUNT:
+            return PASS
+        return self._actions[mods << KEYCODE_BITS | keycode]
+
+    def remap_target(self, keycode):
+        return self._targets[keycode]
+
+    def is_modifier_remap(self, keycode):
+        return self._modifier_remaps[keycode]
+
+    def modifier_of(self, keycode):
+        if keycode >= KEYCODE_COUNT:
+            return 0
+        return self._modifiers[keycode]
@@ -0,0 +1,254 @@
+from collections import deque
+from threading import Thread, Event, Lock
+from time import monotonic_ns
+import logging
+import select
+import socket
+import struct
+
+from .stats import Histogram
+
+logger = logging.getLogger('moonlight-desktop')
+
+DEFAULT_PORT = 47999
+
+# Side channel datagrams: kind, sequence number and up to three timestamps in ns.
+PROBE = 0 # client -> server: a marker key for seq was injected at t0
+SYNC = 1 # client -> server -> client: clock offset exchange, t0 sent, t1 received, t2 replied
+MARKER = 2 # server -> client: the marker key for seq reached the server hook at t1
+MESSAGE = struct.Struct('!BIqqq')
+
+# Runs on the streaming host. The key hook calls on_marker() when the marker key arrives, the
+# probe thread pairs it with the newest probe announced before it, older ones lost their key.
+# It listens on host, loopback unless the config names the address the client reaches this
+# host at, and only answers client_host if set.
+class ProbeServer:
+    def __init__(self, port=DEFAULT_PORT, host='127.0.0.1', client_host=None, pending_timeout=1.0, clock=monotonic_ns):
+        self._address = (host, port)
+        self._client_host = client_host
+        self._pending_timeout_ns = int(pending_timeout * 1e9)
+        self._clock = clock
+        # Only touched by the probe thread.
+        self._pending = deque()
+        # Marker times from the key hook, deque append() and popleft() are atomic.
+        self._markers = deque()
+        self._socket = None
+        # Wakes the probe thread for a marker. A socket pair, select() only takes sockets on Windows.
+        self._wakeup_reader = None
+        self._wakeup_writer = None
+        self._stopped = Event()
+        self._thread = None
+        self.markers = 0
+        self.unmatched = 0
+
+    @property
+    def port(self):
+        return self._socket.getsockname()[1]
+
+    def start(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(self._address)
+        self._wakeup_reader, wakeup_writer = socket.socketpair()
+        wakeup_writer.setblocking(False)
+        self._wakeup_writer = wakeup_writer
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(1)
+            self._thread = None
+        for sock in (self._socket, self._wakeup_reader, self._wakeup_writer):
+            if sock is not None:
+                sock.close()
+        self._socket = self._wakeup_reader = self._wakeup_writer = None
+
+    # Called from the key hook, only takes a timestamp and wakes the probe thread.
+    def on_marker(self):
+        self._markers.append(self._clock())
+        wakeup_writer = self._wakeup_writer
+        if wakeup_writer is not None:
+            try:
+                wakeup_writer.send(b'\0')
+            except OSError:
+                # Full, the probe thread has yet to drain it, or stopped.
+                pass
+
+    # Reports the markers taken since the last call. Called from the probe thread.
+    def report_markers(self):
+        pending = self._pending
+        markers = self._markers
+        while markers:
+            marker_time = markers.popleft()
+            self.markers += 1
+            # Announcements without a marker, the key got lost on the way.
+            while pending and marker_time - pending[0][2] > self._pending_timeout_ns:
+                pending.popleft()
+            # The newest announcement before the marker, later ones are for later keys.
+            match = None
+            while pending and pending[0][2] <= marker_time:
+                match = pending.popleft()
+            if match is None:
+                self.unmatched += 1
+                continue
+            seq, address, _ = match
+            try:
+                self._socket.sendto(MESSAGE.pack(MARKER, seq, marker_time, 0, 0), address)
+            except OSError:
+                logger.exception('Failed to report a latency probe marker.')
+
+    def _run(self):
+        sockets = [self._socket, self._wakeup_reader]
+        while not self._stopped.is_set():
+            try:
+                readable, _, _ = select.select(sockets, [], [], 0.5)
+            except (OSError, ValueError):
+                break
+            # Announcements first, the marker may be for the one that just came in.
+            if self._socket in readable and not self._receive():
+                break
+            if self._wakeup_reader in readable:
+                try:
+                    self._wakeup_reader.recv(4096)
+                except OSError:
+                    break
+                self.report_markers()
+
+    # Returns False once the socket is closed.
+    def _receive(self):
+        try:
+            data, address = self._socket.recvfrom(MESSAGE.size)
+        except OSError:
+            return False
+        received_time = self._clock()
+        if len(data) != MESSAGE.size or (self._client_host is not None and address[0] != self._client_host):
+            return True
+        kind, seq, t0, _, _ = MESSAGE.unpack(data)
+        if kind == PROBE:
+            self._pending.append((seq, address, received_time))
+        elif kind == SYNC:
+            try:
+                self._socket.sendto(MESSAGE.pack(SYNC, seq, t0, received_time, self._clock()), address)
+            except OSError:
+                logger.exception('Failed to answer a latency probe sync.')
+        return True
+
+# Runs on the client. Injects the marker key through send(batch) at a fixed rate while
+# is_active() and turns the server's timestamps into a latency distribution, corrected by
+# the clock offset of the SYNC exchange with the lowest round trip.
+class ProbeClient:
+    def __init__(self, send, marker_keycode, server_address, rate=5, sync_every=10, is_active=lambda: True,
+                 clock=monotonic_ns):
+        self._send = send
+        self._marker_keycode = marker_keycode
+        self._server_address = server_address
+        self._interval = 1.0 / rate
+        self._sync_every = sync_every
+        self._is_active = is_active
+        self._clock = clock
+        self._socket = None
+        self._stopped = Event()
+        self._thread = None
+        self._lock = Lock()
+        self._sent_times = {}
+        self._seq = 0
+
+        self.latency = Histogram()
+        self.sent = 0
+        self.received = 0
+        self.clock_offset_ns = None
+        self.rtt_ns = None
+
+    def start(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(1)
+            self._thread = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _next_seq(self):
+        self._seq = (self._seq + 1) & 0xFFFFFFFF
+        return self._seq
+
+    def sync(self):
+        self._socket.sendto(MESSAGE.pack(SYNC, self._next_seq(), self._clock(), 0, 0), self._server_address)
+
+    def probe(self):
+        seq = self._next_seq()
+        sent_time = self._clock()
+        with self._lock:
+            self._sent_times[seq] = sent_time
+            self.sent += 1
+        # Announce first, the datagram beats the key through the stream.
+        self._socket.sendto(MESSAGE.pack(PROBE, seq, sent_time, 0, 0), self._server_address)
+        self._send(((self._marker_keycode, True), (self._marker_keycode, False)))
+
+    def _run(self):
+        next_probe = 0
+        count = 0
+        while not self._stopped.is_set():
+            now = self._clock()
+            if now >= next_probe:
+                next_probe = now + int(self._interval * 1e9)
+                try:
+                    if count % self._sync_every == 0:
+                        self.sync()
+                    if self._is_active():
+                        self.probe()
+                    count += 1
+                except OSError:
+                    logger.exception('Failed to send a latency probe.')
+            try:
+                self._socket.settimeout(max(next_probe - self._clock(), 1000000) / 1e9)
+                data = self._socket.recv(MESSAGE.size)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if len(data) == MESSAGE.size:
+                self._handle(MESSAGE.unpack(data), self._clock())
+
+    def _handle(self, message, received_time):
+        kind, seq, t0, t1, t2 = message
+        if kind == SYNC:
+            rtt = (received_time - t0) - (t2 - t1)
+            if self.rtt_ns is None or rtt <= self.rtt_ns:
+                self.rtt_ns = rtt
+                self.clock_offset_ns = ((t1 - t0) + (t2 - received_time)) // 2
+        elif kind == MARKER:
+            with self._lock:
+                sent_time = self._sent_times.pop(seq, None)
+                # Probes older than this one won't be answered any more.
+                for stale_seq in [stale_seq for stale_seq in self._sent_times if stale_seq < seq]:
+                    del self._sent_times[stale_seq]
+            if sent_time is None or self.clock_offset_ns is None:
+                return
+            self.received += 1
+            self.latency.record(t0 - self.clock_offset_ns - sent_time)
+
+    def to_dict(self):
+        return {
+            'sent': self.sent,
+            'received': self.received,
+            'clock_offset_ns': self.clock_offset_ns,
+            'rtt_ns': self.rtt_ns,
+            'latency_ns': self.latency.to_dict(),
+        }
+
+    def format_report(self):
+        latency = self.latency
+        if latency.count == 0:
+            return 'Latency probe: {} sent, no marker came back.'.format(self.sent)
+        return 'Latency probe: {}/{} markers, p50 {:.2f} ms, p90 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms, side channel rtt {:.2f} ms.'.format(
+            self.received, self.sent, latency.percentile(50) / 1e6, latency.percentile(90) / 1e6,
+            latency.percentile(99) / 1e6, latency.max / 1e6, (self.rtt_ns or 0) / 1e6)
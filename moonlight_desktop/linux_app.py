@@ -0,0 +1,549 @@
+from threading import Thread, Lock
+from time import perf_counter_ns
+import errno
+import select
+import subprocess
+import logging
+import os
+
+from .app import App
+from .input_state import InputState
+from .keymap import PASS, SUPPRESS, PASSTHROUGH, REMAP, MACRO, MOD_CTRL, MOD_ALT, MOD_CMD, MOD_SHIFT
+from .window_tracker import WindowProvider, WindowTracker
+from .trace import KIND_KEY, KIND_ACTIVE, KIND_DOWN
+from . import startup_profile
+
+MOONLIGHT_PROCESS_NAME = 'moonlight'
+
+# Linux input event codes, from linux/input-event-codes.h.
+EV_SYN = 0x00
+EV_KEY = 0x01
+SYN_REPORT = 0
+KEY_UP = 0
+KEY_DOWN = 1
+KEY_REPEAT = 2
+KEY_A = 30
+
+INPUT_DEVICE_DIR = '/dev/input'
+# Seconds between checks of /dev/input for hot-plugged keyboards.
+DEVICE_SCAN_INTERVAL = 2.0
+
+KEY_NAMES = {
+    'esc': 1, 'backspace': 14, 'tab': 15, 'enter': 28, 'space': 57, 'caps_lock': 58,
+    'ctrl': 29, 'ctrl_l': 29, 'ctrl_r': 97,
+    'shift': 42, 'shift_l': 42, 'shift_r': 54,
+    'alt': 56, 'alt_l': 56, 'alt_r': 100, 'alt_gr': 100,
+    'cmd': 125, 'cmd_l': 125, 'cmd_r': 126,
+    'home': 102, 'up': 103, 'page_up': 104, 'left': 105, 'right': 106, 'end': 107,
+    'down': 108, 'page_down': 109, 'insert': 110, 'delete': 111, 'menu': 127,
+    'print_screen': 99, 'scroll_lock': 70, 'pause': 119, 'num_lock': 69,
+    'f1': 59, 'f2': 60, 'f3': 61, 'f4': 62, 'f5': 63, 'f6': 64, 'f7': 65, 'f8': 66,
+    'f9': 67, 'f10': 68, 'f11': 87, 'f12': 88, 'f13': 183, 'f14': 184, 'f15': 185,
+    'f16': 186, 'f17': 187, 'f18': 188, 'f19': 189, 'f20': 190,
+}
+
+# US layout, evdev codes are physical keys.
+CHAR_KEYCODES = {
+    '1': 2, '2': 3, '3': 4, '4': 5, '5': 6, '6': 7, '7': 8, '8': 9, '9': 10, '0': 11,
+    '-': 12, '=': 13, 'q': 16, 'w': 17, 'e': 18, 'r': 19, 't': 20, 'y': 21, 'u': 22,
+    'i': 23, 'o': 24, 'p': 25, '[': 26, ']': 27, 'a': 30, 's': 31, 'd': 32, 'f': 33,
+    'g': 34, 'h': 35, 'j': 36, 'k': 37, 'l': 38, ';': 39, "'": 40, '`': 41, '\\': 43,
+    'z': 44, 'x': 45, 'c': 46, 'v': 47, 'b': 48, 'n': 49, 'm': 50, ',': 51, '.': 52, '/': 53,
+}
+
+MODIFIER_KEYCODES = {
+    29: MOD_CTRL, 97: MOD_CTRL,
+    56: MOD_ALT, 100: MOD_ALT,
+    125: MOD_CMD, 126: MOD_CMD,
+    42: MOD_SHIFT, 54: MOD_SHIFT,
+}
+
+# Keys replayed for the modifiers of a passthrough hotkey.
+PASSTHROUGH_MODIFIER_KEYCODES = ((MOD_CTRL, 29), (MOD_ALT, 56), (MOD_CMD, 125), (MOD_SHIFT, 42))
+
+logger = logging.getLogger('moonlight-desktop')
+
+def parse_key_name(key_name):
+    if len(key_name) > 2 and key_name[0] == '<' and key_name[-1] == '>':
+        name = key_name[1:-1]
+        if name.isdigit():
+            return int(name)
+        if name in KEY_NAMES:
+            return KEY_NAMES[name]
+    elif key_name.lower() in CHAR_KEYCODES:
+        return CHAR_KEYCODES[key_name.lower()]
+    raise RuntimeError('Invalid key specified: {}'.format(key_name))
+
+# Writes batches of (keycode, is_down) to the uinput device, one SYN per batch.
+# is_down may also be KEY_REPEAT, the kernel drops a second KEY_DOWN of a held key.
+class UInputInjector:
+    def __init__(self):
+        self.uinput = None
+        self._lock = Lock()
+
+    def prepare(self, keycodes):
+        pass
+
+    def send(self, batch):
+        uinput = self.uinput
+        if uinput is None:
+            return
+        with self._lock:
+            for keycode, is_down in batch:
+                uinput.write(EV_KEY, keycode, int(is_down))
+            uinput.syn()
+
+    # Swaps the device between two batches.
+    def replace_uinput(self, uinput):
+        with self._lock:
+            self.uinput = uinput
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+def read_process_name(pid):
+    try:
+        with open('/proc/{}/comm'.format(pid), 'r') as comm_file:
+            return comm_file.read().strip().lower()
+    except OSError:
+        return None
+
+# Queries the window manager over one X connection. Focus changes are notified from a
+# second connection, Xlib connections aren't shared between threads.
+class X11WindowProvider(WindowProvider):
+    def __init__(self):
+        from Xlib import display
+        self._display = display.Display()
+        self._root = self._display.screen().root
+        intern_atom = self._display.intern_atom
+        self._net_active_window = intern_atom('_NET_ACTIVE_WINDOW')
+        self._net_wm_pid = intern_atom('_NET_WM_PID')
+        self._net_wm_name = intern_atom('_NET_WM_NAME')
+        self._net_wm_state = intern_atom('_NET_WM_STATE')
+        self._net_wm_state_fullscreen = intern_atom('_NET_WM_STATE_FULLSCREEN')
+        self._utf8_string = intern_atom('UTF8_STRING')
+        self._target_pid = None
+        self._event_display = None
+        # Found once per refresh by get_active_pid, the other getters read its properties.
+        self._active_window = None
+
+    def subscribe(self, callback):
+        from Xlib import display, X
+        event_display = self._event_display = display.Display()
+        event_display.screen().root.change_attributes(event_mask=X.PropertyChangeMask)
+        event_display.flush()
+        Thread(target=self._run_events, args=(event_display, callback), daemon=True).start()
+        return True
+
+    def unsubscribe(self):
+        event_display, self._event_display = self._event_display, None
+        if event_display is not None:
+            # Ends next_event() in the event thread.
+            event_display.close()
+
+    def _run_events(self, event_display, callback):
+        from Xlib import X
+        net_active_window = event_display.intern_atom('_NET_ACTIVE_WINDOW')
+        try:
+            while True:
+                event = event_display.next_event()
+                if event.type == X.PropertyNotify and event.atom == net_active_window:
+                    callback()
+        except Exception:
+            if self._event_display is event_display:
+                logger.exception('Lost the X connection for focus changes.')
+
+    # Returns the values of a window property, None if the window is gone or hasn't got it.
+    def _get_property(self, window, atom, property_type=None):
+        from Xlib import X
+        from Xlib.error import XError
+        try:
+            prop = window.get_full_property(atom, property_type or X.AnyPropertyType)
+        except XError:
+            return None
+        return prop.value if prop is not None else None
+
+    def _get_active_window(self):
+        value = self._get_property(self._root, self._net_active_window)
+        if not value or not value[0]:
+            return None
+        return self._display.create_resource_object('window', value[0])
+
+    def get_active_pid(self):
+        window = self._active_window = self._get_active_window()
+        value = self._get_property(window, self._net_wm_pid) if window is not None else None
+        return int(value[0]) if value else None
+
+    # The PID stays cached as long as its process is Moonlight, /proc is only scanned once it is gone.
+    def get_target_pid(self):
+        if self._target_pid is not None and read_process_name(self._target_pid) == MOONLIGHT_PROCESS_NAME:
+            return self._target_pid
+        self._target_pid = None
+        for pid in os.listdir('/proc'):
+            if pid.isdigit() and read_process_name(pid) == MOONLIGHT_PROCESS_NAME:
+                self._target_pid = int(pid)
+                break
+        return self._target_pid
+
+    def get_app_id(self, pid):
+        from Xlib.error import XError
+        window = self._active_window
+        try:
+            # (instance, class), e.g. ('moonlight', 'Moonlight').
+            wm_class = window.get_wm_class() if window is not None else None
+        except XError:
+            return None
+        return wm_class[-1] if wm_class else None
+
+    def get_window_title(self, pid):
+        window = self._active_window
+        value = self._get_property(window, self._net_wm_name, self._utf8_string) if window is not None else None
+        if value is None:
+            return None
+        return value.decode('utf-8', 'replace') if isinstance(value, bytes) else str(value)
+
+    # Only reports bounds for a full screen window, the clipping is left to the compositor.
+    def get_window_bounds(self, pid):
+        window = self._active_window
+        value = self._get_property(window, self._net_wm_state) if window is not None else None
+        if not value or self._net_wm_state_fullscreen not in value:
+            return None
+        return {'X': 0, 'Y': 0, 'Width': 0, 'Height': 0}
+
+class LinuxApp(App):
+    def __init__(self, log_file_path, argv):
+        App.__init__(self, log_file_path, 'icons/systray-win.png', argv)
+
+        if self._config_filename is None:
+            self._config_filename = 'config/linux-client.yaml'
+
+        self._devices = []
+        self._uinput = None
+        # Keys the uinput device was created with, it can't emit any other.
+        self._uinput_keys = set()
+        # The event loop adds hot-plugged keyboards while a reload may update the device.
+        self._uinput_lock = Lock()
+        self._wakeup_pipe = None
+        self._event_thread = None
+        self._mods = 0
+
+        self._window_tracker = None
+        self._key_event_histogram = self._stats.histogram('linux_key_events')
+
+    def start(self):
+        self._load_config()
+
+        with startup_profile.phase('start hooks'):
+            self._devices = self._open_devices()
+            if not self._devices:
+                raise RuntimeError('Cannot find any keyboard, is the user in the input group?')
+            self._uinput = self._create_uinput(self._devices)
+            self._base_injector.uinput = self._uinput
+            self._start_window_tracker()
+            wakeup_pipe = self._wakeup_pipe = os.pipe()
+            self._event_thread = Thread(target=self._run_event_loop, args=(wakeup_pipe[0],), daemon=True)
+            self._event_thread.start()
+
+        try:
+            try:
+                with startup_profile.phase('init systray'):
+                    self._init_systray()
+            except Exception:
+                logger.exception('Failed to create the systray icon, running without it.')
+                self.systray = None
+            self._start_workers()
+            startup_profile.report()
+
+            if self.systray is not None:
+                self.systray.run()
+            else:
+                self._event_thread.join()
+            return 0
+        finally:
+            self._stop_event_loop()
+            if self._window_tracker is not None:
+                self._window_tracker.stop()
+            self._release_injected_keys()
+            self._stop_workers()
+            self._close_devices()
+
+    def stop(self):
+        if self.systray is not None:
+            self.systray.stop()
+        else:
+            self._stop_event_loop()
+
+    def _create_base_injector(self):
+        return UInputInjector()
+
+    def _parse_key(self, key_name):
+        return parse_key_name(key_name)
+
+    def _get_modifier_keycodes(self):
+        return MODIFIER_KEYCODES
+
+    def _char_to_keycode(self, char):
+        return CHAR_KEYCODES.get(char)
+
+    def _open_file_with_associated_app(self, path):
+        subprocess.Popen(['xdg-open', path])
+
+    # Opens and grabs the keyboards whose path isn't in open_paths. If one fails, the ones
+    # grabbed so far are let go again.
+    def _open_devices(self, open_paths=()):
+        from evdev import InputDevice, list_devices, ecodes
+        devices = []
+        try:
+            for device_path in list_devices():
+                if device_path in open_paths:
+                    continue
+                device = InputDevice(device_path)
+                try:
+                    # Keyboards have letter keys, skip mice, power buttons and our own virtual device.
+                    is_keyboard = KEY_A in device.capabilities().get(ecodes.EV_KEY, []) and device.name != 'moonlight-desktop'
+                    if is_keyboard:
+                        device.grab()
+                except Exception:
+                    device.close()
+                    raise
+                if is_keyboard:
+                    logger.info('Grabbed keyboard %s (%s).', device.name, device.path)
+                    devices.append(device)
+                else:
+                    device.close()
+        except Exception:
+            self._release_devices(devices)
+            raise
+        return devices
+
+    # One virtual device emits the keys of all grabbed keyboards and every key the config injects.
+    def _create_uinput(self, devices):
+        from evdev import UInput, ecodes
+        keys = self._get_uinput_keys(devices)
+        self._uinput_keys = keys
+        return UInput({ecodes.EV_KEY: sorted(keys)}, name='moonlight-desktop')
+
+    def _get_uinput_keys(self, devices):
+        from evdev import ecodes
+        keys = set()
+        for device in devices:
+            keys.update(device.capabilities().get(ecodes.EV_KEY, []))
+        keys.update(self._get_injected_keycodes())
+        return keys
+
+    # A reload or a hot-plugged keyboard may need keys the device can't emit, it is then
+    # replaced by one that can.
+    def _update_uinput(self):
+        with self._uinput_lock:
+            if self._uinput is None or self._get_uinput_keys(self._devices) <= self._uinput_keys:
+                return
+            old_uinput = self._uinput
+            self._uinput = self._create_uinput(self._devices)
+            self._base_injector.replace_uinput(self._uinput)
+            # Closing it releases whatever it still held down.
+            old_uinput.close()
+        logger.info('Recreated the uinput device for the new keys.')
+
+    def _release_devices(self, devices):
+        for device in devices:
+            try:
+                device.ungrab()
+            except OSError:
+                # Already gone if it was unplugged.
+                pass
+            except Exception:
+                logger.exception('Failed to release %s.', device)
+            try:
+                device.close()
+            except Exception:
+                logger.exception('Failed to close %s.', device)
+
+    def _close_devices(self):
+        self._release_devices(self._devices)
+        self._devices = []
+        self._base_injector.uinput = None
+        if self._uinput is not None:
+            self._uinput.close()
+            self._uinput = None
+
+    def _start_window_tracker(self):
+        try:
+            provider = X11WindowProvider()
+        except Exception:
+            logger.warning('Cannot connect to the X server, handling keys regardless of the focused window.', exc_info=True)
+            self._publish_input_state(InputState(True))
+            return
+        self._window_tracker = WindowTracker(provider, self._on_moonlight_window_changed, max_interval=0.5)
+        self._window_tracker.start()
+
+    def _on_moonlight_window_changed(self, state):
+        logger.debug('Moonlight window state: %s', state)
+        self._publish_input_state(self._input_state_for_window(state))
+
+    def _load_platform_config(self, config):
+        self._update_uinput()
+        # Match the focused app against the new profiles.
+        if self._window_tracker is not None:
+            self._on_moonlight_window_changed(self._window_tracker.state)
+
+    def _stop_event_loop(self):
+        wakeup_pipe, self._wakeup_pipe = self._wakeup_pipe, None
+        if wakeup_pipe is not None:
+            os.write(wakeup_pipe[1], b'\0')
+            if self._event_thread is not None:
+                self._event_thread.join(1)
+            os.close(wakeup_pipe[0])
+            os.close(wakeup_pipe[1])
+
+    # Reads the grabbed keyboards until the wakeup fd is written to. Unplugged keyboards are
+    # dropped, /dev/input is checked for new ones every DEVICE_SCAN_INTERVAL.
+    def _run_event_loop(self, wakeup_fd):
+        devices_by_fd = {device.fd: device for device in self._devices}
+        poller = select.epoll()
+        scan_interval_ns = int(DEVICE_SCAN_INTERVAL * 1e9)
+        next_scan_time = perf_counter_ns() + scan_interval_ns
+        input_dir_mtime = self._get_input_dir_mtime()
+        try:
+            poller.register(wakeup_fd, select.EPOLLIN)
+            for fd in devices_by_fd:
+                poller.register(fd, select.EPOLLIN)
+            while True:
+                for fd, event_mask in poller.poll(DEVICE_SCAN_INTERVAL):
+                    if fd == wakeup_fd:
+                        return
+                    device = devices_by_fd.get(fd)
+                    if device is None:
+                        continue
+                    if event_mask & (select.EPOLLHUP | select.EPOLLERR):
+                        self._drop_device(poller, devices_by_fd, device)
+                        continue
+                    start_time = perf_counter_ns()
+                    try:
+                        # Everything read in one go goes out as one batch with a single SYN.
+                        batch = self.handle_events(device.read())
+                        if batch:
+                            self._injector.send(batch)
+                    except BlockingIOError:
+                        pass
+                    except OSError as e:
+                        if e.errno != errno.ENODEV:
+                            self._stats.exceptions += 1
+                            logger.exception('Failed to read %s.', device.path)
+                        self._drop_device(poller, devices_by_fd, device)
+                    except Exception:
+                        self._stats.exceptions += 1
+                        logger.exception('Exception was thrown in the key event loop.')
+                    self._key_event_histogram.record(perf_counter_ns() - start_time)
+
+                now = perf_counter_ns()
+                if now >= next_scan_time:
+                    next_scan_time = now + scan_interval_ns
+                    # Device nodes are only added or removed when the directory changes.
+                    mtime = self._get_input_dir_mtime()
+                    if mtime != input_dir_mtime:
+                        input_dir_mtime = mtime
+                        self._add_devices(poller, devices_by_fd)
+        finally:
+            poller.close()
+
+    def _get_input_dir_mtime(self):
+        try:
+            return os.stat(INPUT_DEVICE_DIR).st_mtime_ns
+        except OSError:
+            return None
+
+    # Called from the event loop when a keyboard was unplugged or can't be read any more.
+    def _drop_device(self, poller, devices_by_fd, device):
+        try:
+            poller.unregister(device.fd)
+        except OSError:
+            pass
+        del devices_by_fd[device.fd]
+        self._devices = [open_device for open_device in self._devices if open_device is not device]
+        self._release_devices([device])
+        logger.info('Lost keyboard %s (%s).', device.name, device.path)
+
+    # Grabs the keyboards plugged in since the last scan.
+    def _add_devices(self, poller, devices_by_fd):
+        try:
+            devices = self._open_devices({device.path for device in self._devices})
+        except Exception:
+            logger.exception('Failed to open the new input devices.')
+            return
+        if not devices:
+            return
+        for device in devices:
+            devices_by_fd[device.fd] = device
+            poller.register(device.fd, select.EPOLLIN)
+        self._devices = self._devices + devices
+        try:
+            self._update_uinput()
+        except Exception:
+            logger.exception('Failed to recreate the uinput device.')
+
+    # Translates evdev events into a batch of (keycode, value) to emit.
+    def handle_events(self, events):
+        batch = []
+        trace = self._trace
+        for event in events:
+            if event.type == EV_KEY:
+                verdict = self._handle_key(event.code, event.value, batch)
+                # The read is timed as a whole, the records carry no callback time.
+                kind = KIND_ACTIVE if self._input_state.enabled else KIND_KEY
+                trace.record(perf_counter_ns(), event.value, event.code, 0, self._mods, verdict,
+                             kind | KIND_DOWN if event.value != KEY_UP else kind, self._keymap.profile_index, 0)
+        return batch
+
+    # Returns what happened to the key.
+    def _handle_key(self, keycode, value, batch):
+        keymap = self._keymap
+        stats = self._stats
+        is_key_down = value != KEY_UP
+
+        # Track the physical modifiers ourselves, the grabbed keys never reach the system as is.
+        modifier = keymap.modifier_of(keycode)
+        if modifier and value != KEY_REPEAT:
+            if is_key_down:
+                self._mods |= modifier
+            else:
+                self._mods &= ~modifier
+        mods = self._mods
+
+        # If Moonlight isn't the active window, don't process.
+        if not self._input_state.enabled:
+            batch.append((keycode, value))
+            stats.passed += 1
+            return PASS
+
+        action = keymap.decide(mods, keycode)
+        hotkey_matcher = keymap.hotkey_matcher
+        # The modifiers are in mods, they don't advance the chords and sequences.
+        if hotkey_matcher is not None and not modifier:
+            action = hotkey_matcher.feed(mods, keycode, is_key_down) or action
+        # The macro plays on the scheduler thread, the trigger key is swallowed.
+        if action >= MACRO or (not is_key_down and self._macro_triggers):
+            if self._handle_macro_key(action, keycode, is_key_down) == MACRO:
+                stats.suppressed += 1
+                return MACRO
+        if action == REMAP:
+            to = keymap.remap_target(keycode)
+            if not self._track_remapped_key(keymap, keycode, to, is_key_down):
+                return SUPPRESS
+            batch.append((to, value))
+            stats.remapped += 1
+        elif action == PASSTHROUGH:
+            # Unpress injected keys, then replay the hotkey with real modifiers.
+            for injected_key in self._injected_keys.release_all():
+                batch.append((injected_key, False))
+            for mod, modifier_keycode in PASSTHROUGH_MODIFIER_KEYCODES:
+                if mods & mod:
+                    batch.append((modifier_keycode, is_key_down))
+            batch.append((keycode, value))
+            stats.passthrough += 1
+        else:
+            batch.append((keycode, value))
+            stats.passed += 1
+        return action
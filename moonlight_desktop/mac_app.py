@@ -1,42 +1,191 @@
-from os import system, path
-from time import sleep
-from threading import Thread
+from os import path
+from time import perf_counter_ns
+from threading import Lock
+import plistlib
 import subprocess
 import logging
-from psutil import pid_exists
 
 from pynput import keyboard, mouse
-from pynput.keyboard import Key, KeyCode
-from pynput._util.darwin import get_unicode_to_keycode_map
+from pynput.keyboard import Key
 
-from AppKit import NSWorkspace, NSRunningApplication
-from Foundation import NSAppleScript
+from AppKit import NSWorkspace, NSRunningApplication, NSWorkspaceDidActivateApplicationNotification, \
+    NSWorkspaceActiveSpaceDidChangeNotification, NSWorkspaceDidTerminateApplicationNotification
 import Quartz
 
 from .app import App
+from .window_tracker import WindowProvider, WindowTracker
+from .clipper import ClipConfig, MouseClipper, TrailingWarpTimer, CLIP_NONE, CLIP_WARP
+from .supervisor import ProcessSupervisor
+from .tap_watchdog import EventTap, TapWatchdog, DISABLED_BY_TIMEOUT, DISABLED_BY_USER_INPUT
+from . import startup_profile
+from .keymap import PASS, SUPPRESS, PASSTHROUGH, REMAP, MACRO, MOD_CTRL, MOD_ALT, MOD_CMD, MOD_SHIFT
+from .trace import KIND_KEY, KIND_MOUSE, KIND_ACTIVE, KIND_INJECTED, KIND_DOWN
 
 MOUSE_CLIP_X_MARGIN = 50
-UNICODE_TO_KEYCODE_MAP = get_unicode_to_keycode_map()
 MOONLIGHT_BUNDLE_ID = 'com.moonlight-stream.Moonlight'
 MOONLIGHT_APP_NAME = 'Moonlight'
+INJECTED_KEYBOARD_TYPE = 70
 
-logger = logging.getLogger('moonlight-desktop')
+# Quartz modifier flags are contiguous bits (shift, ctrl, alt, cmd) lined up with keymap.MOD_*.
+MODIFIER_FLAGS_SHIFT = 17
+FILTERED_MODIFIER_FLAGS = ~(Quartz.kCGEventFlagMaskControl | Quartz.kCGEventFlagMaskAlternate | Quartz.kCGEventFlagMaskCommand)
+assert Quartz.kCGEventFlagMaskShift == MOD_SHIFT << MODIFIER_FLAGS_SHIFT
+assert Quartz.kCGEventFlagMaskControl == MOD_CTRL << MODIFIER_FLAGS_SHIFT
+assert Quartz.kCGEventFlagMaskAlternate == MOD_ALT << MODIFIER_FLAGS_SHIFT
+assert Quartz.kCGEventFlagMaskCommand == MOD_CMD << MODIFIER_FLAGS_SHIFT
+
+# Keys replayed for the modifiers of a passthrough hotkey.
+PASSTHROUGH_MODIFIER_KEYCODES = ((MOD_CTRL, Key.ctrl.value.vk), (MOD_ALT, Key.alt.value.vk),
+                                 (MOD_CMD, Key.cmd.value.vk), (MOD_SHIFT, Key.shift.value.vk))
 
-def clip(val, min_, max_):
-    return min_ if val < min_ else max_ if val > max_ else val
+logger = logging.getLogger('moonlight-desktop')
 
 def get_active_app_bundle_id():
     return NSWorkspace.sharedWorkspace().frontmostApplication().bundleIdentifier()
 
-def get_moonlight_window_bounds():
-    for window in Quartz.CGWindowListCopyWindowInfo(Quartz.kCGWindowListOptionOnScreenOnly, Quartz.kCGNullWindowID):
-        if window['kCGWindowOwnerName'] == MOONLIGHT_APP_NAME and window['kCGWindowAlpha'] > 0.5:
+# The executable inside an app bundle, so it can be run and waited for without open -W.
+def get_bundle_executable(bundle_path):
+    try:
+        with open(path.join(bundle_path, 'Contents', 'Info.plist'), 'rb') as info_file:
+            name = plistlib.load(info_file).get('CFBundleExecutable')
+    except (OSError, plistlib.InvalidFileException):
+        name = None
+    return path.join(bundle_path, 'Contents', 'MacOS', name or path.splitext(path.basename(bundle_path))[0])
+
+def get_moonlight_window(pid=None):
+    for window in Quartz.CGWindowListCopyWindowInfo(Quartz.kCGWindowListOptionOnScreenOnly | Quartz.kCGWindowListExcludeDesktopElements, Quartz.kCGNullWindowID):
+        if pid is not None:
+            if window['kCGWindowOwnerPID'] != pid: continue
+        elif window['kCGWindowOwnerName'] != MOONLIGHT_APP_NAME: continue
+        if window['kCGWindowAlpha'] > 0.5:
             bounds = window['kCGWindowBounds']
             if bounds['Height'] > 50:
                 # logger.debug(window)
-                return window['kCGWindowBounds']
+                return window
     return None
 
+class MacWindowProvider(WindowProvider):
+    # Entering or leaving full screen switches spaces, so the space notification covers it.
+    NOTIFICATIONS = (NSWorkspaceDidActivateApplicationNotification,
+                     NSWorkspaceActiveSpaceDidChangeNotification,
+                     NSWorkspaceDidTerminateApplicationNotification)
+
+    def __init__(self):
+        self._observers = []
+        # {pid: window} of the current refresh, the window list is fetched once per refresh.
+        self._windows = {}
+
+    def subscribe(self, callback):
+        try:
+            notification_center = NSWorkspace.sharedWorkspace().notificationCenter()
+            for name in self.NOTIFICATIONS:
+                self._observers.append(notification_center.addObserverForName_object_queue_usingBlock_(
+                    name, None, None, lambda notification: callback()))
+            return True
+        except Exception:
+            logger.exception('Failed to subscribe to workspace notifications.')
+            self.unsubscribe()
+            return False
+
+    def unsubscribe(self):
+        notification_center = NSWorkspace.sharedWorkspace().notificationCenter()
+        for observer in self._observers:
+            notification_center.removeObserver_(observer)
+        self._observers = []
+
+    def get_active_pid(self):
+        self._windows = {}
+        return NSWorkspace.sharedWorkspace().frontmostApplication().processIdentifier()
+
+    def get_target_pid(self):
+        for app in NSRunningApplication.runningApplicationsWithBundleIdentifier_(MOONLIGHT_BUNDLE_ID):
+            return app.processIdentifier()
+        return None
+
+    def _get_window(self, pid):
+        if pid not in self._windows:
+            self._windows[pid] = get_moonlight_window(pid)
+        return self._windows[pid]
+
+    def get_window_bounds(self, pid):
+        window = self._get_window(pid)
+        return window['kCGWindowBounds'] if window is not None else None
+
+    def get_app_id(self, pid):
+        app = NSRunningApplication.runningApplicationWithProcessIdentifier_(pid)
+        return app.bundleIdentifier() if app is not None else None
+
+    # Window titles are only listed with the screen recording permission.
+    def get_window_title(self, pid):
+        window = self._get_window(pid)
+        return window.get('kCGWindowName') if window is not None else None
+
+# The event tap of a pynput listener, pynput keeps it in a local so it is caught on creation.
+class QuartzEventTap(EventTap):
+    def __init__(self, listener):
+        self._tap = None
+        create_event_tap = listener._create_event_tap
+
+        def _create_event_tap():
+            self._tap = create_event_tap()
+            return self._tap
+        listener._create_event_tap = _create_event_tap
+
+    def is_enabled(self):
+        return self._tap is None or Quartz.CGEventTapIsEnabled(self._tap)
+
+    def enable(self):
+        if self._tap is not None:
+            Quartz.CGEventTapEnable(self._tap, True)
+
+# Posts key events created up front from one event source. The modifier flags of the
+# injected modifiers are carried over to the following keys, like a real keyboard.
+class QuartzInjector:
+    def __init__(self, modifier_keycodes):
+        self._modifier_flags = {keycode: mod << MODIFIER_FLAGS_SHIFT for keycode, mod in modifier_keycodes.items()}
+        self._flags = 0
+        self._source = None
+        self._events = {}
+        # Events are reused, the hook and the injection worker may post at the same time.
+        self._lock = Lock()
+
+    def prepare(self, keycodes):
+        with self._lock:
+            for keycode in keycodes:
+                self._get_events(keycode)
+
+    # Returns the (up, down) events of a keycode.
+    def _get_events(self, keycode):
+        events = self._events.get(keycode)
+        if events is None:
+            if self._source is None:
+                self._source = Quartz.CGEventSourceCreate(Quartz.kCGEventSourceStateHIDSystemState)
+            events = (Quartz.CGEventCreateKeyboardEvent(self._source, keycode, False),
+                      Quartz.CGEventCreateKeyboardEvent(self._source, keycode, True))
+            # Tags the events so the key hook lets them through.
+            for event in events:
+                Quartz.CGEventSetIntegerValueField(event, Quartz.kCGKeyboardEventKeyboardType, INJECTED_KEYBOARD_TYPE)
+            self._events[keycode] = events
+        return events
+
+    def send(self, batch):
+        with self._lock:
+            flags = self._flags
+            for keycode, is_down in batch:
+                modifier_flag = self._modifier_flags.get(keycode, 0)
+                if modifier_flag:
+                    flags = flags | modifier_flag if is_down else flags & ~modifier_flag
+                event = self._get_events(keycode)[is_down]
+                Quartz.CGEventSetFlags(event, flags)
+                Quartz.CGEventPost(Quartz.kCGHIDEventTap, event)
+            self._flags = flags
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
 class MacApp(App):
     def __init__(self, log_file_path, argv):
         App.__init__(self, log_file_path, 'icons/systray-mac.png', argv)
@@ -45,52 +194,113 @@ class MacApp(App):
             self._config_filename = 'config/mac-client.yaml'
 
         self._moonlight_path = argv[2] if len(argv) > 2 else None
-        self._injected_keys = set()
+        self._moonlight = None
+        self._unicode_to_keycode_map = None
+
+        self._clipper = MouseClipper(ClipConfig(margin_left=MOUSE_CLIP_X_MARGIN, margin_right=MOUSE_CLIP_X_MARGIN))
+        self._trailing_warp_timer = TrailingWarpTimer(self._trailing_warp)
+        self._mouse_event_histogram = self._stats.histogram('darwin_mouse_event_listener')
+        self._key_event_histogram = self._stats.histogram('darwin_key_event_listener')
+        self._window_tracker = WindowTracker(MacWindowProvider(), self._on_moonlight_window_changed)
+        self._tap_watchdog = TapWatchdog(self._on_event_tap_recovered, is_active=lambda: self._input_state.enabled)
+        self._key_tap_monitor = self._tap_watchdog.monitor('keyboard')
+        self._mouse_tap_monitor = self._tap_watchdog.monitor('mouse')
 
     def start(self):
         self._load_config()
 
-        self._create_listeners()
-
         try:
-            self.kb_listener.start()
-            self.enable_input_handling = False
-            self.update_moonlight_window_bounds_thread = Thread(target=self._update_moonlight_window_bounds_loop, daemon=True)
-            self.update_moonlight_window_bounds_thread.start()
+            with startup_profile.phase('start hooks'):
+                self._launch_hooks()
+                self._window_tracker.start()
+            with startup_profile.phase('init systray'):
+                self._init_systray()
+            self._start_workers()
+            startup_profile.report()
             self.systray.run(lambda systray: self._run_moonlight())
             return 0
         finally:
-            self.mouse_listener.stop()
-            self.kb_listener.stop()
+            self._window_tracker.stop()
+            self._shutdown_hooks()
+            self._stop_workers()
+
+    def _start_hooks(self):
+        self._create_listeners()
+        self.kb_listener.start()
+        self._tap_watchdog.start()
+        # In process, the mouse hook starts along with Moonlight.
+        if self._hook_only:
+            self._start_mouse_hook()
+
+    def _start_mouse_hook(self):
+        # Don't swallow mouse moves for 0.25s after every warp.
+        Quartz.CGSetLocalEventsSuppressionInterval(0)
+        self._trailing_warp_timer.start()
+        self.mouse_listener.start()
+
+    def _stop_hooks(self):
+        self._tap_watchdog.stop()
+        self.mouse_listener.stop()
+        self._trailing_warp_timer.stop()
+        Quartz.CGSetLocalEventsSuppressionInterval(0.25)
+        self.kb_listener.stop()
+        self._release_injected_keys()
 
     def stop(self):
         try:
-            self.mouse_listener.stop()
-            self.kb_listener.stop()
-            for app in NSRunningApplication.runningApplicationsWithBundleIdentifier_(MOONLIGHT_BUNDLE_ID):
-                count = 0
-                pid = app.processIdentifier()
-                while count < 30 and pid_exists(pid): # app.isTerminated() is always false.
-                    app.forceTerminate()
-                    sleep(1)
-                    count += 1
+            self._shutdown_hooks()
+            # Terminates Moonlight, then kills it if it doesn't exit right away. _run_moonlight() stops the systray.
+            if self._moonlight is not None:
+                self._moonlight.stop()
+            elif self.systray is not None:
+                self.systray.stop()
         except Exception:
-            logger.exception('Failed to stop Moonlight.') 
+            logger.exception('Failed to stop Moonlight.')
     
-    def _update_moonlight_window_bounds_loop(self):
-        # If the window isn't the foremost window, and isn't in full screen mode (y != 0)
-        # Don't clip.
-        while True:
-            enable_input_handling = False
-            if get_active_app_bundle_id() == MOONLIGHT_BUNDLE_ID:
-                self._bounds = get_moonlight_window_bounds()
-                enable_input_handling = self._bounds is not None and self._bounds['Y'] == 0
-            # print(self.enable_input_handling)
-            self.enable_input_handling = enable_input_handling
-            sleep(0.25)
+    def _on_moonlight_window_changed(self, state):
+        logger.debug('Moonlight window state: %s', state)
+        self._publish_input_state(self._input_state_for_window(state, self._clipper.config.margins))
+
+    # The OS turned a tap off and it was re-enabled, the key ups in between were lost.
+    def _on_event_tap_recovered(self, name, reason):
+        self._release_injected_keys()
+
+    def _get_stats(self):
+        stats = App._get_stats(self)
+        if self._hook_process is None:
+            stats['event_taps'] = self._tap_watchdog.to_dict()
+            stats['coalesced_warps'] = self._clipper.coalesced_warps
+            stats['trailing_warps'] = self._clipper.trailing_warps
+        return stats
+
+    def _load_platform_config(self, config):
+        self._tap_watchdog.heartbeat_gap = config.get('event_tap_heartbeat_gap', 30)
+        clipper = MouseClipper(ClipConfig.from_config(config.get('mouse_clip', {}), MOUSE_CLIP_X_MARGIN))
+        # The count survives reloads.
+        clipper.coalesced_warps = self._clipper.coalesced_warps
+        clipper.trailing_warps = self._clipper.trailing_warps
+        self._clipper = clipper
+        # Republish the clip rectangle with the new margins. The hook process gets it from its parent.
+        if not self._hook_only:
+            self._on_moonlight_window_changed(self._window_tracker.state)
+
+    def _create_base_injector(self):
+        return QuartzInjector(self._get_modifier_keycodes())
 
     def _char_to_keycode(self, char):
-        return UNICODE_TO_KEYCODE_MAP.get(char)
+        # Building the map is slow, only do it when the compiled config cache misses.
+        if self._unicode_to_keycode_map is None:
+            from pynput._util.darwin import get_unicode_to_keycode_map
+            self._unicode_to_keycode_map = get_unicode_to_keycode_map()
+        return self._unicode_to_keycode_map.get(char)
+
+    def _get_keyboard_layout_id(self):
+        try:
+            from Foundation import CFPreferencesCopyAppValue
+            return str(CFPreferencesCopyAppValue('AppleCurrentKeyboardLayoutInputSourceID', 'com.apple.HIToolbox'))
+        except Exception:
+            logger.exception('Failed to get the keyboard layout.')
+            return ''
 
     def _create_listeners(self):
         self.mouse_listener = mouse.Listener(
@@ -99,117 +309,168 @@ class MacApp(App):
         self.kb_listener = keyboard.Listener(
             suppress=True,
             darwin_intercept=self._darwin_key_event_listener)
+        self._mouse_tap_monitor.tap = QuartzEventTap(self.mouse_listener)
+        self._key_tap_monitor.tap = QuartzEventTap(self.kb_listener)
+
+    # Both tap disabled event types sort after every real event type.
+    def _on_event_tap_disabled(self, monitor, event_type):
+        monitor.disabled(DISABLED_BY_TIMEOUT if event_type == Quartz.kCGEventTapDisabledByTimeout else DISABLED_BY_USER_INPUT)
 
     def _darwin_mouse_event_listener(self, event_type, event):
+        start_time = perf_counter_ns()
+        verdict = CLIP_NONE
+        kind = KIND_MOUSE
         try:
             # If Moonlight isn't the active window, don't process.
-            if event_type == Quartz.kCGEventMouseMoved and self.enable_input_handling and self._bounds is not None:
-                bounds = self._bounds
+            input_state = self._input_state
+            if event_type == Quartz.kCGEventMouseMoved and input_state.clipping:
+                kind = KIND_MOUSE | KIND_ACTIVE
                 # Clip the mouse to keep it close to the Moonlight window.
-                # Extend Moonlight window bounds horizontally.
-                min_x = bounds['X']
-                max_x = min_x + bounds['Width']
-                min_x -= MOUSE_CLIP_X_MARGIN
-                max_x += MOUSE_CLIP_X_MARGIN
-                min_y = 0
-                max_y = bounds['Y'] + bounds['Height']
                 (x, y) = Quartz.CGEventGetLocation(event)
-                clipped_x = clip(x, min_x, max_x)
-                clipped_y = clip(y, min_y, max_y)
-                # logger.info('x: [{}, {}] y:[{}, {}]'.format(min_x, max_x, min_y, max_y))
-                if x != clipped_x or y != clipped_y:
-                    Quartz.CGSetLocalEventsSuppressionInterval(0)
-                    Quartz.CGWarpMouseCursorPosition((clipped_x, clipped_y))
-                    Quartz.CGSetLocalEventsSuppressionInterval(0.25)
-                    
+                clipper = self._clipper
+                verdict = clipper.clip(input_state, x, y)
+                if verdict != CLIP_NONE:
+                    clipped = (clipper.x, clipper.y)
+                    Quartz.CGEventSetLocation(event, clipped)
+                    if verdict == CLIP_WARP:
+                        # Local events suppression is turned off while the mouse listener runs.
+                        Quartz.CGWarpMouseCursorPosition(clipped)
+                        self._stats.warps += 1
+                    elif clipper.pending_warp:
+                        self._trailing_warp_timer.arm()
+
+            elif event_type >= Quartz.kCGEventTapDisabledByTimeout:
+                self._on_event_tap_disabled(self._mouse_tap_monitor, event_type)
+
             return event
         except Exception:
             # Make sure mouse events are still being passed in error case
+            self._stats.exceptions += 1
             logger.exception('Exception was thrown in the mouse event listener.')
             return event
+        finally:
+            end_time = perf_counter_ns()
+            self._mouse_event_histogram.record(end_time - start_time)
+            self._mouse_tap_monitor.callback_done(end_time - start_time, end_time)
+            self._trace.record(end_time, event_type, 0, 0, 0, verdict, kind, 0, end_time - start_time)
+
+    # Warps the cursor back if the flick stopped outside within the coalescing interval.
+    # Called from the trailing warp timer.
+    def _trailing_warp(self):
+        clipper = self._clipper
+        try:
+            delay = clipper.take_trailing_warp()
+            if delay == 0 and self._input_state.clipping:
+                Quartz.CGWarpMouseCursorPosition((clipper.x, clipper.y))
+                clipper.trailing_warps += 1
+            return delay
+        except Exception:
+            logger.exception('Failed to warp the mouse cursor.')
+            return None
 
     def _darwin_key_event_listener(self, event_type, event):
+        start_time = perf_counter_ns()
+        keycode = flags = mods = 0
+        verdict = PASS
+        kind = KIND_KEY
         try:
+            if event_type >= Quartz.kCGEventTapDisabledByTimeout:
+                self._on_event_tap_disabled(self._key_tap_monitor, event_type)
+                return event
+
+            keycode = Quartz.CGEventGetIntegerValueField(event, Quartz.kCGKeyboardEventKeycode)
             keyboard_type = Quartz.CGEventGetIntegerValueField(event, Quartz.kCGKeyboardEventKeyboardType)
             # Ignore injected keys.
-            if keyboard_type == 70:
+            if keyboard_type == INJECTED_KEYBOARD_TYPE:
+                kind = KIND_INJECTED
+                self._stats.passed += 1
                 return event
 
             # If Moonlight isn't the active window, don't process.
-            if not self.enable_input_handling:
+            if not self._input_state.enabled:
+                self._stats.passed += 1
                 return event
+            kind = KIND_ACTIVE | KIND_DOWN if event_type == Quartz.kCGEventKeyDown else KIND_ACTIVE
 
             # Parsing the event.
             flags = Quartz.CGEventGetFlags(event)
-            keycode = Quartz.CGEventGetIntegerValueField(event, Quartz.kCGKeyboardEventKeycode)
+            mods = (flags >> MODIFIER_FLAGS_SHIFT) & 0xF
 
             # Make sure remapped modifier flags are not leaked along with non-remapped keys.
-            filtered_flags = flags & ~(Quartz.kCGEventFlagMaskControl | Quartz.kCGEventFlagMaskAlternate | Quartz.kCGEventFlagMaskCommand)
-            Quartz.CGEventSetFlags(event, filtered_flags)
+            Quartz.CGEventSetFlags(event, flags & FILTERED_MODIFIER_FLAGS)
 
             if event_type == Quartz.kCGEventKeyDown or event_type == Quartz.kCGEventKeyUp:
-                return self._darwin_key_press_event(event_type, event, keycode, flags)
+                verdict = self._darwin_key_press_event(event_type, keycode, mods)
             elif event_type == Quartz.kCGEventFlagsChanged:
-                return self._darwin_key_flags_changed_event(event, keycode, flags)
+                verdict = self._darwin_key_flags_changed_event(keycode, mods)
+            return event if verdict == PASS else None
         except Exception:
             # Make sure key events are still being passed in error case
+            self._stats.exceptions += 1
             logger.exception('Exception was thrown in the key event listener.')
             return event
-            
-    def _darwin_key_flags_changed_event(self, event, keycode, flags):
-        is_ctrl_key = keycode == Key.ctrl.value.vk or keycode == Key.ctrl_l.value.vk or keycode == Key.ctrl_r.value.vk
-        is_alt_key = keycode == Key.alt.value.vk or keycode == Key.alt_l.value.vk or keycode == Key.alt_r.value.vk
-        is_cmd_key = keycode == Key.alt.value.vk or keycode == Key.cmd_l.value.vk or keycode == Key.cmd_r.value.vk
-
-        is_key_down = None
-        if is_ctrl_key:
-            is_key_down = flags & Quartz.kCGEventFlagMaskControl == Quartz.kCGEventFlagMaskControl
-        elif is_alt_key:
-            is_key_down = flags & Quartz.kCGEventFlagMaskAlternate == Quartz.kCGEventFlagMaskAlternate
-        elif is_cmd_key:
-            is_key_down = flags & Quartz.kCGEventFlagMaskCommand == Quartz.kCGEventFlagMaskCommand
+        finally:
+            end_time = perf_counter_ns()
+            self._key_event_histogram.record(end_time - start_time)
+            self._key_tap_monitor.callback_done(end_time - start_time, end_time)
+            self._trace.record(end_time, event_type, keycode, flags, mods, verdict, kind, self._keymap.profile_index,
+                               end_time - start_time)
+
+    # The handlers return what happened to the event, it is swallowed unless PASS.
+    def _darwin_key_flags_changed_event(self, keycode, mods):
+        keymap = self._keymap
+        modifier = keymap.modifier_of(keycode)
 
         # Translate the key
-        if is_key_down is not None and keycode in self._remap_keys:
-            to = self._remap_keys.get(keycode)
-            logger.debug('Remapping {}->{}'.format(keycode, to))
+        if modifier & (MOD_CTRL | MOD_ALT | MOD_CMD) and keymap.decide(mods, keycode) == REMAP:
+            is_key_down = mods & modifier != 0
+            to = keymap.remap_target(keycode)
+            logger.debug('Remapping %d->%d', keycode, to)
             # Simulate target key.
-            self._kb_controller.touch(KeyCode.from_vk(to), is_key_down)
-            if is_key_down:
-                self._injected_keys.add(to)
-            else:
-                self._injected_keys.discard(to)
-            return None
-        return event
-
-    def _darwin_key_press_event(self, event_type, event, keycode, flags):
+            if not self._track_remapped_key(keymap, keycode, to, is_key_down):
+                return SUPPRESS
+            self._injector.send(((to, is_key_down),))
+            self._stats.remapped += 1
+            return REMAP
+        self._stats.passed += 1
+        return PASS
+
+    def _darwin_key_press_event(self, event_type, keycode, mods):
         is_key_down = event_type == Quartz.kCGEventKeyDown
-        is_ctrl_down = flags & Quartz.kCGEventFlagMaskControl == Quartz.kCGEventFlagMaskControl
-        is_alt_down = flags & Quartz.kCGEventFlagMaskAlternate == Quartz.kCGEventFlagMaskAlternate
-        is_cmd_down = flags & Quartz.kCGEventFlagMaskCommand == Quartz.kCGEventFlagMaskCommand
-        is_shift_down = flags & Quartz.kCGEventFlagMaskShift == Quartz.kCGEventFlagMaskShift
-        key_with_modifiers_tuple = (is_ctrl_down, is_alt_down, is_cmd_down, is_shift_down, keycode)
 
-        # logger.debug('{} {} ctrl: {} alt: {} cmd: {} shift: {}'.format(keycode, 'down' if is_key_down else 'up', is_ctrl_down, is_alt_down, is_cmd_down, is_shift_down))
+        # logger.debug('{} {} mods: {}'.format(keycode, 'down' if is_key_down else 'up', mods))
+
+        keymap = self._keymap
+        action = keymap.decide(mods, keycode)
+        # Macro chords and sequences, their last key gets the action.
+        hotkey_matcher = keymap.hotkey_matcher
+        if hotkey_matcher is not None:
+            action = hotkey_matcher.feed(mods, keycode, is_key_down) or action
+
+        # The macro plays on the scheduler thread, the trigger key is swallowed.
+        if action >= MACRO or (not is_key_down and self._macro_triggers):
+            if self._handle_macro_key(action, keycode, is_key_down) == MACRO:
+                self._stats.suppressed += 1
+                return MACRO
 
         # If the key is in the passthrough hotkey list, bypass our modifiers filtering.
-        if key_with_modifiers_tuple in self._passthrough_hotkeys:
-            logger.debug('Passthrough hotkey: {}'.format(key_with_modifiers_tuple))
+        if action == PASSTHROUGH:
+            logger.debug('Passthrough hotkey: %d %d', mods, keycode)
 
             # Unpress injected keys
-            for injected_key in self._injected_keys:
-                self._kb_controller.touch(KeyCode.from_vk(injected_key), False)
-            self._injected_keys.clear()
-                
-            # Simulate modifiers.
-            if key_with_modifiers_tuple[0]: self._kb_controller.touch(Key.ctrl, is_key_down)
-            if key_with_modifiers_tuple[1]: self._kb_controller.touch(Key.alt, is_key_down)
-            if key_with_modifiers_tuple[2]: self._kb_controller.touch(Key.cmd, is_key_down)
-            if key_with_modifiers_tuple[3]: self._kb_controller.touch(Key.shift, is_key_down)
-            self._kb_controller.touch(KeyCode.from_vk(key_with_modifiers_tuple[4]), is_key_down)
-            return None
+            batch = [(injected_key, False) for injected_key in self._injected_keys.release_all()]
 
-        return event
+            # Simulate modifiers, then the key, as one chord.
+            for mod, modifier_keycode in PASSTHROUGH_MODIFIER_KEYCODES:
+                if mods & mod:
+                    batch.append((modifier_keycode, is_key_down))
+            batch.append((keycode, is_key_down))
+            self._injector.send(batch)
+            self._stats.passthrough += 1
+            return PASSTHROUGH
+
+        self._stats.passed += 1
+        return PASS
 
     def _open_file_with_associated_app(self, path):
         subprocess.Popen(['open', path])
@@ -223,10 +484,16 @@ class MacApp(App):
             return 1
 
         self.systray.visible = True
-        self.mouse_listener.start()
+        if self._hook_process is None:
+            self._start_mouse_hook()
         logger.info('Listening for key & mouse events until Moonlight quits...')
-        exit_code = system('open -W {}'.format(self._moonlight_path))
-        logger.info('Moonlight terminated with code %d. Exiting...', exit_code)
+        options = self._compiled_config.options
+        self._moonlight = ProcessSupervisor(self._supervisor_loop, [get_bundle_executable(self._moonlight_path)],
+                                            restart_on_crash=options.get('restart_moonlight_on_crash', False),
+                                            max_restarts=options.get('max_moonlight_restarts', 3))
+        self._moonlight.start()
+        exit_code = self._moonlight.wait()
+        logger.info('Moonlight terminated with code %s. Exiting...', exit_code)
 
         self.systray.stop()
 
@@ -0,0 +1,271 @@
+# Key macros: compiled at config load into batches at fixed offsets, played by a scheduler
+# thread off a timer wheel, so the hooks only hand a macro over and never wait on it.
+from threading import Thread, Condition
+from time import perf_counter_ns
+import logging
+
+from .hotkey_trie import split_hotkeys
+from .stats import Histogram
+
+logger = logging.getLogger('moonlight-desktop')
+
+# A compiled macro. batches: ((offset ns, ((keycode, is_down), ...)), ...) in play order.
+class Macro:
+    def __init__(self, name, trigger, batches):
+        self.name = name
+        # The hotkey_trie rule starting the macro.
+        self.trigger = trigger
+        self.batches = batches
+
+    @property
+    def duration_ns(self):
+        return self.batches[-1][0] if self.batches else 0
+
+    def keycodes(self):
+        return {keycode for _, batch in self.batches for keycode, _ in batch}
+
+    def to_dict(self):
+        return {'name': self.name, 'trigger': self.trigger, 'batches': self.batches}
+
+    @staticmethod
+    def from_dict(data):
+        return Macro(data['name'], data['trigger'],
+                     tuple((offset, tuple((keycode, is_down) for keycode, is_down in batch)) for offset, batch in data['batches']))
+
+# Compiles the steps of a macro in the config. Each step is one of
+#   tap: '<ctrl>+<alt>+<end>'   press the keys in order, release them in reverse, optional hold: seconds
+#   down: '<alt>'               press keys
+#   up: '<alt>'                 release keys
+#   delay: 0.05                 wait
+# parse_key: returns the keycode of a key name.
+def compile_macro(name, trigger, steps, parse_key):
+    batches = []
+    offset = 0
+    held = []
+
+    def add_batch(batch):
+        if batches and batches[-1][0] == offset:
+            batches[-1] = (offset, batches[-1][1] + batch)
+        else:
+            batches.append((offset, batch))
+
+    for step in steps:
+        if 'delay' in step:
+            offset += int(step['delay'] * 1e9)
+            continue
+        kind = next((kind for kind in ('tap', 'down', 'up') if kind in step), None)
+        if kind is None:
+            raise RuntimeError('Invalid step in macro {}: {}'.format(name, step))
+        keycodes = [parse_key(key_name) for key_name in step[kind].split('+')]
+        if kind in ('tap', 'down'):
+            for keycode in keycodes:
+                if keycode in held:
+                    raise RuntimeError('Macro {} presses {} twice.'.format(name, step[kind]))
+                held.append(keycode)
+            add_batch(tuple((keycode, True) for keycode in keycodes))
+        if kind == 'tap':
+            # Separate batches, the up of a tap must not land in the same chord as its down.
+            offset += int(step.get('hold', 0) * 1e9)
+            batches.append((offset, ()))
+        if kind in ('tap', 'up'):
+            for keycode in keycodes:
+                if keycode not in held:
+                    raise RuntimeError('Macro {} releases {} without pressing it.'.format(name, step[kind]))
+                held.remove(keycode)
+            add_batch(tuple((keycode, False) for keycode in reversed(keycodes)))
+    if held:
+        raise RuntimeError('Macro {} leaves keys down: {}'.format(name, held))
+    return Macro(name, trigger, tuple(batches))
+
+# The triggers of the macros for a Keymap: {(mods, keycode): index} of the single key ones and
+# [(rule, index)] of the chords and sequences.
+def macro_triggers(macros):
+    hotkeys = {}
+    sequences = []
+    for index, macro in enumerate(macros):
+        single_keys, multi_keys = split_hotkeys([macro.trigger])
+        for hotkey in single_keys:
+            hotkeys[hotkey] = index
+        sequences.extend((rule, index) for rule in multi_keys)
+    return hotkeys, sequences
+
+# A macro being played. Only touched under the scheduler lock.
+class MacroRun:
+    __slots__ = ('macro', 'start_time', 'held', 'cancelled', 'remaining')
+
+    def __init__(self, macro, start_time):
+        self.macro = macro
+        self.start_time = start_time
+        self.held = set()
+        self.cancelled = False
+        self.remaining = len(macro.batches)
+
+# Plays macros on its own thread. Batches are kept in a hashed timer wheel of tick_ns slots,
+# an entry due beyond one turn of the wheel waits in its slot for its tick to come round.
+# The thread sleeps until the earliest entry of the next non empty slot is due, not tick by tick.
+# send(batch) injects a batch, jitter is the dispatch time minus the requested time. Batches,
+# the releases of cancelled macros too, are collected under the condition and sent by the
+# scheduler thread after it is released, so play() and cancel_all() from the hooks never wait
+# on an injection. Only that thread sends, the batches go out in the order they were collected.
+class MacroScheduler:
+    def __init__(self, send, tick_ns=500000, wheel_size=1024, clock=perf_counter_ns):
+        self._send = send
+        self._tick_ns = tick_ns
+        self._wheel = [[] for _ in range(wheel_size)]
+        self._clock = clock
+        self._condition = Condition()
+        # (run, batch) releasing the keys of cancelled runs, sent before anything due after the cancel.
+        self._cancel_sends = []
+        self._current_tick = clock() // tick_ns
+        self._runs = []
+        self._pending = 0
+        self._stopped = False
+        self._thread = None
+
+        self.jitter = Histogram()
+        self.started = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.batches = 0
+
+    def start(self):
+        self._stopped = False
+        self._thread = Thread(target=self._run, name='moonlight-desktop-macros', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.cancel_all()
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(1)
+            self._thread = None
+
+    # Schedules a macro, returns right away. Called from the hooks.
+    def play(self, macro):
+        start_time = self._clock()
+        run = MacroRun(macro, start_time)
+        with self._condition:
+            if self._pending == 0:
+                # The wheel was idle, don't make _advance() walk the ticks since.
+                self._current_tick = start_time // self._tick_ns
+            self._runs.append(run)
+            for index, (offset, _) in enumerate(macro.batches):
+                due_time = start_time + offset
+                tick = max(due_time // self._tick_ns, self._current_tick)
+                self._wheel[tick % len(self._wheel)].append((tick, due_time, run, index))
+            self._pending += len(macro.batches)
+            self.started += 1
+            self._condition.notify()
+        logger.debug('Playing macro %s.', macro.name)
+        return run
+
+    # Stops every macro being played and has the scheduler thread release the keys they hold,
+    # e.g. on focus loss.
+    def cancel_all(self):
+        with self._condition:
+            runs, self._runs = self._runs, []
+            for run in runs:
+                self._cancel(run, self._cancel_sends)
+            self._condition.notify()
+
+    # Appends the (run, batch) releasing the keys of run to sends.
+    def _cancel(self, run, sends):
+        run.cancelled = True
+        self.cancelled += 1
+        if run.held:
+            sends.append((run, tuple((keycode, False) for keycode in run.held)))
+            run.held.clear()
+        logger.debug('Cancelled macro %s.', run.macro.name)
+
+    # Sends the collected (run, batch) pairs. Called from the scheduler thread only.
+    def _send_batches(self, sends):
+        for run, batch in sends:
+            try:
+                self._send(batch)
+            except Exception:
+                logger.exception('Failed to play macro %s.', run.macro.name)
+
+    # Appends the (run, batch) of the entry to sends.
+    def _fire(self, due_time, run, index, sends):
+        if run.cancelled:
+            return
+        batch = run.macro.batches[index][1]
+        self.jitter.record(self._clock() - due_time)
+        if batch:
+            sends.append((run, batch))
+            self.batches += 1
+        for keycode, is_down in batch:
+            if is_down:
+                run.held.add(keycode)
+            else:
+                run.held.discard(keycode)
+        run.remaining -= 1
+        if run.remaining == 0:
+            self._runs.remove(run)
+            self.completed += 1
+
+    # Fires the entries due by now, returns the seconds until the next one is due and the
+    # (run, batch) pairs to send. The tick of now is kept current, its entries due later in
+    # the tick fire on a later call.
+    def _advance(self):
+        wheel = self._wheel
+        wheel_size = len(wheel)
+        now = self._clock()
+        now_tick = now // self._tick_ns
+        sends = []
+        while True:
+            tick = self._current_tick
+            slot = wheel[tick % wheel_size]
+            if slot:
+                due = [entry for entry in slot if entry[0] <= tick and entry[1] <= now]
+                if due:
+                    slot[:] = [entry for entry in slot if not (entry[0] <= tick and entry[1] <= now)]
+                    self._pending -= len(due)
+                    # In play order, the batches of a run must not overtake each other.
+                    for _, due_time, run, index in sorted(due, key=lambda entry: entry[1]):
+                        try:
+                            self._fire(due_time, run, index, sends)
+                        except Exception:
+                            logger.exception('Failed to play macro %s.', run.macro.name)
+            if tick >= now_tick:
+                break
+            self._current_tick = tick + 1
+
+        if self._pending == 0:
+            return None, sends
+        # The earliest entry of the next non empty tick within a turn of the wheel, else a turn.
+        for tick in range(self._current_tick, self._current_tick + wheel_size):
+            due_times = [entry[1] for entry in wheel[tick % wheel_size] if entry[0] <= tick]
+            if due_times:
+                return max(min(due_times) - self._clock(), 0) / 1e9, sends
+        return wheel_size * self._tick_ns / 1e9, sends
+
+    # Once stopped, the releases of the runs cancelled by stop() still go out before it returns.
+    def _run(self):
+        with self._condition:
+            while True:
+                timeout, sends = self._advance()
+                if self._cancel_sends:
+                    sends[:0] = self._cancel_sends
+                    self._cancel_sends = []
+                if sends:
+                    self._condition.release()
+                    try:
+                        self._send_batches(sends)
+                    finally:
+                        self._condition.acquire()
+                elif self._stopped:
+                    break
+                elif timeout != 0:
+                    self._condition.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'started': self.started,
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+            'batches': self.batches,
+            'jitter_ns': self.jitter.to_dict(),
+        }
@@ -0,0 +1,99 @@
+from contextlib import contextmanager, nullcontext
+from importlib.abc import MetaPathFinder
+from time import perf_counter_ns
+import logging
+import sys
+
+logger = logging.getLogger('moonlight-desktop')
+
+# Times module execution like `python -X importtime`, which isn't available to frozen apps.
+class _TimingLoader:
+    def __init__(self, profiler, loader):
+        self._profiler = profiler
+        self._loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        profiler = self._profiler
+        profiler._stack.append(0)
+        start_time = perf_counter_ns()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            cumulative = perf_counter_ns() - start_time
+            nested = profiler._stack.pop()
+            if profiler._stack:
+                profiler._stack[-1] += cumulative
+            profiler.imports.append((module.__name__, cumulative - nested, cumulative))
+
+class _TimingFinder(MetaPathFinder):
+    def __init__(self, profiler):
+        self._profiler = profiler
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimingLoader(self._profiler, spec.loader)
+                return spec
+        return None
+
+class StartupProfiler:
+    def __init__(self):
+        self._start_time = perf_counter_ns()
+        self._finder = _TimingFinder(self)
+        self._stack = []
+        self.imports = []
+        self.phases = []
+
+    def install(self):
+        sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self):
+        if self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+
+    @contextmanager
+    def phase(self, name):
+        start_time = perf_counter_ns()
+        try:
+            yield
+        finally:
+            end_time = perf_counter_ns()
+            self.phases.append((name, end_time - start_time, end_time - self._start_time))
+
+    def format_report(self):
+        lines = ['Startup phases [ms] (duration | since start):']
+        for name, duration, since_start in self.phases:
+            lines.append('{:>10.2f} | {:>10.2f} | {}'.format(duration / 1e6, since_start / 1e6, name))
+        lines.append('import time: self [us] | cumulative | imported module')
+        for name, self_time, cumulative in self.imports:
+            lines.append('import time: {:>9} | {:>10} | {}'.format(self_time // 1000, cumulative // 1000, name))
+        return '\n'.join(lines)
+
+_profiler = None
+
+def enable():
+    global _profiler
+    _profiler = StartupProfiler()
+    _profiler.install()
+    return _profiler
+
+def phase(name):
+    return _profiler.phase(name) if _profiler is not None else nullcontext()
+
+# Logs the report once startup is done, later imports aren't tracked.
+def report():
+    global _profiler
+    if _profiler is not None:
+        _profiler.uninstall()
+        logger.info(_profiler.format_report())
+        _profiler = None
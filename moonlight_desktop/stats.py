@@ -0,0 +1,133 @@
+from threading import Thread, Event
+from os import replace
+import json
+import logging
+
+logger = logging.getLogger('moonlight-desktop')
+
+# Log-linear buckets like HdrHistogram: values below 2 * SUB_BUCKET_COUNT are exact,
+# above that every power of two is split into SUB_BUCKET_COUNT buckets (~6% precision).
+SUB_BUCKET_BITS = 4
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+
+class Histogram:
+    __slots__ = ('_counts', 'count', 'total', 'min', 'max')
+
+    # The default range covers up to ~18 minutes in ns.
+    def __init__(self, max_bits=40):
+        self._counts = [0] * ((max_bits - SUB_BUCKET_BITS + 1) << SUB_BUCKET_BITS)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        if shift < 0:
+            index = value
+        else:
+            index = (shift << SUB_BUCKET_BITS) + (value >> shift)
+        counts = self._counts
+        if index >= len(counts):
+            index = len(counts) - 1
+        counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    @staticmethod
+    def _bucket_value(index):
+        if index < SUB_BUCKET_COUNT << 1:
+            return index
+        shift = (index >> SUB_BUCKET_BITS) - 1
+        return (index - (shift << SUB_BUCKET_BITS)) << shift
+
+    def percentile(self, percent):
+        if self.count == 0:
+            return 0
+        threshold = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if count and seen >= threshold:
+                return min(self._bucket_value(index), self.max)
+        return self.max
+
+    def reset(self):
+        counts = self._counts
+        for index in range(len(counts)):
+            counts[index] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0,
+            'min': self.min or 0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p99.9': self.percentile(99.9),
+            'max': self.max,
+        }
+
+class Stats:
+    COUNTERS = ('passed', 'suppressed', 'remapped', 'passthrough', 'warps', 'exceptions')
+
+    # Counters are only incremented from the hook threads, so plain attributes are good enough.
+    def __init__(self, callback_names=()):
+        self.callbacks = {name: Histogram() for name in callback_names}
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+
+    def histogram(self, name):
+        histogram = self.callbacks.get(name)
+        if histogram is None:
+            histogram = self.callbacks[name] = Histogram()
+        return histogram
+
+    def to_dict(self):
+        return {
+            'counters': {name: getattr(self, name) for name in self.COUNTERS},
+            'callbacks_ns': {name: histogram.to_dict() for name, histogram in self.callbacks.items()},
+        }
+
+# Periodically writes stats to a JSON file.
+class StatsDumper:
+    def __init__(self, get_stats, file_path, interval=60):
+        self._get_stats = get_stats
+        self.file_path = file_path
+        self._interval = interval
+        self._stopped = Event()
+        self._thread = None
+
+    def dump(self):
+        temp_file_path = self.file_path + '.tmp'
+        with open(temp_file_path, 'w') as stats_file:
+            json.dump(self._get_stats(), stats_file, indent=2)
+        replace(temp_file_path, self.file_path)
+
+    def start(self):
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.dump()
+            except Exception:
+                logger.exception('Failed to write stats to %s.', self.file_path)
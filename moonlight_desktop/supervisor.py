@@ -0,0 +1,208 @@
+# Runs and watches child processes from an asyncio loop on a background thread. Exits are
+# waited for on an OS handle: a pidfd on Linux, a kqueue on macOS, the process handle on
+# Windows. Nothing polls, so stopping a child takes as long as the child takes to exit.
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import Thread, Event
+import asyncio
+import logging
+import os
+import select
+import subprocess
+
+logger = logging.getLogger('moonlight-desktop')
+
+class EventLoopThread:
+    def __init__(self, name='moonlight-desktop-supervisor'):
+        self._name = name
+        self._thread = None
+        self.loop = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self.loop.run_forever, name=self._name, daemon=True)
+        self._thread.start()
+
+    # Cancels the tasks left on the loop and stops it. The loop is only closed once its
+    # thread is gone, closing a running loop raises.
+    def stop(self, timeout=1.0):
+        if self._thread is None:
+            return
+        loop, thread = self.loop, self._thread
+        self._thread = None
+        self.loop = None
+        try:
+            asyncio.run_coroutine_threadsafe(_cancel_tasks(), loop).result(timeout)
+        except FutureTimeoutError:
+            logger.warning('Tasks of %s didn\'t finish after being cancelled.', self._name)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning('%s is still running, leaving its loop open.', self._name)
+            return
+        loop.close()
+
+    # Runs a coroutine on the loop, returns a concurrent.futures.Future of its result.
+    def submit(self, coro):
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+async def _cancel_tasks():
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+# Returns (fd, close) of a handle that turns readable when pid exits, or None if the platform has none.
+def _open_exit_handle(pid):
+    if hasattr(os, 'pidfd_open'):
+        fd = os.pidfd_open(pid)
+        return fd, lambda: os.close(fd)
+    if hasattr(select, 'kqueue'):
+        kq = select.kqueue()
+        try:
+            kq.control([select.kevent(pid, select.KQ_FILTER_PROC, select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
+                                      select.KQ_NOTE_EXIT)], 0)
+        except OSError:
+            kq.close()
+            raise
+        return kq.fileno(), kq.close
+    return None
+
+# Waits for a subprocess.Popen to exit and returns its exit code.
+async def wait_for_exit(process):
+    loop = asyncio.get_running_loop()
+    try:
+        handle = _open_exit_handle(process.pid)
+    except OSError:
+        # Already gone, wait() returns right away.
+        handle = None
+    if handle is None:
+        # Windows: wait() blocks a worker thread on the process handle.
+        return await loop.run_in_executor(None, process.wait)
+
+    fd, close = handle
+    exited = loop.create_future()
+    loop.add_reader(fd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(fd)
+        close()
+    # Only reaps the exited child.
+    return process.wait()
+
+# Terminates a process, kills it if it is still there after terminate_timeout. exit_future
+# is the pending wait_for_exit() of the process. Returns the exit code, None if even the
+# kill didn't do it in kill_timeout.
+async def terminate_process(process, exit_future, terminate_timeout=0.5, kill_timeout=0.5):
+    for signal_process, timeout in ((process.terminate, terminate_timeout), (process.kill, kill_timeout)):
+        if exit_future.done():
+            break
+        try:
+            signal_process()
+        except OSError:
+            pass
+        try:
+            return await asyncio.wait_for(asyncio.shield(exit_future), timeout)
+        except asyncio.TimeoutError:
+            pass
+    return exit_future.result() if exit_future.done() else None
+
+# Runs a command to completion without blocking the caller's thread, terminates it after timeout.
+async def run_command(argv, timeout=10.0):
+    process = subprocess.Popen(argv, stdin=subprocess.DEVNULL)
+    exit_future = asyncio.ensure_future(wait_for_exit(process))
+    try:
+        return await asyncio.wait_for(asyncio.shield(exit_future), timeout)
+    except asyncio.TimeoutError:
+        logger.warning('%s took longer than %.1fs, terminating it.', argv[0], timeout)
+        return await terminate_process(process, exit_future)
+
+# Launches argv and watches it. A crash, i.e. a non zero exit code, restarts it if
+# restart_on_crash is set, up to max_restarts times. on_exit(exit_code) is called once
+# it is gone for good, from the loop thread.
+class ProcessSupervisor:
+    def __init__(self, loop_thread, argv, on_exit=None, restart_on_crash=False, max_restarts=3, restart_delay=1.0,
+                 terminate_timeout=0.5, kill_timeout=0.5, popen=subprocess.Popen):
+        self._loop_thread = loop_thread
+        self._argv = argv
+        self._on_exit = on_exit
+        self._restart_on_crash = restart_on_crash
+        self._max_restarts = max_restarts
+        self._restart_delay = restart_delay
+        self._terminate_timeout = terminate_timeout
+        self._kill_timeout = kill_timeout
+        self._popen = popen
+        self._process = None
+        self._exit_future = None
+        self._stop_event = None
+        self._task = None
+        self._stopping = False
+        self._done = Event()
+        self.restarts = 0
+        self.exit_code = None
+
+    @property
+    def pid(self):
+        process = self._process
+        return process.pid if process is not None else None
+
+    def start(self):
+        self._stopping = False
+        self._done.clear()
+        self._task = self._loop_thread.submit(self._supervise())
+
+    # Stops the process and waits for it, returns its exit code.
+    def stop(self, timeout=5.0):
+        if self._task is None:
+            return self.exit_code
+        return self._loop_thread.submit(self._stop()).result(timeout)
+
+    # Blocks until the process is gone for good, returns its exit code.
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.exit_code
+
+    async def _supervise(self):
+        self._stop_event = asyncio.Event()
+        try:
+            while not self._stopping:
+                self._process = self._popen(self._argv)
+                logger.info('Started %s with pid %d.', self._argv[0], self._process.pid)
+                self._exit_future = asyncio.ensure_future(wait_for_exit(self._process))
+                self.exit_code = await self._exit_future
+                if self._stopping or self.exit_code == 0 or not self._restart_on_crash:
+                    break
+                if self.restarts >= self._max_restarts:
+                    logger.error('%s crashed %d times, not restarting it.', self._argv[0], self.restarts + 1)
+                    break
+                self.restarts += 1
+                logger.warning('%s exited with code %s, restarting it in %.1fs.', self._argv[0], self.exit_code, self._restart_delay)
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), self._restart_delay)
+                except asyncio.TimeoutError:
+                    pass
+        except Exception:
+            logger.exception('Failed to run %s.', self._argv[0])
+        finally:
+            self._done.set()
+            if self._on_exit is not None:
+                try:
+                    self._on_exit(self.exit_code)
+                except Exception:
+                    logger.exception('Failed to handle the exit of %s.', self._argv[0])
+
+    async def _stop(self):
+        self._stopping = True
+        if self._stop_event is not None:
+            self._stop_event.set()
+        process = self._process
+        if process is not None and self._exit_future is not None and not self._exit_future.done():
+            exit_code = await terminate_process(process, self._exit_future, self._terminate_timeout, self._kill_timeout)
+            if exit_code is None:
+                logger.error('%s (pid %d) didn\'t exit after being killed.', self._argv[0], process.pid)
+                return None
+        await asyncio.wrap_future(self._task)
+        return self.exit_code
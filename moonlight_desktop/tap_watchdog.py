@@ -0,0 +1,149 @@
+from collections import deque
+from threading import Thread, Event, Lock
+from time import perf_counter_ns, time
+import logging
+
+logger = logging.getLogger('moonlight-desktop')
+
+# Why a tap had to be re-enabled.
+DISABLED_BY_TIMEOUT = 'timeout'
+DISABLED_BY_USER_INPUT = 'user_input'
+# The tap was found disabled without us being told, e.g. the disable event was lost.
+FOUND_DISABLED = 'found_disabled'
+# No callback for longer than the heartbeat gap while input was handled, the tap may be dead
+# or starved without the OS saying so.
+HEARTBEAT_GAP = 'heartbeat_gap'
+
+# What the watchdog needs from an OS event tap.
+class EventTap:
+    def is_enabled(self):
+        raise NotImplementedError()
+
+    def enable(self):
+        raise NotImplementedError()
+
+# Health of one tap. The hook calls callback_done() after every event and disabled()
+# when the OS reports the tap was turned off.
+class TapMonitor:
+    __slots__ = ('name', 'tap', 'last_callback_ns', 'slowest_callback_ns', 'last_callback_time', 'gap_reported', '_watchdog')
+
+    def __init__(self, watchdog, name, tap=None):
+        self._watchdog = watchdog
+        self.name = name
+        self.tap = tap
+        self.last_callback_ns = 0
+        self.slowest_callback_ns = 0
+        self.last_callback_time = perf_counter_ns()
+        # A gap is reported once, until the next callback.
+        self.gap_reported = False
+
+    # end_time is the perf_counter_ns() the callback ended at.
+    def callback_done(self, duration_ns, end_time):
+        self.last_callback_ns = duration_ns
+        self.last_callback_time = end_time
+        self.gap_reported = False
+        if duration_ns > self.slowest_callback_ns:
+            self.slowest_callback_ns = duration_ns
+
+    def disabled(self, reason):
+        self._watchdog.recover(self, reason)
+
+# Re-enables event taps the OS turned off and keeps a record of it. Disable events are
+# handled right away on the tap thread, a background check catches taps found disabled
+# and heartbeat gaps: no callback for heartbeat_gap seconds while is_active(). On a gap the
+# tap is only enabled again, which is a no-op if it still is, and counted. on_recover is
+# called for disabled taps only. heartbeat_gap 0 turns the gap check off.
+class TapWatchdog:
+    def __init__(self, on_recover, check_interval=1.0, history_size=20, heartbeat_gap=0, is_active=lambda: True):
+        self._on_recover = on_recover
+        self._check_interval = check_interval
+        self.heartbeat_gap = heartbeat_gap
+        self._is_active = is_active
+        self._monitors = []
+        self._lock = Lock()
+        self.counts = {}
+        self.history = deque(maxlen=history_size)
+        self._stopped = Event()
+        self._thread = None
+
+    def monitor(self, name, tap=None):
+        monitor = TapMonitor(self, name, tap)
+        self._monitors.append(monitor)
+        return monitor
+
+    def recover(self, monitor, reason):
+        record = self._re_enable(monitor, reason)
+        logger.warning('Re-enabled the %s event tap (%s), last callback took %d ns, slowest %d ns.',
+                       monitor.name, reason, record['last_callback_ns'], record['slowest_callback_ns'])
+
+        try:
+            self._on_recover(monitor.name, reason)
+        except Exception:
+            logger.exception('Failed to handle the %s event tap recovery.', monitor.name)
+
+    # Idle gaps are ordinary, the user may just not be typing. The tap is enabled again in
+    # case it is dead, but no key was lost for sure, so nothing held is released.
+    def _heartbeat_gap(self, monitor):
+        monitor.gap_reported = True
+        record = self._re_enable(monitor, HEARTBEAT_GAP)
+        logger.info('No %s event tap callback for %d ms.', monitor.name, record['idle_ms'])
+
+    def _re_enable(self, monitor, reason):
+        tap = monitor.tap
+        if tap is not None:
+            try:
+                tap.enable()
+            except Exception:
+                logger.exception('Failed to re-enable the %s event tap.', monitor.name)
+
+        with self._lock:
+            key = (monitor.name, reason)
+            self.counts[key] = self.counts.get(key, 0) + 1
+            record = {
+                'tap': monitor.name,
+                'reason': reason,
+                'time': time(),
+                'last_callback_ns': monitor.last_callback_ns,
+                'slowest_callback_ns': monitor.slowest_callback_ns,
+                'idle_ms': (perf_counter_ns() - monitor.last_callback_time) // 1000000,
+            }
+            self.history.append(record)
+            monitor.slowest_callback_ns = 0
+        return record
+
+    def check(self):
+        gap_ns = int(self.heartbeat_gap * 1e9)
+        for monitor in self._monitors:
+            tap = monitor.tap
+            if tap is None:
+                continue
+            if not tap.is_enabled():
+                self.recover(monitor, FOUND_DISABLED)
+            elif gap_ns and not monitor.gap_reported and perf_counter_ns() - monitor.last_callback_time > gap_ns \
+                    and self._is_active():
+                self._heartbeat_gap(monitor)
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self._check_interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception('Failed to check the event taps.')
+
+    def to_dict(self):
+        with self._lock:
+            recoveries = {}
+            for (name, reason), count in self.counts.items():
+                recoveries.setdefault(name, {})[reason] = count
+            return {'recoveries': recoveries, 'recent': list(self.history)}
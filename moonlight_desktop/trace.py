@@ -0,0 +1,189 @@
+# Flight recorder for the hooks: every event is written as a fixed size record into a
+# memory mapped ring file, with no formatting on the hook thread. The file survives a
+# crash and can be saved from the systray, then decoded or replayed through the keymap:
+#   python -m moonlight_desktop.trace decode TRACE
+#   python -m moonlight_desktop.trace replay TRACE CONFIG
+from argparse import ArgumentParser
+from itertools import count
+from tempfile import gettempdir
+import mmap
+import os
+import struct
+import sys
+
+from .keymap import PASS, SUPPRESS, REMAP, PASSTHROUGH, MACRO
+
+MAGIC = b'MLTR'
+VERSION = 2
+# magic, version, record size, capacity, next record index
+HEADER = struct.Struct('<4sHHIQ')
+INDEX_OFFSET = 12
+INDEX = struct.Struct('<Q')
+# time ns, flags, callback ns, event type, keycode, modifier mask, verdict, kind bits,
+# profile index of the keymap (see Keymap)
+RECORD = struct.Struct('<qQIHHBBBB4x')
+
+# Kind bits.
+KIND_KEY = 0
+KIND_MOUSE = 1
+# Moonlight was active, the keymap applied.
+KIND_ACTIVE = 2
+# Injected by us, the hooks let it through.
+KIND_INJECTED = 4
+# A key down or an auto-repeat.
+KIND_DOWN = 8
+
+DEFAULT_CAPACITY = 1 << 17
+VERDICT_NAMES = {PASS: 'pass', SUPPRESS: 'suppress', REMAP: 'remap', PASSTHROUGH: 'passthrough', MACRO: 'macro'}
+
+def get_trace_path():
+    return os.path.join(gettempdir(), 'moonlight-desktop-trace.bin')
+
+# Where a new recorder moves the ring of the previous run, which may have crashed.
+def get_previous_trace_path(file_path):
+    return file_path + '.prev'
+
+class TraceRecorder:
+    def __init__(self, file_path, capacity=DEFAULT_CAPACITY):
+        if capacity & (capacity - 1):
+            raise RuntimeError('Trace capacity must be a power of two: {}'.format(capacity))
+        self.file_path = file_path
+        self._mask = capacity - 1
+        size = HEADER.size + capacity * RECORD.size
+        if os.path.exists(file_path):
+            os.replace(file_path, get_previous_trace_path(file_path))
+        with open(file_path, 'w+b') as trace_file:
+            trace_file.truncate(size)
+            self._mmap = mmap.mmap(trace_file.fileno(), size)
+        HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, RECORD.size, capacity, 0)
+        # next() on a count is atomic, the key and the mouse hooks record from different threads.
+        self._counter = count()
+
+    def record(self, time_ns, event_type, keycode, flags, mods, verdict, kind, profile_index, callback_ns):
+        index = next(self._counter)
+        RECORD.pack_into(self._mmap, HEADER.size + (index & self._mask) * RECORD.size,
+                         time_ns, flags, min(callback_ns, 0xFFFFFFFF), event_type & 0xFFFF, keycode & 0xFFFF, mods, verdict, kind,
+                         profile_index)
+        INDEX.pack_into(self._mmap, INDEX_OFFSET, index + 1)
+
+    def close(self):
+        self._mmap.close()
+
+# Used when tracing is off.
+class NullTraceRecorder:
+    def record(self, time_ns, event_type, keycode, flags, mods, verdict, kind, profile_index, callback_ns):
+        pass
+
+    def close(self):
+        pass
+
+# Returns the records of a trace file, oldest first.
+def read_trace(file_path):
+    with open(file_path, 'rb') as trace_file:
+        data = trace_file.read()
+    magic, version, record_size, capacity, next_index = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        raise RuntimeError('Not a trace file: {}'.format(file_path))
+    records = []
+    for index in range(max(0, next_index - capacity), next_index):
+        record = RECORD.unpack_from(data, HEADER.size + (index % capacity) * RECORD.size)
+        # Slots being written while the file was read still hold a zero time.
+        if record[0]:
+            records.append(record)
+    # The hooks of different threads may have finished their records out of order.
+    records.sort()
+    return records
+
+def write_trace(file_path, records):
+    with open(file_path, 'wb') as trace_file:
+        trace_file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, len(records), len(records)))
+        for record in records:
+            trace_file.write(RECORD.pack(*record))
+
+# Copies the ring into a standalone trace file, in order.
+def save_trace(file_path, ring_file_path=None):
+    write_trace(file_path, read_trace(ring_file_path or get_trace_path()))
+    return file_path
+
+def format_record(record, start_time):
+    time_ns, flags, callback_ns, event_type, keycode, mods, verdict, kind, profile_index = record
+    if kind & KIND_MOUSE:
+        source, verdict_name = 'mouse', 'clip {}'.format(verdict)
+    else:
+        source, verdict_name = 'key', VERDICT_NAMES.get(verdict, verdict)
+    state = 'injected' if kind & KIND_INJECTED else 'active' if kind & KIND_ACTIVE else 'inactive'
+    return '{:>12.3f} ms  {:<5}  type {:>5}  key {:>3}  mods {:x}  flags {:#010x}  {:<8}  profile {:>2}  {:<11}  {:>7} ns'.format(
+        (time_ns - start_time) / 1e6, source, event_type, keycode, mods, flags, state, profile_index, verdict_name, callback_ns)
+
+def decode(file_path, out=sys.stdout):
+    records = read_trace(file_path)
+    start_time = records[0][0] if records else 0
+    for record in records:
+        out.write(format_record(record, start_time) + '\n')
+    return records
+
+# Feeds the recorded key events through the keymaps of a config, each through the keymap of
+# the profile it was recorded with, and reports where the verdicts differ. Uses the compiled
+# config cache, so it needs neither yaml nor pynput.
+def replay(file_path, config_filename, out=sys.stdout):
+    from .config_cache import ConfigCache, get_cache_path
+    compiled_config = ConfigCache(get_cache_path(config_filename), None).load()
+    if compiled_config is None:
+        raise RuntimeError('No compiled config for {}, run with --compile-config first.'.format(config_filename))
+    return replay_records(read_trace(file_path), compiled_config, out)
+
+def replay_records(records, compiled_config, out=sys.stdout):
+    # The sequence timeouts run on the recorded time.
+    now = [0]
+    default_keymap, profile_keymaps = compiled_config.create_keymaps(clock=lambda: now[0])
+    keymaps = [default_keymap] + [profile_keymaps[profile.name] for profile in compiled_config.profiles]
+
+    start_time = records[0][0] if records else 0
+    transitions = {}
+    last_profile_index = 0
+    for record in records:
+        time_ns, _, _, _, keycode, mods, verdict, kind, profile_index = record
+        # Only key events the keymap was applied to.
+        if kind & (KIND_MOUSE | KIND_INJECTED) or not kind & KIND_ACTIVE:
+            continue
+        keymap = keymaps[profile_index] if profile_index < len(keymaps) else default_keymap
+        hotkey_matcher = keymap.hotkey_matcher
+        if profile_index != last_profile_index and hotkey_matcher is not None:
+            # The hooks drop the matches in progress on a profile swap.
+            hotkey_matcher.reset()
+        last_profile_index = profile_index
+        action = keymap.decide(mods, keycode)
+        # The modifiers are in mods, they don't advance the chords and sequences.
+        if hotkey_matcher is not None and not keymap.modifier_of(keycode):
+            now[0] = time_ns / 1e9
+            action = hotkey_matcher.feed(mods, keycode, kind & KIND_DOWN != 0) or action
+        # The hooks record the starts of every macro as MACRO.
+        replayed_verdict = min(action, MACRO)
+        key = (verdict, replayed_verdict)
+        transitions[key] = transitions.get(key, 0) + 1
+        # Dropped auto-repeats were remaps all along.
+        if verdict != replayed_verdict and not (verdict == SUPPRESS and replayed_verdict == REMAP):
+            out.write('{} -> {}\n'.format(format_record(record, start_time), VERDICT_NAMES.get(replayed_verdict)))
+    out.write('recorded -> replayed verdicts:\n')
+    for (verdict, replayed_verdict), transition_count in sorted(transitions.items()):
+        out.write('  {:<11} -> {:<11} {}\n'.format(VERDICT_NAMES.get(verdict, verdict), VERDICT_NAMES.get(replayed_verdict), transition_count))
+    return transitions
+
+def main(argv):
+    parser = ArgumentParser(prog='python -m moonlight_desktop.trace')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    decode_parser = subparsers.add_parser('decode', help='print the records of a trace')
+    decode_parser.add_argument('trace', nargs='?', default=get_trace_path())
+    replay_parser = subparsers.add_parser('replay', help='run the key events of a trace through the keymap of a config')
+    replay_parser.add_argument('trace')
+    replay_parser.add_argument('config')
+    args = parser.parse_args(argv)
+
+    if args.command == 'decode':
+        decode(args.trace)
+    else:
+        replay(args.trace, args.config)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
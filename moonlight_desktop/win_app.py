@@ -1,18 +1,103 @@
-from os import startfile, system
+from os import startfile, environ, path
+from time import perf_counter_ns
+from threading import Lock
+import ctypes
 import logging
 
 from pynput import keyboard
-from pynput.keyboard import Key, KeyCode
 
-import pystray
-
-from win32api import VkKeyScan
+from win32api import VkKeyScan, GetKeyboardLayoutName
 from win32con import WM_KEYDOWN, WM_KEYUP, WM_SYSKEYDOWN, WM_SYSKEYUP
 
 from .app import App
+from .keymap import PASS, SUPPRESS, REMAP
+from .trace import KIND_ACTIVE, KIND_INJECTED, KIND_DOWN
+from .supervisor import run_command
+from .win_hook import KeyboardHook, load_user32, LLKHF_INJECTED, INJECTED_EXTRA_INFO
+from . import startup_profile
 
 logger = logging.getLogger('moonlight-desktop')
 
+INPUT_KEYBOARD = 1
+KEYEVENTF_EXTENDEDKEY = 0x0001
+KEYEVENTF_KEYUP = 0x0002
+MAPVK_VK_TO_VSC = 0
+
+# Keys on the extended part of the keyboard, they need KEYEVENTF_EXTENDEDKEY.
+EXTENDED_KEYS = frozenset((
+    0x21, 0x22, 0x23, 0x24, # page up, page down, end, home
+    0x25, 0x26, 0x27, 0x28, # arrows
+    0x2C, 0x2D, 0x2E, # print screen, insert, delete
+    0x5B, 0x5C, 0x5D, # left win, right win, apps
+    0x6F, 0x90, # numpad divide, num lock
+    0xA3, 0xA5, # right ctrl, right alt
+))
+
+class KEYBDINPUT(ctypes.Structure):
+    _fields_ = (('wVk', ctypes.c_ushort),
+                ('wScan', ctypes.c_ushort),
+                ('dwFlags', ctypes.c_ulong),
+                ('time', ctypes.c_ulong),
+                ('dwExtraInfo', ctypes.c_size_t))
+
+class MOUSEINPUT(ctypes.Structure):
+    _fields_ = (('dx', ctypes.c_long),
+                ('dy', ctypes.c_long),
+                ('mouseData', ctypes.c_ulong),
+                ('dwFlags', ctypes.c_ulong),
+                ('time', ctypes.c_ulong),
+                ('dwExtraInfo', ctypes.c_size_t))
+
+class _INPUTUNION(ctypes.Union):
+    # The mouse member sets the size SendInput expects.
+    _fields_ = (('ki', KEYBDINPUT), ('mi', MOUSEINPUT))
+
+class INPUT(ctypes.Structure):
+    _fields_ = (('type', ctypes.c_ulong), ('union', _INPUTUNION))
+
+# Injects a whole batch with one SendInput call, so no other input lands in the middle of a chord.
+class SendInputInjector:
+    def __init__(self, user32):
+        self._user32 = user32
+        self._inputs = {}
+        # One preallocated INPUT array per batch size.
+        self._arrays = {}
+        self._lock = Lock()
+
+    def prepare(self, keycodes):
+        with self._lock:
+            for keycode in keycodes:
+                self._get_inputs(keycode)
+
+    # Returns the (up, down) INPUT of a keycode.
+    def _get_inputs(self, keycode):
+        inputs = self._inputs.get(keycode)
+        if inputs is None:
+            flags = KEYEVENTF_EXTENDEDKEY if keycode in EXTENDED_KEYS else 0
+            scan_code = self._user32.MapVirtualKeyW(keycode, MAPVK_VK_TO_VSC)
+            inputs = tuple(
+                INPUT(INPUT_KEYBOARD, _INPUTUNION(ki=KEYBDINPUT(keycode, scan_code, key_flags, 0, INJECTED_EXTRA_INFO)))
+                for key_flags in (flags | KEYEVENTF_KEYUP, flags))
+            self._inputs[keycode] = inputs
+        return inputs
+
+    def send(self, batch):
+        count = len(batch)
+        with self._lock:
+            array = self._arrays.get(count)
+            if array is None:
+                array = self._arrays[count] = (INPUT * count)()
+            for i, (keycode, is_down) in enumerate(batch):
+                array[i] = self._get_inputs(keycode)[is_down]
+            if self._user32.SendInput(count, array, ctypes.sizeof(INPUT)) != count:
+                logger.warning('SendInput injected only part of %s.', batch)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
 class WinApp(App):
     def __init__(self, log_file_path, argv):
         App.__init__(self, log_file_path, 'icons/systray-win.png', argv)
@@ -20,23 +105,52 @@ class WinApp(App):
         if self._config_filename is None:
             self._config_filename = 'config/win-server.yaml'
 
+        self._key_event_histogram = self._stats.histogram('win32_key_event_listener')
+        self._use_native_hook = True
+
     def start(self):
         self._load_config()
 
-        self._create_key_listener()
+        with startup_profile.phase('start hooks'):
+            self._launch_hooks()
 
         try:
-            self._listener.start()
+            with startup_profile.phase('init systray'):
+                self._init_systray()
+            self._start_workers()
+            startup_profile.report()
             self.systray.run()
             return 0
         finally:
-            self._listener.stop()
+            self._shutdown_hooks()
+            self._stop_workers()
 
     def stop(self):
-        self.systray.stop()
+        if self.systray is not None:
+            self.systray.stop()
 
-    def _create_key_listener(self):
+    def _start_hooks(self):
+        self._start_key_listener()
+
+    def _stop_hooks(self):
+        self._listener.stop()
+        self._release_injected_keys()
+
+    # Prefers our own low level hook, falls back to pynput if it can't be installed.
+    def _start_key_listener(self):
         if len(self._passthrough_hotkeys) > 0: raise NotImplementedError()
+        if self._use_native_hook:
+            try:
+                listener = KeyboardHook(self._handle_key_event, load_user32(), ctypes.windll.kernel32)
+                listener.start()
+                self._listener = listener
+                return
+            except Exception:
+                logger.exception('Failed to install the keyboard hook, falling back to pynput.')
+        self._create_key_listener()
+        self._listener.start()
+
+    def _create_key_listener(self):
         self._listener = keyboard.Listener(
             on_press=None,
             on_release=None,
@@ -44,28 +158,85 @@ class WinApp(App):
             win32_event_filter=self._win32_key_event_listener)
 
     def _create_pystray_menu(self, *items):
+        import pystray
         items = (pystray.MenuItem('Disconnect RDP', lambda: self._disconnect_rdp()),) + items
         return App._create_pystray_menu(self, *items)
 
+    # Hands the session back to the console without holding up the systray thread.
     def _disconnect_rdp(self):
-        system('%WINDIR%\\sysnative\\tscon.exe 1 /dest:console')
+        tscon_path = path.join(environ.get('WINDIR', 'C:\\Windows'), 'sysnative', 'tscon.exe')
+        future = self._supervisor_loop.submit(run_command([tscon_path, '1', '/dest:console']))
+        future.add_done_callback(self._on_rdp_disconnected)
+
+    def _on_rdp_disconnected(self, future):
+        try:
+            exit_code = future.result()
+        except Exception:
+            logger.exception('Failed to disconnect RDP.')
+            return
+        if exit_code != 0:
+            logger.error('tscon exited with code %s.', exit_code)
+
+    def _create_base_injector(self):
+        return SendInputInjector(ctypes.windll.user32)
+
+    def _load_platform_config(self, config):
+        self._use_native_hook = config.get('native_keyboard_hook', True)
 
     def _char_to_keycode(self, char):
         return VkKeyScan(char)
 
+    def _get_keyboard_layout_id(self):
+        return GetKeyboardLayoutName()
+
     def _open_file_with_associated_app(self, path):
         startfile(path, 'open')
 
+    # pynput's win32_event_filter, which swallows events by raising an exception.
     def _win32_key_event_listener(self, msg, data):
-        is_key_down = msg == WM_KEYDOWN or msg == WM_SYSKEYDOWN
-        keycode = data.vkCode
-        # logger.debug('vkCode {} {}'.format(data.vkCode, hex(data.vkCode)))
-
-        if keycode in self._remap_keys:
-            to = self._remap_keys.get(keycode)
-            logger.debug('Remapping {}->{}'.format(keycode, to))
-            # Simulate target key.
-            self._kb_controller.touch(KeyCode.from_vk(to), is_key_down)
+        if self._handle_key_event(msg, data):
             self._listener.suppress_event()
-            return True
         return True
+
+    # Returns True to swallow the event.
+    def _handle_key_event(self, msg, data):
+        start_time = perf_counter_ns()
+        keycode = data.vkCode
+        verdict = PASS
+        kind = KIND_ACTIVE
+        try:
+            # Ignore the keys we injected, the ones the streaming host injects are handled.
+            if data.flags & LLKHF_INJECTED and data.dwExtraInfo == INJECTED_EXTRA_INFO:
+                kind = KIND_INJECTED
+                self._stats.passed += 1
+                return False
+
+            is_key_down = msg == WM_KEYDOWN or msg == WM_SYSKEYDOWN
+            if is_key_down:
+                kind |= KIND_DOWN
+            # logger.debug('vkCode {} {}'.format(data.vkCode, hex(data.vkCode)))
+
+            if keycode == self._probe_marker_keycode:
+                if is_key_down:
+                    self._latency_probe.on_marker()
+                verdict = SUPPRESS
+                return True
+
+            keymap = self._keymap
+            if keymap.decide(0, keycode) == REMAP:
+                to = keymap.remap_target(keycode)
+                logger.debug('Remapping %d->%d', keycode, to)
+                # Simulate target key, once per press.
+                verdict = SUPPRESS
+                if self._track_remapped_key(keymap, keycode, to, is_key_down):
+                    self._injector.send(((to, is_key_down),))
+                    self._stats.remapped += 1
+                    verdict = REMAP
+                return True
+            self._stats.passed += 1
+            return False
+        finally:
+            end_time = perf_counter_ns()
+            self._key_event_histogram.record(end_time - start_time)
+            self._trace.record(end_time, msg, keycode, data.flags, 0, verdict, kind, self._keymap.profile_index,
+                               end_time - start_time)
@@ -0,0 +1,97 @@
+from threading import Thread, Event
+import ctypes
+import logging
+
+logger = logging.getLogger('moonlight-desktop')
+
+WH_KEYBOARD_LL = 13
+HC_ACTION = 0
+WM_QUIT = 0x0012
+LLKHF_INJECTED = 0x10
+# dwExtraInfo of the keys we inject, tells them from the ones the streaming host injects.
+INJECTED_EXTRA_INFO = 0x4D4C4441
+
+class KBDLLHOOKSTRUCT(ctypes.Structure):
+    _fields_ = (('vkCode', ctypes.c_ulong),
+                ('scanCode', ctypes.c_ulong),
+                ('flags', ctypes.c_ulong),
+                ('time', ctypes.c_ulong),
+                ('dwExtraInfo', ctypes.c_size_t))
+
+_KBDLLHOOKSTRUCT_POINTER = ctypes.POINTER(KBDLLHOOKSTRUCT)
+
+# LRESULT CALLBACK LowLevelKeyboardProc(int nCode, WPARAM wParam, LPARAM lParam)
+HOOKPROC = getattr(ctypes, 'WINFUNCTYPE', ctypes.CFUNCTYPE)(ctypes.c_ssize_t, ctypes.c_int, ctypes.c_size_t, ctypes.c_ssize_t)
+
+def load_user32():
+    from ctypes import wintypes
+    user32 = ctypes.WinDLL('user32', use_last_error=True)
+    user32.SetWindowsHookExW.argtypes = (ctypes.c_int, HOOKPROC, wintypes.HINSTANCE, wintypes.DWORD)
+    user32.SetWindowsHookExW.restype = wintypes.HHOOK
+    user32.CallNextHookEx.argtypes = (wintypes.HHOOK, ctypes.c_int, ctypes.c_size_t, ctypes.c_ssize_t)
+    user32.CallNextHookEx.restype = ctypes.c_ssize_t
+    user32.UnhookWindowsHookEx.argtypes = (wintypes.HHOOK,)
+    user32.GetMessageW.argtypes = (ctypes.POINTER(wintypes.MSG), wintypes.HWND, wintypes.UINT, wintypes.UINT)
+    user32.PostThreadMessageW.argtypes = (wintypes.DWORD, wintypes.UINT, ctypes.c_size_t, ctypes.c_ssize_t)
+    return user32
+
+# A thin WH_KEYBOARD_LL hook. handler(msg, data) gets the window message and the
+# KBDLLHOOKSTRUCT of each key event and returns True to swallow it. Unlike pynput's
+# win32_event_filter no exception is raised to suppress an event, the verdict is
+# returned straight to the hook chain.
+class KeyboardHook:
+    def __init__(self, handler, user32, kernel32):
+        self._handler = handler
+        self._user32 = user32
+        self._kernel32 = kernel32
+        # Keep the callback alive as long as the hook is installed.
+        self._proc = HOOKPROC(self.dispatch)
+        self._hook = None
+        self._thread = None
+        self._thread_id = None
+
+    def dispatch(self, n_code, w_param, l_param):
+        if n_code == HC_ACTION:
+            try:
+                if self._handler(w_param, ctypes.cast(l_param, _KBDLLHOOKSTRUCT_POINTER).contents):
+                    return 1
+            except Exception:
+                logger.exception('Exception was thrown in the keyboard hook.')
+        return self._user32.CallNextHookEx(None, n_code, w_param, l_param)
+
+    # Installs the hook on a thread running the message loop it needs, raises if it fails.
+    def start(self):
+        started = Event()
+        errors = []
+        self._thread = Thread(target=self._run, args=(started, errors), daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            self._thread.join()
+            self._thread = None
+            raise errors[0]
+
+    def stop(self):
+        if self._thread is not None:
+            self._user32.PostThreadMessageW(self._thread_id, WM_QUIT, 0, 0)
+            self._thread.join(1)
+            self._thread = None
+
+    def _run(self, started, errors):
+        user32 = self._user32
+        self._thread_id = self._kernel32.GetCurrentThreadId()
+        self._hook = user32.SetWindowsHookExW(WH_KEYBOARD_LL, self._proc, None, 0)
+        if not self._hook:
+            errors.append(OSError('SetWindowsHookExW failed'))
+            started.set()
+            return
+        started.set()
+        try:
+            from ctypes import wintypes
+            message = wintypes.MSG()
+            # Low level hooks are called from this thread's message loop.
+            while user32.GetMessageW(ctypes.byref(message), None, 0, 0) > 0:
+                pass
+        finally:
+            user32.UnhookWindowsHookEx(self._hook)
+            self._hook = None
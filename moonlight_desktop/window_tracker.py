@@ -0,0 +1,155 @@
+from threading import Thread, Event
+from time import monotonic
+import logging
+
+logger = logging.getLogger('moonlight-desktop')
+
+class WindowProvider:
+    # Calls callback whenever the frontmost app or a window geometry may have changed.
+    # Returns False if the platform can't deliver notifications, the tracker will poll instead.
+    def subscribe(self, callback):
+        return False
+
+    def unsubscribe(self):
+        pass
+
+    # Returns the PID of the frontmost application. Called first by every refresh, the other
+    # getters may answer from what it fetched until the next call.
+    def get_active_pid(self):
+        raise NotImplementedError()
+
+    # Returns the PID of the tracked app or None if it isn't running.
+    def get_target_pid(self):
+        raise NotImplementedError()
+
+    # Returns the bounds dict (X, Y, Width, Height) of the main window of pid or None.
+    def get_window_bounds(self, pid):
+        raise NotImplementedError()
+
+    # Returns the bundle ID or window class of the app of pid, or None if unknown.
+    def get_app_id(self, pid):
+        return None
+
+    # Returns the title of the main window of pid, or None if unknown.
+    def get_window_title(self, pid):
+        return None
+
+# pid, bounds and title are only set while the target app is frontmost, app_id is the one
+# of the frontmost app, whichever it is.
+class WindowState:
+    __slots__ = ('enabled', 'bounds', 'pid', 'app_id', 'title')
+
+    def __init__(self, enabled, bounds, pid, app_id=None, title=None):
+        self.enabled = enabled
+        self.bounds = bounds
+        self.pid = pid
+        self.app_id = app_id
+        self.title = title
+
+    def __eq__(self, other):
+        return isinstance(other, WindowState) and \
+            (self.enabled, self.bounds, self.pid, self.app_id, self.title) == \
+            (other.enabled, other.bounds, other.pid, other.app_id, other.title)
+
+    def __repr__(self):
+        return 'WindowState(enabled={}, bounds={}, pid={}, app_id={}, title={})'.format(
+            self.enabled, self.bounds, self.pid, self.app_id, self.title)
+
+DISABLED_WINDOW_STATE = WindowState(False, None, None)
+
+class WindowTracker:
+    # Tracks whether the target app is frontmost and full screen (Y == 0).
+    # Refreshes on provider notifications. While the target is frontmost, or if the provider
+    # can't notify, it also polls with an interval doubling from min_interval to max_interval
+    # as long as nothing changes.
+    def __init__(self, provider, on_change, min_interval=0.05, max_interval=1.0, clock=monotonic):
+        self._provider = provider
+        self._on_change = on_change
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._clock = clock
+
+        self._wakeup = Event()
+        self._stopped = False
+        self._has_notifications = False
+        self._target_pid = None
+        self._active_pid = None
+        self._app_id = None
+        self._interval = min_interval
+        self._thread = None
+
+        self.state = DISABLED_WINDOW_STATE
+        self.last_notify_time = None
+        self.last_change_latency = None
+
+    def start(self):
+        self._has_notifications = self._provider.subscribe(self.notify)
+        if not self._has_notifications:
+            logger.info('Window notifications are unavailable, falling back to polling.')
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._provider.unsubscribe()
+        self._wakeup.set()
+
+    def notify(self):
+        self.last_notify_time = self._clock()
+        self._wakeup.set()
+
+    def refresh(self):
+        provider = self._provider
+        # Only hit the provider for the target PID when the cached one is gone.
+        active_pid = provider.get_active_pid()
+        if self._target_pid is None or active_pid != self._target_pid:
+            self._target_pid = provider.get_target_pid()
+        # The app of a PID doesn't change.
+        if active_pid != self._active_pid:
+            self._active_pid = active_pid
+            self._app_id = provider.get_app_id(active_pid) if active_pid is not None else None
+
+        if self._target_pid is not None and active_pid == self._target_pid:
+            bounds = provider.get_window_bounds(self._target_pid)
+            # If the window isn't in full screen mode (y != 0), don't handle inputs.
+            state = WindowState(bounds is not None and bounds['Y'] == 0, bounds, self._target_pid,
+                                self._app_id, provider.get_window_title(self._target_pid))
+        elif self._app_id is not None:
+            state = WindowState(False, None, None, self._app_id)
+        else:
+            state = DISABLED_WINDOW_STATE
+
+        if state == self.state:
+            return False
+
+        self.state = state
+        if self.last_notify_time is not None:
+            self.last_change_latency = self._clock() - self.last_notify_time
+        self._on_change(state)
+        return True
+
+    def next_timeout(self, changed):
+        if changed:
+            self._interval = self._min_interval
+        else:
+            self._interval = min(self._interval * 2, self._max_interval)
+
+        # Nothing to watch until the next notification.
+        if self._has_notifications and self.state.pid is None:
+            return None
+        return self._interval
+
+    def _run(self):
+        timeout = 0
+        while not self._stopped:
+            self._wakeup.wait(timeout)
+            notified = self._wakeup.is_set()
+            self._wakeup.clear()
+            if self._stopped:
+                break
+            try:
+                changed = self.refresh()
+            except Exception:
+                logger.exception('Failed to refresh the window state.')
+                changed = False
+            timeout = self.next_timeout(changed or notified)
@@ -0,0 +1,28 @@
+import sys
+
+import pytest
+
+from benchmarks import stubs
+
+# A clock the test moves by hand, in whatever unit the code under test reads.
+class FakeClock:
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+# Installs the stubbed OS modules of a platform ('darwin' or 'win32'), moonlight_desktop is
+# imported against them until the test ends.
+@pytest.fixture
+def stub_platform():
+    saved_modules = dict(sys.modules)
+    yield stubs.install
+    for name in list(sys.modules):
+        if name not in saved_modules:
+            del sys.modules[name]
+    sys.modules.update(saved_modules)
@@ -0,0 +1,242 @@
+# Test doubles for the OS facing interfaces of moonlight_desktop.
+from threading import Lock, Timer
+from types import ModuleType
+import errno
+import os
+import time
+
+from moonlight_desktop.hook_process import MSG_GET_STATS, MSG_STOP
+from moonlight_desktop.linux_app import EV_KEY, KEY_A
+from moonlight_desktop.tap_watchdog import EventTap
+from moonlight_desktop.window_tracker import WindowProvider
+
+class FakeWindowProvider(WindowProvider):
+    def __init__(self, target_pid=None, has_notifications=True):
+        self.active_pid = None
+        self.target_pid = target_pid
+        self.bounds = {}
+        self.app_ids = {}
+        self.titles = {}
+        self.has_notifications = has_notifications
+        self.calls = []
+        self._callback = None
+
+    def subscribe(self, callback):
+        self._callback = callback if self.has_notifications else None
+        return self.has_notifications
+
+    def unsubscribe(self):
+        self._callback = None
+
+    def get_active_pid(self):
+        self.calls.append('active_pid')
+        return self.active_pid
+
+    def get_target_pid(self):
+        return self.target_pid
+
+    def get_window_bounds(self, pid):
+        self.calls.append('bounds')
+        return self.bounds.get(pid)
+
+    def get_app_id(self, pid):
+        return self.app_ids.get(pid)
+
+    def get_window_title(self, pid):
+        self.calls.append('title')
+        return self.titles.get(pid)
+
+    # Simulates the app focus or window geometry changing.
+    def set(self, active_pid=None, bounds=None, app_id=None, title=None):
+        self.active_pid = active_pid
+        if bounds is not None:
+            self.bounds[active_pid] = bounds
+        if app_id is not None:
+            self.app_ids[active_pid] = app_id
+        if title is not None:
+            self.titles[active_pid] = title
+        if self._callback is not None:
+            self._callback()
+
+# Keeps the batches instead of injecting them.
+class RecordingInjector:
+    def __init__(self):
+        self.prepared = set()
+        self.batches = []
+
+    def prepare(self, keycodes):
+        self.prepared.update(keycodes)
+
+    def send(self, batch):
+        self.batches.append(tuple(batch))
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+# Stands in for the client injector, the streaming chain and the server hook: every
+# injected marker down reaches server.on_marker() after delay seconds.
+class LoopbackMarkerInjector:
+    def __init__(self, server, marker_keycode, delay=0.005):
+        self._server = server
+        self._marker_keycode = marker_keycode
+        self._delay = delay
+
+    def prepare(self, keycodes):
+        pass
+
+    def send(self, batch):
+        for keycode, is_down in batch:
+            if keycode == self._marker_keycode and is_down:
+                Timer(self._delay, self._server.on_marker).start()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+# Stands in for the app class in the hook process. Its stats are the kinds of the messages
+# received so far, argv[1] is how long it takes to answer.
+class EchoHooks:
+    def __init__(self, log_file_path, argv):
+        self._stats_delay = float(argv[1]) if len(argv) > 1 else 0
+
+    def run_hooks(self, conn):
+        kinds = []
+        while True:
+            try:
+                kind, payload = conn.recv()
+            except EOFError:
+                break
+            kinds.append(kind)
+            if kind == MSG_GET_STATS:
+                time.sleep(self._stats_delay)
+                conn.send((payload, {'messages': kinds}))
+            elif kind == MSG_STOP:
+                break
+        return 0
+
+# An event tap that fails on demand.
+class FakeEventTap(EventTap):
+    def __init__(self):
+        self.enabled = True
+        self.enable_count = 0
+
+    def is_enabled(self):
+        return self.enabled
+
+    def enable(self):
+        self.enabled = True
+        self.enable_count += 1
+
+    def disable(self):
+        self.enabled = False
+
+class FakeInputEvent:
+    __slots__ = ('type', 'code', 'value')
+
+    def __init__(self, type, code, value):
+        self.type = type
+        self.code = code
+        self.value = value
+
+# Stands in for evdev.InputDevice, events are queued with push() and wake up the event loop.
+class FakeInputDevice:
+    def __init__(self, path='/dev/input/event0', name='fake keyboard', keys=range(1, 256)):
+        self.name = name
+        self.path = path
+        self.keys = list(keys)
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        self.fd = self._read_fd
+        self._events = []
+        self._lock = Lock()
+        self.grabbed = False
+        self.closed = False
+        self.unplugged = False
+        self.grab_error = None
+
+    def push(self, *events):
+        with self._lock:
+            self._events.extend(FakeInputEvent(EV_KEY, code, value) for code, value in events)
+        os.write(self._write_fd, b'\0')
+
+    # Like the kernel, the fd reports a hangup and reading it fails.
+    def unplug(self):
+        self.unplugged = True
+        os.close(self._write_fd)
+        self._write_fd = None
+
+    def read(self):
+        if self.unplugged:
+            raise OSError(errno.ENODEV, 'No such device')
+        os.read(self._read_fd, 4096)
+        with self._lock:
+            events, self._events = self._events, []
+        return events
+
+    def capabilities(self):
+        return {EV_KEY: self.keys}
+
+    def grab(self):
+        if self.grab_error is not None:
+            raise self.grab_error
+        self.grabbed = True
+
+    def ungrab(self):
+        if self.unplugged:
+            raise OSError(errno.ENODEV, 'No such device')
+        self.grabbed = False
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        os.close(self._read_fd)
+        if self._write_fd is not None:
+            os.close(self._write_fd)
+
+# Stands in for evdev.UInput and records what was emitted.
+class RecordingUInput:
+    def __init__(self, events=None, name=None):
+        self.keys = (events or {}).get(EV_KEY, [])
+        self.events = []
+        self.syn_count = 0
+        self.closed = False
+
+    def write(self, type, code, value):
+        self.events.append((type, code, value))
+
+    def syn(self):
+        self.syn_count += 1
+
+    def close(self):
+        self.closed = True
+
+# An evdev module over FakeInputDevices, plugged in by path.
+def create_fake_evdev():
+    evdev = ModuleType('evdev')
+    evdev.devices = {}
+    evdev.uinputs = []
+
+    def InputDevice(path):
+        device = evdev.devices.get(path)
+        if device is None or device.unplugged:
+            raise OSError(errno.ENOENT, 'No such file or directory', path)
+        return device
+
+    def UInput(events, name=None):
+        uinput = RecordingUInput(events, name)
+        evdev.uinputs.append(uinput)
+        return uinput
+
+    evdev.InputDevice = InputDevice
+    evdev.UInput = UInput
+    evdev.list_devices = lambda: sorted(path for path, device in evdev.devices.items() if not device.unplugged)
+    evdev.ecodes = ModuleType('evdev.ecodes')
+    evdev.ecodes.EV_KEY = EV_KEY
+    evdev.ecodes.KEY_A = KEY_A
+    return evdev
@@ -0,0 +1,71 @@
+from threading import Event
+
+from moonlight_desktop.clipper import ClipConfig, MouseClipper, TrailingWarpTimer, clip_rect, \
+    CLIP_HARD, CLIP_SOFT, CLIP_NONE, CLIP_MOVE, CLIP_WARP
+from moonlight_desktop.input_state import InputState
+
+BOUNDS = {'X': 0, 'Y': 0, 'Width': 1920, 'Height': 1080}
+
+def test_clip_rect_adds_the_margins_and_keeps_the_screen_top():
+    assert clip_rect(BOUNDS, (50, 60, 10, 20)) == (-50, 1980, -10, 1100)
+    assert clip_rect({'X': 0, 'Y': 30, 'Width': 100, 'Height': 100}, (0, 0, 0, 0)) == (0, 100, 0, 130)
+
+def test_hard_clip_warps_at_most_once_per_interval(clock):
+    clipper = MouseClipper(ClipConfig(CLIP_HARD, max_warp_rate=60), clock)
+    state = InputState.from_bounds(True, BOUNDS)
+
+    assert clipper.clip(state, 500, 500) == CLIP_NONE
+    assert clipper.clip(state, 2000, 500) == CLIP_WARP
+    assert (clipper.x, clipper.y) == (1920, 500)
+    clock.now += 0.005
+    assert clipper.clip(state, 2010, 1200) == CLIP_MOVE
+    assert (clipper.x, clipper.y) == (1920, 1080)
+    assert clipper.coalesced_warps == 1
+    clock.now += 0.02
+    assert clipper.clip(state, 2020, 500) == CLIP_WARP
+
+def test_soft_clip_moves_within_the_soft_margin(clock):
+    clipper = MouseClipper(ClipConfig(CLIP_SOFT, soft_margin=20), clock)
+    state = InputState.from_bounds(True, BOUNDS)
+    assert clipper.clip(state, 1930, 500) == CLIP_MOVE
+    assert clipper.clip(state, 1960, 500) == CLIP_WARP
+
+def test_trailing_warp_after_a_coalesced_flick(clock):
+    clipper = MouseClipper(ClipConfig(max_warp_rate=50), clock)
+    state = InputState.from_bounds(True, BOUNDS)
+    assert clipper.take_trailing_warp() is None
+
+    clipper.clip(state, 2000, 500)
+    clock.now += 0.005
+    assert clipper.clip(state, 2050, 500) == CLIP_MOVE
+    assert abs(clipper.take_trailing_warp() - 0.015) < 1e-9
+    clock.now += 0.015
+    assert clipper.take_trailing_warp() == 0
+    assert clipper.take_trailing_warp() is None
+
+def test_moving_back_inside_cancels_the_trailing_warp(clock):
+    clipper = MouseClipper(ClipConfig(), clock)
+    state = InputState.from_bounds(True, BOUNDS)
+    clipper.clip(state, 2000, 500)
+    clipper.clip(state, 2050, 500)
+    clipper.clip(state, 1000, 500)
+    assert clipper.take_trailing_warp() is None
+
+def test_trailing_warp_timer_warps_once_due():
+    delays = [0.01, 0]
+    warped = Event()
+
+    def warp():
+        delay = delays.pop(0)
+        if delay == 0:
+            warped.set()
+        return delay
+
+    timer = TrailingWarpTimer(warp)
+    timer.start()
+    try:
+        timer.arm()
+        assert warped.wait(1)
+        assert delays == []
+    finally:
+        timer.stop()
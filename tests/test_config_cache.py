@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+from moonlight_desktop.config_cache import CompiledConfig, Profile, ConfigCache, get_cache_dir, get_cache_path
+
+@pytest.fixture
+def cache_home(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    monkeypatch.setenv('LOCALAPPDATA', str(tmp_path))
+    return tmp_path
+
+def create_config():
+    profile = Profile('vm', 'com.example.vm', None, {1: 2}, {(2, 3)})
+    return CompiledConfig({55: 59}, {(2, 18)}, {'watch_config': False}, [profile], modifier_keys={59: 2})
+
+def test_round_trip(cache_home):
+    cache = ConfigCache(get_cache_path('config.yaml'), 'key')
+    cache.save(create_config())
+    compiled_config = cache.load()
+    assert compiled_config.remap_keys == {55: 59}
+    assert compiled_config.passthrough_hotkeys == {(2, 18)}
+    assert compiled_config.profiles[0].remap_keys == {1: 2}
+    assert compiled_config.modifier_keys == {59: 2}
+    assert ConfigCache(cache.cache_path, 'other key').load() is None
+    assert ConfigCache(cache.cache_path, None).load() is not None
+
+def test_cache_is_private_to_the_user(cache_home):
+    cache_path = get_cache_path('config.yaml')
+    assert cache_path.startswith(str(cache_home))
+    ConfigCache(cache_path, 'key').save(create_config())
+    if hasattr(os, 'getuid'):
+        assert os.stat(os.path.dirname(cache_path)).st_mode & 0o777 == 0o700
+        assert os.stat(cache_path).st_mode & 0o777 == 0o600
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='POSIX permissions')
+def test_cache_writable_by_others_is_ignored(cache_home):
+    cache = ConfigCache(get_cache_path('config.yaml'), 'key')
+    cache.save(create_config())
+    os.chmod(cache.cache_path, 0o666)
+    assert cache.load() is None
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='POSIX cache dirs')
+def test_mac_cache_is_under_library_caches(monkeypatch, tmp_path):
+    monkeypatch.delenv('XDG_CACHE_HOME', raising=False)
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setattr(sys, 'platform', 'darwin')
+    assert get_cache_dir() == str(tmp_path / 'Library' / 'Caches' / 'moonlight-desktop')
+
+def test_uncreatable_cache_dir_caches_nothing(cache_home):
+    # A file where the cache dir would go.
+    (cache_home / 'moonlight-desktop').write_text('')
+    cache_path = get_cache_path('config.yaml')
+    assert cache_path is None
+    cache = ConfigCache(cache_path, 'key')
+    assert not cache.save(create_config())
+    assert cache.load() is None
@@ -0,0 +1,36 @@
+from threading import Event
+
+from moonlight_desktop.config_watcher import ConfigWatcher
+
+def test_on_change_can_stop_the_watcher(tmp_path):
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text('watch_config: true\n')
+    stopped = Event()
+    errors = []
+
+    def on_change():
+        try:
+            watcher.stop()
+        except Exception as error:
+            errors.append(error)
+        stopped.set()
+
+    watcher = ConfigWatcher(str(config_path), on_change, poll_interval=0.01, debounce=0.01)
+    watcher.start()
+    config_path.write_text('watch_config: false\n')
+    assert stopped.wait(2)
+    assert errors == []
+
+def test_restarts_after_stop(tmp_path):
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text('a: 1\n')
+    changed = Event()
+    watcher = ConfigWatcher(str(config_path), changed.set, poll_interval=0.01, debounce=0.01)
+    watcher.start()
+    watcher.stop()
+    watcher.start()
+    try:
+        config_path.write_text('a: 2\n')
+        assert changed.wait(2)
+    finally:
+        watcher.stop()
@@ -0,0 +1,74 @@
+from threading import Thread
+import time
+
+import pytest
+
+from moonlight_desktop.config_cache import CompiledConfig
+from moonlight_desktop.hook_process import HookProcess, MSG_CONFIG, MSG_INPUT_STATE, MSG_RELEASE_ALL_KEYS, \
+    MSG_GET_STATS
+from moonlight_desktop.input_state import InputState
+
+from fakes import EchoHooks
+
+@pytest.fixture
+def create_hook_process(tmp_path):
+    hook_processes = []
+
+    def create_hook_process(*argv, **kwargs):
+        hook_process = HookProcess(EchoHooks, str(tmp_path / 'hooks.log'), ['hooks'] + list(argv), **kwargs)
+        hook_process.send_config(CompiledConfig({55: 59}, set(), {}))
+        hook_process.send_input_state(InputState(True))
+        hook_process.start()
+        hook_processes.append(hook_process)
+        return hook_process
+
+    yield create_hook_process
+    for hook_process in hook_processes:
+        hook_process.stop()
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_spawned_process_gets_the_state_sent_before(create_hook_process):
+    hook_process = create_hook_process()
+    assert hook_process.is_alive()
+    assert hook_process.get_stats(timeout=10) == {'messages': [MSG_CONFIG, MSG_INPUT_STATE, MSG_GET_STATS]}
+
+def test_dead_process_is_restarted_with_the_last_state(create_hook_process):
+    hook_process = create_hook_process(restart_delay=0.01)
+    hook_process.send_input_state(InputState(False))
+    hook_process.get_stats(timeout=10)
+    hook_process._process.kill()
+    wait_until(lambda: hook_process.restarts == 1 and hook_process.is_alive())
+    assert hook_process.get_stats(timeout=10) == {
+        'messages': [MSG_CONFIG, MSG_INPUT_STATE, MSG_RELEASE_ALL_KEYS, MSG_GET_STATS]}
+
+def test_unanswered_stats_request(create_hook_process):
+    hook_process = create_hook_process('0.5')
+    hook_process.get_stats(timeout=10)
+    assert hook_process.get_stats(timeout=0.05) is None
+    # The late reply is skipped by its id.
+    assert hook_process.get_stats(timeout=10)['messages'][-1] == MSG_GET_STATS
+
+def test_sends_dont_wait_for_a_stats_reply(create_hook_process):
+    hook_process = create_hook_process('0.5')
+    hook_process.get_stats(timeout=10)
+    waiting = Thread(target=hook_process.get_stats)
+    waiting.start()
+    time.sleep(0.05)
+    start_time = time.monotonic()
+    hook_process.send_input_state(InputState(True))
+    assert time.monotonic() - start_time < 0.2
+    waiting.join()
+
+def test_stop_ends_the_process(create_hook_process):
+    hook_process = create_hook_process()
+    process = hook_process._process
+    hook_process.stop()
+    assert not process.is_alive()
+    assert process.exitcode == 0
+    assert hook_process.restarts == 0
+    assert hook_process.get_stats() is None
@@ -0,0 +1,80 @@
+import pytest
+
+from moonlight_desktop.hotkey_trie import HotkeyMatcher, NO_MATCH, parse_hotkey, split_hotkeys
+from moonlight_desktop.keymap import MACRO, MOD_CTRL, MOD_SHIFT
+
+KEYCODES = {'<ctrl>': 59, '<shift>': 56, 'a': 0, 's': 1, 'b': 11, 'c': 8, 'q': 12}
+MODIFIER_KEYS = {59: MOD_CTRL, 56: MOD_SHIFT}
+ACTION = MACRO
+
+@pytest.fixture
+def create_matcher(clock):
+    def create_matcher(*hotkey_strings, timeout=1.0):
+        rules = [(parse_hotkey(hotkey_string, KEYCODES.__getitem__, MODIFIER_KEYS), ACTION) for hotkey_string in hotkey_strings]
+        return HotkeyMatcher(rules, timeout, clock)
+    return create_matcher
+
+def test_parse_splits_single_keys_from_sequences():
+    rules = [parse_hotkey(hotkey_string, KEYCODES.__getitem__, MODIFIER_KEYS)
+             for hotkey_string in ('<ctrl>+q', '<ctrl>+<18..19>', '<ctrl>+a+s', '<ctrl>+b c')]
+    hotkeys, sequences = split_hotkeys(rules)
+    assert hotkeys == {(MOD_CTRL, 12), (MOD_CTRL, 18), (MOD_CTRL, 19)}
+    assert sequences == [((MOD_CTRL, ((0,), (1,))),), ((MOD_CTRL, ((11,),)), (0, ((8,),)))]
+
+def test_chord_in_any_order(create_matcher):
+    matcher = create_matcher('<ctrl>+a+s')
+    assert matcher.feed(MOD_CTRL, 1, True) == NO_MATCH
+    assert matcher.feed(MOD_CTRL, 0, True) == ACTION
+    assert matcher.feed(MOD_CTRL, 0, False) == ACTION
+    assert matcher.feed(MOD_CTRL, 1, False) == NO_MATCH
+    assert matcher.feed(MOD_CTRL, 0, True) == NO_MATCH
+    assert matcher.feed(MOD_CTRL, 1, True) == ACTION
+    assert matcher.matches == 2
+
+def test_chord_key_released_early(create_matcher):
+    matcher = create_matcher('<ctrl>+a+s')
+    assert matcher.feed(MOD_CTRL, 0, True) == NO_MATCH
+    assert matcher.feed(MOD_CTRL, 0, False) == NO_MATCH
+    assert matcher.feed(MOD_CTRL, 1, True) == NO_MATCH
+
+def test_sequence_and_its_repeat(create_matcher):
+    matcher = create_matcher('<ctrl>+b c')
+    assert matcher.feed(MOD_CTRL, 11, True) == NO_MATCH
+    # The auto-repeat of the leader doesn't restart the sequence.
+    assert matcher.feed(MOD_CTRL, 11, True) == NO_MATCH
+    assert matcher.feed(MOD_CTRL, 11, False) == NO_MATCH
+    assert matcher.feed(0, 8, True) == ACTION
+    assert matcher.feed(0, 8, True) == ACTION
+    # A repeat with other modifiers isn't the matched hotkey.
+    assert matcher.feed(MOD_SHIFT, 8, True) == NO_MATCH
+    assert matcher.feed(0, 8, False) == ACTION
+
+def test_sequence_timeout(create_matcher, clock):
+    matcher = create_matcher('<ctrl>+b c', timeout=1.0)
+    matcher.feed(MOD_CTRL, 11, True)
+    matcher.feed(MOD_CTRL, 11, False)
+    clock.now = 1.5
+    assert matcher.feed(0, 8, True) == NO_MATCH
+
+def test_key_may_start_another_rule(create_matcher):
+    matcher = create_matcher('<ctrl>+b c', '<ctrl>+a+s')
+    matcher.feed(MOD_CTRL, 11, True)
+    matcher.feed(MOD_CTRL, 11, False)
+    assert matcher.feed(MOD_CTRL, 0, True) == NO_MATCH
+    assert matcher.feed(MOD_CTRL, 1, True) == ACTION
+
+@pytest.mark.parametrize('hotkey_strings', [('<ctrl>+b', '<ctrl>+b c'), ('<ctrl>+b c', '<ctrl>+b')])
+def test_prefix_conflict(create_matcher, hotkey_strings):
+    with pytest.raises(RuntimeError):
+        create_matcher(*hotkey_strings)
+
+def test_reset_after_a_lost_up(create_matcher):
+    matcher = create_matcher('<ctrl>+b c')
+    matcher.feed(MOD_CTRL, 11, True)
+    matcher.feed(MOD_CTRL, 11, False)
+    assert matcher.feed(0, 8, True) == ACTION
+    # The up of c never came, e.g. the focus moved away. Without a reset a fresh c would
+    # still get the action.
+    matcher.reset()
+    assert matcher.feed(0, 8, True) == NO_MATCH
+    assert matcher.feed(0, 8, False) == NO_MATCH
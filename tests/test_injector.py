@@ -0,0 +1,48 @@
+from threading import Event
+
+from moonlight_desktop.injector import QueuedInjector
+
+from fakes import RecordingInjector
+
+# Holds the worker on its first batch until released.
+class BlockingInjector(RecordingInjector):
+    def __init__(self):
+        RecordingInjector.__init__(self)
+        self.entered = Event()
+        self.release = Event()
+
+    def send(self, batch):
+        self.entered.set()
+        self.release.wait(1)
+        RecordingInjector.send(self, batch)
+
+def test_releases_on_a_full_queue_keep_their_order():
+    base = BlockingInjector()
+    injector = QueuedInjector(base, 2)
+    injector.start()
+    injector.send(((1, True),))
+    assert base.entered.wait(1)
+    # The worker is busy, these fill the queue.
+    injector.send(((2, True),))
+    injector.send(((3, True),))
+    injector.send(((4, True),))
+    injector.send(((2, False),))
+    injector.send(((3, False),))
+    base.release.set()
+    injector.stop()
+
+    assert base.batches == [((1, True),), ((2, True),), ((3, True),), ((2, False),), ((3, False),)]
+    assert injector.dropped == 1
+    assert injector.overflowed == 2
+    assert injector.overflows == 1
+
+def test_stop_does_not_block_on_a_full_queue():
+    base = BlockingInjector()
+    injector = QueuedInjector(base, 1)
+    injector.start()
+    injector.send(((1, True),))
+    assert base.entered.wait(1)
+    injector.send(((2, True),))
+    base.release.set()
+    injector.stop()
+    assert base.batches == [((1, True),), ((2, True),)]
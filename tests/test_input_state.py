@@ -0,0 +1,41 @@
+import pytest
+
+from moonlight_desktop.input_state import InputState, DISABLED_INPUT_STATE
+
+BOUNDS = {'X': 100, 'Y': 40, 'Width': 800, 'Height': 600}
+
+def test_snapshot_is_immutable():
+    state = InputState(True)
+    with pytest.raises(AttributeError):
+        state.enabled = False
+    with pytest.raises(AttributeError):
+        del state.profile
+    with pytest.raises(AttributeError):
+        state.extra = 1
+
+def test_from_bounds_adds_the_margins():
+    state = InputState.from_bounds(True, BOUNDS, (10, 20, 30, 40), profile='vm')
+    assert (state.min_x, state.max_x, state.min_y, state.max_y) == (90, 920, 0, 680)
+    assert state.enabled and state.clipping
+    assert state.profile == 'vm'
+
+@pytest.mark.parametrize('enabled, bounds', [(False, BOUNDS), (True, None)])
+def test_from_bounds_without_a_window_is_disabled(enabled, bounds):
+    state = InputState.from_bounds(enabled, bounds, profile='vm')
+    assert not state.enabled and not state.clipping
+    assert state.profile == 'vm'
+
+def test_clipping_follows_enabled_unless_given():
+    assert not DISABLED_INPUT_STATE.clipping
+    assert not InputState(True, clipping=False).clipping
+
+def test_every_snapshot_is_a_new_generation():
+    first = InputState(True)
+    second = InputState(True)
+    assert second.generation > first.generation
+
+def test_round_trip_through_a_tuple():
+    state = InputState(True, 1, 2, 3, 4, False, 'vm')
+    copy = InputState(*state.to_tuple())
+    assert copy.to_tuple() == state.to_tuple()
+    assert copy.generation != state.generation
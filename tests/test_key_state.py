@@ -0,0 +1,32 @@
+from moonlight_desktop.key_state import KeyState
+
+def test_press_and_release_report_changes():
+    state = KeyState()
+    assert not state
+    assert state.press(5)
+    # The auto-repeat of a held key.
+    assert not state.press(5)
+    assert state.is_down(5)
+    assert state
+    assert state.release(5)
+    assert not state.release(5)
+    assert not state.is_down(5)
+    assert not state
+
+def test_keys_are_independent():
+    state = KeyState()
+    state.press(0)
+    state.press(255)
+    state.release(0)
+    assert not state.is_down(0)
+    assert state.is_down(255)
+    assert not state.is_down(254)
+
+def test_release_all_lists_the_held_keys_in_order():
+    state = KeyState()
+    for keycode in (200, 3, 64, 0):
+        state.press(keycode)
+    assert repr(state) == 'KeyState([0, 3, 64, 200])'
+    assert state.release_all() == [0, 3, 64, 200]
+    assert not state
+    assert state.release_all() == []
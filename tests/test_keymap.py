@@ -0,0 +1,55 @@
+import pytest
+
+from moonlight_desktop.keymap import Keymap, PASS, REMAP, PASSTHROUGH, MACRO, MOD_SHIFT, MOD_CTRL, MOD_ALT, MOD_CMD, \
+    MOD_COUNT, KEYCODE_BITS, KEYCODE_COUNT, modifier_mask, check_keycode
+
+CTRL_L = 59
+F17 = 64
+Q = 12
+
+def test_bit_layout():
+    # Each modifier a bit of its own, the mask indexes MOD_COUNT rows of KEYCODE_COUNT keys.
+    assert MOD_SHIFT | MOD_CTRL | MOD_ALT | MOD_CMD == MOD_COUNT - 1
+    assert KEYCODE_COUNT == 1 << KEYCODE_BITS
+    assert modifier_mask(True, False, False, False) == MOD_CTRL
+    assert modifier_mask(False, True, True, True) == MOD_ALT | MOD_CMD | MOD_SHIFT
+    assert modifier_mask(False, False, False, False) == 0
+
+def test_remap_applies_with_any_modifiers():
+    keymap = Keymap({CTRL_L: F17}, modifier_keys={CTRL_L: MOD_CTRL})
+    for mods in range(MOD_COUNT):
+        assert keymap.decide(mods, CTRL_L) == REMAP
+    assert keymap.remap_target(CTRL_L) == F17
+    assert keymap.is_modifier_remap(CTRL_L)
+    assert keymap.decide(0, F17) == PASS
+    assert not keymap.is_modifier_remap(Q)
+
+def test_passthrough_needs_its_exact_modifiers():
+    keymap = Keymap(passthrough_hotkeys={(MOD_CTRL, Q)})
+    assert keymap.decide(MOD_CTRL, Q) == PASSTHROUGH
+    assert keymap.decide(0, Q) == PASS
+    assert keymap.decide(MOD_CTRL | MOD_SHIFT, Q) == PASS
+    assert keymap.decide(MOD_CTRL, Q + 1) == PASS
+
+def test_macro_hotkey_action_carries_its_index():
+    keymap = Keymap(macro_hotkeys={(MOD_CMD, Q): 3})
+    assert keymap.decide(MOD_CMD, Q) == MACRO + 3
+    assert keymap.hotkey_matcher is None
+
+def test_last_keycode_and_the_ones_past_it():
+    keymap = Keymap({KEYCODE_COUNT - 1: 0}, modifier_keys={KEYCODE_COUNT - 1: MOD_ALT})
+    assert keymap.decide(MOD_COUNT - 1, KEYCODE_COUNT - 1) == REMAP
+    assert keymap.decide(0, KEYCODE_COUNT) == PASS
+    assert keymap.modifier_of(KEYCODE_COUNT - 1) == MOD_ALT
+    assert keymap.modifier_of(KEYCODE_COUNT) == 0
+
+@pytest.mark.parametrize('keycode', [-1, KEYCODE_COUNT, 1.5, None])
+def test_out_of_range_keycodes_are_rejected(keycode):
+    with pytest.raises(RuntimeError, match='out of range'):
+        check_keycode(keycode)
+    with pytest.raises(RuntimeError):
+        Keymap({keycode: 0})
+    with pytest.raises(RuntimeError):
+        Keymap({0: keycode})
+    with pytest.raises(RuntimeError):
+        Keymap(passthrough_hotkeys={(0, keycode)})
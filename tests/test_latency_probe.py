@@ -0,0 +1,98 @@
+import time
+
+from moonlight_desktop.latency_probe import ProbeServer, ProbeClient, MESSAGE, MARKER, PROBE, SYNC
+
+from fakes import LoopbackMarkerInjector
+
+class FakeSocket:
+    def __init__(self, received=()):
+        self.sent = []
+        self.received = list(received)
+
+    def sendto(self, data, address):
+        self.sent.append((MESSAGE.unpack(data), address))
+
+    def recvfrom(self, size):
+        return self.received.pop(0)
+
+def create_server(now, **kwargs):
+    server = ProbeServer(clock=lambda: now[0], **kwargs)
+    server._socket = FakeSocket()
+    return server
+
+def test_server_listens_on_loopback_by_default():
+    assert ProbeServer()._address[0] == '127.0.0.1'
+
+def test_marker_is_paired_with_the_newest_announcement():
+    now = [0]
+    server = create_server(now)
+    server._pending.extend([(1, 'client', 100), (2, 'client', 200)])
+    now[0] = 300
+    server.on_marker()
+    # The hook only takes the time, the probe thread sends.
+    assert server._socket.sent == []
+    now[0] = 400
+    server.report_markers()
+    assert server._socket.sent == [((MARKER, 2, 300, 0, 0), 'client')]
+    assert not server._pending
+    server.on_marker()
+    server.report_markers()
+    assert server.unmatched == 1
+
+def test_announcement_after_the_marker_is_not_paired():
+    now = [300]
+    server = create_server(now)
+    server.on_marker()
+    server._pending.append((1, 'client', 350))
+    server.report_markers()
+    assert server._socket.sent == []
+    assert server.unmatched == 1
+
+def test_expired_announcements_are_not_paired():
+    now = [0]
+    server = create_server(now)
+    server._pending.append((1, 'client', 0))
+    now[0] = 2 * 10 ** 9
+    server.on_marker()
+    server.report_markers()
+    assert server._socket.sent == []
+    assert server.unmatched == 1
+
+def test_other_hosts_are_ignored():
+    now = [0]
+    server = create_server(now, client_host='10.0.0.2')
+    server._socket.received = [
+        (MESSAGE.pack(SYNC, 1, 5, 0, 0), ('10.0.0.3', 1000)),
+        (MESSAGE.pack(PROBE, 2, 5, 0, 0), ('10.0.0.3', 1000)),
+        (MESSAGE.pack(SYNC, 3, 5, 0, 0), ('10.0.0.2', 1000)),
+    ]
+    for _ in range(3):
+        assert server._receive()
+    assert server._socket.sent == [((SYNC, 3, 5, 0, 0), ('10.0.0.2', 1000))]
+    assert not server._pending
+
+def test_client_sends_through_the_given_callable():
+    batches = []
+    client = ProbeClient(batches.append, 111, ('server', 1), clock=lambda: 5)
+    client._socket = FakeSocket()
+    client.probe()
+    assert batches == [((111, True), (111, False))]
+    assert client.sent == 1
+
+def test_markers_come_back_over_loopback():
+    server = ProbeServer(port=0, client_host='127.0.0.1')
+    server.start()
+    injector = LoopbackMarkerInjector(server, 111)
+    client = ProbeClient(injector.send, 111, server._socket.getsockname(), rate=100, sync_every=1)
+    client.start()
+    try:
+        deadline = time.monotonic() + 2
+        while client.received < 3:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        client.stop()
+        server.stop()
+    assert client.latency.count >= 3
+    # The loopback delays the marker by 5 ms, the clocks are the same.
+    assert client.latency.max >= 5 * 10 ** 6
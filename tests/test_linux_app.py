@@ -0,0 +1,146 @@
+from threading import Thread
+import errno
+import os
+import sys
+import time
+
+import pytest
+
+from moonlight_desktop import linux_app
+from moonlight_desktop.linux_app import LinuxApp, KEY_NAMES, CHAR_KEYCODES, KEY_DOWN, KEY_UP, KEY_REPEAT
+from moonlight_desktop.input_state import InputState, DISABLED_INPUT_STATE
+from moonlight_desktop.keymap import REMAP, PASSTHROUGH, PASS, MOD_CTRL, MOD_SHIFT
+
+from fakes import FakeInputDevice, RecordingUInput, create_fake_evdev
+
+CTRL_L = KEY_NAMES['ctrl_l']
+F17 = KEY_NAMES['f17']
+Q = CHAR_KEYCODES['q']
+
+CONFIG = '''
+remap_keys:
+  - from: '<ctrl_l>'
+    to: '<f17>'
+passthrough_hotkeys:
+  - '<ctrl>+q'
+'''
+
+@pytest.fixture
+def evdev(monkeypatch):
+    evdev = create_fake_evdev()
+    monkeypatch.setitem(sys.modules, 'evdev', evdev)
+    yield evdev
+    for device in evdev.devices.values():
+        device.close()
+
+@pytest.fixture
+def app(evdev, tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text(CONFIG)
+    app = LinuxApp(str(tmp_path / 'moonlight-desktop.log'), ['main', str(config_path)])
+    app._load_config()
+    app._base_injector.uinput = RecordingUInput()
+    app._publish_input_state(InputState(True))
+    return app
+
+def plug(evdev, path, **kwargs):
+    device = evdev.devices[path] = FakeInputDevice(path, **kwargs)
+    return device
+
+def test_only_keyboards_are_grabbed(app, evdev):
+    keyboard = plug(evdev, '/dev/input/event0')
+    mouse = plug(evdev, '/dev/input/event1', name='mouse', keys=[0x110, 0x111])
+    assert app._open_devices() == [keyboard]
+    assert keyboard.grabbed
+    assert mouse.closed
+
+def test_grabbed_keyboards_are_let_go_if_one_fails(app, evdev):
+    first = plug(evdev, '/dev/input/event0')
+    second = plug(evdev, '/dev/input/event1')
+    second.grab_error = OSError(errno.EBUSY, 'Device or resource busy')
+    with pytest.raises(OSError):
+        app._open_devices()
+    assert not first.grabbed
+    assert first.closed and second.closed
+
+def test_remapped_modifier(app):
+    batch = []
+    assert app._handle_key(CTRL_L, KEY_DOWN, batch) == REMAP
+    assert app._handle_key(CTRL_L, KEY_UP, batch) == REMAP
+    assert batch == [(F17, KEY_DOWN), (F17, KEY_UP)]
+
+def test_passthrough_hotkey_is_replayed_with_the_real_modifier(app):
+    batch = []
+    app._handle_key(CTRL_L, KEY_DOWN, batch)
+    assert app._handle_key(Q, KEY_DOWN, batch) == PASSTHROUGH
+    assert batch == [(F17, KEY_DOWN), (F17, False), (CTRL_L, True), (Q, KEY_DOWN)]
+
+def test_modifier_mask_follows_the_physical_modifiers(app):
+    shift_l = KEY_NAMES['shift_l']
+    batch = []
+    app._handle_key(CTRL_L, KEY_DOWN, batch)
+    app._handle_key(shift_l, KEY_DOWN, batch)
+    assert app._mods == MOD_CTRL | MOD_SHIFT
+    app._handle_key(CTRL_L, KEY_REPEAT, batch)
+    app._handle_key(CTRL_L, KEY_UP, batch)
+    assert app._mods == MOD_SHIFT
+    app._handle_key(shift_l, KEY_UP, batch)
+    assert app._mods == 0
+
+def test_injected_keys_are_released_on_focus_loss(app):
+    batch = []
+    app._handle_key(CTRL_L, KEY_DOWN, batch)
+    app._publish_input_state(DISABLED_INPUT_STATE)
+    assert app._base_injector.uinput.events == [(linux_app.EV_KEY, F17, 0)]
+    # Unhandled now, the key goes out as it is.
+    assert app._handle_key(CTRL_L, KEY_UP, batch) == PASS
+    assert batch[-1] == (CTRL_L, KEY_UP)
+
+@pytest.fixture
+def run_event_loop(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(linux_app, 'INPUT_DEVICE_DIR', str(tmp_path))
+    monkeypatch.setattr(linux_app, 'DEVICE_SCAN_INTERVAL', 0.01)
+    wakeup_pipe = os.pipe()
+    threads = []
+
+    def run_event_loop():
+        app._devices = app._open_devices()
+        thread = Thread(target=app._run_event_loop, args=(wakeup_pipe[0],), daemon=True)
+        thread.start()
+        threads.append(thread)
+        return thread
+
+    yield run_event_loop
+    os.write(wakeup_pipe[1], b'\0')
+    for thread in threads:
+        thread.join(1)
+    os.close(wakeup_pipe[0])
+    os.close(wakeup_pipe[1])
+
+def wait_until(condition):
+    deadline = time.monotonic() + 1
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+def test_unplugged_keyboard_is_dropped(app, evdev, run_event_loop):
+    keyboard = plug(evdev, '/dev/input/event0')
+    thread = run_event_loop()
+    keyboard.unplug()
+    wait_until(lambda: app._devices == [])
+    assert keyboard.closed
+    assert thread.is_alive()
+    assert app._stats.exceptions == 0
+
+def test_hot_plugged_keyboard_is_grabbed(app, evdev, run_event_loop, tmp_path):
+    plug(evdev, '/dev/input/event0')
+    run_event_loop()
+    keyboard = plug(evdev, '/dev/input/event1')
+    # Keep adding device nodes, the loop may take its first look at the directory after one.
+    nodes = iter(range(1000))
+    wait_until(lambda: (tmp_path / 'event{}'.format(next(nodes))).touch() or keyboard in app._devices)
+    assert keyboard.grabbed
+    keyboard.push((Q, KEY_DOWN))
+    wait_until(lambda: app._base_injector.uinput.events)
+    assert app._base_injector.uinput.events == [(linux_app.EV_KEY, Q, KEY_DOWN)]
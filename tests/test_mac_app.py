@@ -0,0 +1,82 @@
+import pytest
+
+from benchmarks import stubs
+
+from fakes import RecordingInjector
+
+BOUNDS = {'X': 0, 'Y': 0, 'Width': 1920, 'Height': 1080}
+CTRL_FLAGS = stubs.QUARTZ_CONSTANTS['kCGEventFlagMaskControl']
+KEY_DOWN = stubs.QUARTZ_CONSTANTS['kCGEventKeyDown']
+KEY_UP = stubs.QUARTZ_CONSTANTS['kCGEventKeyUp']
+FLAGS_CHANGED = stubs.QUARTZ_CONSTANTS['kCGEventFlagsChanged']
+CTRL_L = stubs.MAC_KEYS['ctrl_l']
+F17 = stubs.MAC_KEYS['f17']
+
+CONFIG = '''
+remap_keys:
+  - from: '<ctrl_l>'
+    to: '<f17>'
+passthrough_hotkeys:
+  - '<ctrl>+q'
+macros:
+  - name: leader
+    hotkey: '<ctrl>+b c'
+    steps:
+      - tap: '<f18>'
+'''
+
+@pytest.fixture
+def create_app(stub_platform, tmp_path, monkeypatch):
+    stub_platform('darwin')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    from moonlight_desktop.mac_app import MacApp
+    from moonlight_desktop.window_tracker import WindowState
+
+    class RecordingMacApp(MacApp):
+        def _create_base_injector(self):
+            return RecordingInjector()
+
+    def create_app(config_text):
+        config_path = tmp_path / 'config.yaml'
+        config_path.write_text(config_text)
+        app = RecordingMacApp(str(tmp_path / 'moonlight-desktop.log'), ['main', str(config_path)])
+        app._load_config()
+        app._on_moonlight_window_changed(WindowState(True, BOUNDS, 1))
+        return app
+
+    return create_app
+
+def press(app, event_type, keycode, flags=0):
+    return app._darwin_key_event_listener(event_type, stubs.FakeEvent(keycode=keycode, flags=flags))
+
+def test_passthrough_hotkey_is_injected_with_its_modifiers(create_app):
+    app = create_app(CONFIG)
+    q = stubs.MAC_CHARS['q']
+    assert press(app, FLAGS_CHANGED, CTRL_L, CTRL_FLAGS) is None
+    assert press(app, KEY_DOWN, q, CTRL_FLAGS) is None
+    assert press(app, KEY_UP, q, CTRL_FLAGS) is None
+    assert app._injector.batches == [
+        ((F17, True),),
+        # The remapped ctrl is let go, the host gets a real ctrl with the key.
+        ((F17, False), (CTRL_L, True), (q, True)),
+        ((CTRL_L, False), (q, False)),
+    ]
+
+def test_passthrough_chords_and_sequences_are_rejected(create_app):
+    with pytest.raises(RuntimeError, match='single key'):
+        create_app("passthrough_hotkeys:\n  - '<ctrl>+a+s'\n")
+    with pytest.raises(RuntimeError, match='single key'):
+        create_app("passthrough_hotkeys:\n  - '<ctrl>+b c'\n")
+
+def test_macro_sequence_plays_on_its_last_key(create_app, monkeypatch):
+    app = create_app(CONFIG)
+    played = []
+    monkeypatch.setattr(app._macro_scheduler, 'play', lambda macro: played.append(macro.name))
+    b = stubs.MAC_CHARS['b']
+    c = stubs.MAC_CHARS['c']
+    press(app, KEY_DOWN, b, CTRL_FLAGS)
+    press(app, KEY_UP, b, CTRL_FLAGS)
+    assert played == []
+    assert press(app, KEY_DOWN, c) is None
+    assert press(app, KEY_UP, c) is None
+    assert played == ['leader']
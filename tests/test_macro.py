@@ -0,0 +1,110 @@
+from threading import Thread, Event
+
+import pytest
+
+from moonlight_desktop.macro import Macro, MacroScheduler, compile_macro
+
+TICK_NS = 500000
+
+@pytest.fixture
+def macro():
+    return compile_macro('m', ((0, ((1,),)),), [{'down': 'a'}, {'delay': 1.0}, {'up': 'a'}], {'a': 5}.__getitem__)
+
+def is_lock_free(lock):
+    # Tried from another thread, the scheduler's condition is reentrant.
+    result = []
+    def try_lock():
+        acquired = lock.acquire(timeout=1)
+        if acquired:
+            lock.release()
+        result.append(acquired)
+    thread = Thread(target=try_lock)
+    thread.start()
+    thread.join()
+    return result[0]
+
+def test_compile_macro(macro):
+    assert macro.batches == ((0, ((5, True),)), (10 ** 9, ((5, False),)))
+    assert macro.keycodes() == {5}
+    assert Macro.from_dict(macro.to_dict()).batches == macro.batches
+
+def test_batches_fire_when_due(macro, clock):
+    scheduler = MacroScheduler(lambda batch: None, clock=clock)
+    scheduler.play(macro)
+    timeout, sends = scheduler._advance()
+    assert [batch for _, batch in sends] == [((5, True),)]
+    assert 0 < timeout <= 1.0
+    clock.now = 10 ** 9
+    timeout, sends = scheduler._advance()
+    assert [batch for _, batch in sends] == [((5, False),)]
+    assert timeout is None
+    assert scheduler.completed == 1
+
+def test_idle_wheel_jumps_to_now(macro, clock):
+    scheduler = MacroScheduler(lambda batch: None, clock=clock)
+    clock.now = 3600 * 10 ** 9
+    scheduler.play(macro)
+    assert scheduler._current_tick == clock.now // TICK_NS
+
+def test_batches_are_sent_outside_the_lock(macro):
+    free_while_sending = []
+    pressed = Event()
+    released = Event()
+    scheduler = None
+
+    def send(batch):
+        free_while_sending.append(is_lock_free(scheduler._condition))
+        (pressed if batch == ((5, True),) else released).set()
+
+    scheduler = MacroScheduler(send)
+    scheduler.start()
+    try:
+        scheduler.play(macro)
+        # The down fires right away, the cancel releases the key.
+        assert pressed.wait(1)
+        scheduler.cancel_all()
+        assert released.wait(1)
+    finally:
+        scheduler.stop()
+    assert free_while_sending == [True, True]
+    assert scheduler.cancelled == 1
+
+def test_cancel_all_does_not_wait_for_a_send(macro):
+    sending = Event()
+    unblock = Event()
+    sent = []
+
+    def send(batch):
+        sending.set()
+        unblock.wait(1)
+        sent.append(batch)
+
+    scheduler = MacroScheduler(send)
+    scheduler.start()
+    try:
+        scheduler.play(macro)
+        assert sending.wait(1)
+        # The scheduler thread is stuck injecting the down.
+        canceller = Thread(target=scheduler.cancel_all)
+        canceller.start()
+        canceller.join(0.5)
+        assert not canceller.is_alive()
+        unblock.set()
+    finally:
+        scheduler.stop()
+    assert sent == [((5, True),), ((5, False),)]
+
+def test_stop_sends_the_releases(macro):
+    pressed = Event()
+    sent = []
+
+    def send(batch):
+        sent.append(batch)
+        pressed.set()
+
+    scheduler = MacroScheduler(send)
+    scheduler.start()
+    scheduler.play(macro)
+    assert pressed.wait(1)
+    scheduler.stop()
+    assert sent == [((5, True),), ((5, False),)]
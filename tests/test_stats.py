@@ -0,0 +1,58 @@
+import pytest
+
+from moonlight_desktop.stats import Histogram, SUB_BUCKET_COUNT
+
+def single(value):
+    histogram = Histogram()
+    histogram.record(value)
+    return histogram
+
+def test_values_below_two_sub_bucket_ranges_are_exact():
+    histogram = Histogram()
+    for value in range(2 * SUB_BUCKET_COUNT):
+        histogram.record(value)
+    assert histogram.percentile(50) == SUB_BUCKET_COUNT - 1
+    assert histogram.percentile(100) == 2 * SUB_BUCKET_COUNT - 1
+    for value in range(2 * SUB_BUCKET_COUNT):
+        assert single(value).percentile(50) == value
+
+@pytest.mark.parametrize('value, bucket', [(32, 32), (33, 32), (34, 34), (63, 62), (64, 64), (67, 64), (68, 68), (1000, 992)])
+def test_larger_values_report_the_lower_bound_of_their_bucket(value, bucket):
+    assert single(value).percentile(50) == bucket
+
+def test_bucket_precision():
+    for value in (100, 12345, 10 ** 6 + 7, 10 ** 9 + 11):
+        bucket = single(value).percentile(50)
+        assert bucket <= value < bucket * (1 + 1 / SUB_BUCKET_COUNT)
+
+def test_percentiles():
+    histogram = Histogram()
+    for value in range(1, 101):
+        histogram.record(value)
+    assert histogram.percentile(0) == 1
+    assert histogram.percentile(10) == 10
+    # 88 to 91 share a bucket, the percentiles in it report 88.
+    assert histogram.percentile(88) == 88
+    assert histogram.percentile(91) == 88
+    assert histogram.percentile(92) == 92
+    assert histogram.percentile(100) == 100
+    assert histogram.to_dict()['mean'] == 50.5
+    assert histogram.to_dict()['min'] == 1
+
+def test_percentile_never_exceeds_the_max():
+    histogram = single(100)
+    histogram.record(101)
+    assert histogram.percentile(100) == 100
+    assert histogram.max == 101
+
+def test_empty_and_out_of_range_values():
+    histogram = Histogram()
+    assert histogram.percentile(99) == 0
+    histogram.record(-5)
+    assert histogram.min == 0 and histogram.percentile(50) == 0
+    # Past the last bucket, counted there.
+    histogram.record(1 << 50)
+    assert histogram.max == 1 << 50
+    assert histogram.percentile(100) == Histogram._bucket_value(len(histogram._counts) - 1)
+    histogram.reset()
+    assert histogram.count == 0 and histogram.min is None and histogram.percentile(50) == 0
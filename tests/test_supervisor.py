@@ -0,0 +1,62 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from moonlight_desktop.supervisor import EventLoopThread, ProcessSupervisor
+
+IGNORE_SIGTERM = 'import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); print("ready", flush=True); time.sleep(30)'
+
+@pytest.fixture
+def loop_thread():
+    loop_thread = EventLoopThread()
+    yield loop_thread
+    loop_thread.stop()
+
+def python_argv(code):
+    return [sys.executable, '-c', code]
+
+def wait_for_process(supervisor, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while supervisor._process is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return supervisor._process
+
+def test_exit_is_reported(loop_thread):
+    exit_codes = []
+    supervisor = ProcessSupervisor(loop_thread, python_argv('pass'), on_exit=exit_codes.append, restart_on_crash=True)
+    supervisor.start()
+    assert supervisor.wait(5) == 0
+    assert exit_codes == [0]
+    assert supervisor.restarts == 0
+
+def test_restarts_on_crash(loop_thread):
+    exit_codes = []
+    supervisor = ProcessSupervisor(loop_thread, python_argv('import sys; sys.exit(3)'), on_exit=exit_codes.append,
+                                   restart_on_crash=True, max_restarts=2, restart_delay=0.01)
+    supervisor.start()
+    assert supervisor.wait(10) == 3
+    assert supervisor.restarts == 2
+    assert exit_codes == [3]
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='SIGTERM can be ignored on POSIX only')
+def test_stop_kills_a_process_ignoring_terminate(loop_thread):
+    supervisor = ProcessSupervisor(loop_thread, python_argv(IGNORE_SIGTERM), terminate_timeout=0.2, kill_timeout=2.0,
+                                   popen=lambda argv: subprocess.Popen(argv, stdout=subprocess.PIPE))
+    supervisor.start()
+    process = wait_for_process(supervisor)
+    assert process.stdout.readline() == b'ready\n'
+    start_time = time.monotonic()
+    assert supervisor.stop() == -9
+    assert time.monotonic() - start_time >= 0.2
+    process.stdout.close()
+
+def test_stop_cancels_pending_tasks():
+    import asyncio
+    loop_thread = EventLoopThread()
+    future = loop_thread.submit(asyncio.sleep(30))
+    loop_thread.stop()
+    assert future.cancelled()
+    assert loop_thread.loop is None
@@ -0,0 +1,62 @@
+from time import perf_counter_ns
+
+from moonlight_desktop.tap_watchdog import TapWatchdog, DISABLED_BY_TIMEOUT, FOUND_DISABLED, HEARTBEAT_GAP
+
+from fakes import FakeEventTap
+
+def create_watchdog(heartbeat_gap=0, is_active=lambda: True):
+    recoveries = []
+    watchdog = TapWatchdog(lambda name, reason: recoveries.append((name, reason)),
+                           heartbeat_gap=heartbeat_gap, is_active=is_active)
+    tap = FakeEventTap()
+    monitor = watchdog.monitor('keyboard', tap)
+    return watchdog, monitor, tap, recoveries
+
+def test_disable_event_re_enables_the_tap():
+    watchdog, monitor, tap, recoveries = create_watchdog()
+    tap.disable()
+    monitor.callback_done(2000000, perf_counter_ns())
+    monitor.disabled(DISABLED_BY_TIMEOUT)
+    assert tap.enabled
+    assert recoveries == [('keyboard', DISABLED_BY_TIMEOUT)]
+    stats = watchdog.to_dict()
+    assert stats['recoveries'] == {'keyboard': {DISABLED_BY_TIMEOUT: 1}}
+    assert stats['recent'][0]['slowest_callback_ns'] == 2000000
+
+def test_check_finds_a_silently_disabled_tap():
+    watchdog, _, tap, recoveries = create_watchdog()
+    watchdog.check()
+    assert recoveries == []
+    tap.disable()
+    watchdog.check()
+    assert tap.enabled
+    assert recoveries == [('keyboard', FOUND_DISABLED)]
+
+def test_heartbeat_gap_is_counted_once_per_gap():
+    watchdog, monitor, tap, recoveries = create_watchdog(heartbeat_gap=0.5)
+    monitor.callback_done(1000, perf_counter_ns())
+    watchdog.check()
+    assert tap.enable_count == 0
+
+    monitor.last_callback_time = perf_counter_ns() - 1000000000
+    watchdog.check()
+    watchdog.check()
+    assert tap.enable_count == 1
+    assert watchdog.to_dict()['recoveries'] == {'keyboard': {HEARTBEAT_GAP: 1}}
+
+    # A callback ends the gap, the next one is counted again.
+    monitor.callback_done(1000, perf_counter_ns() - 1000000000)
+    watchdog.check()
+    assert tap.enable_count == 2
+
+def test_heartbeat_gap_does_not_release_held_keys():
+    watchdog, monitor, _, recoveries = create_watchdog(heartbeat_gap=0.5)
+    monitor.last_callback_time = perf_counter_ns() - 1000000000
+    watchdog.check()
+    assert recoveries == []
+
+def test_no_heartbeat_gap_while_input_is_not_handled():
+    watchdog, monitor, _, recoveries = create_watchdog(heartbeat_gap=0.5, is_active=lambda: False)
+    monitor.last_callback_time = perf_counter_ns() - 1000000000
+    watchdog.check()
+    assert recoveries == []
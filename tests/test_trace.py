@@ -0,0 +1,59 @@
+import io
+import os
+
+from moonlight_desktop.config_cache import CompiledConfig, Profile
+from moonlight_desktop.keymap import PASS, REMAP, PASSTHROUGH, MACRO, MOD_CTRL
+from moonlight_desktop.macro import Macro
+from moonlight_desktop.trace import TraceRecorder, read_trace, replay_records, get_previous_trace_path, KIND_ACTIVE, KIND_DOWN
+
+def test_records_are_read_back_in_order(tmp_path):
+    recorder = TraceRecorder(str(tmp_path / 'trace.bin'), capacity=4)
+    for time_ns in range(1, 7):
+        recorder.record(time_ns, 10, 55, 0, 0, PASS, KIND_ACTIVE, 0, 100)
+    recorder.close()
+    assert [record[0] for record in read_trace(recorder.file_path)] == [3, 4, 5, 6]
+
+def test_previous_ring_is_kept(tmp_path):
+    file_path = str(tmp_path / 'trace.bin')
+    recorder = TraceRecorder(file_path, capacity=4)
+    recorder.record(1, 10, 55, 0, 0, REMAP, KIND_ACTIVE, 0, 100)
+    recorder.close()
+    TraceRecorder(file_path, capacity=4).close()
+    assert read_trace(file_path) == []
+    assert os.path.exists(get_previous_trace_path(file_path))
+    assert [record[6] for record in read_trace(get_previous_trace_path(file_path))] == [REMAP]
+
+CTRL_B_C = ((MOD_CTRL, ((11,),)), (0, ((8,),)))
+
+def create_macro():
+    return Macro('ctrl-b-c', CTRL_B_C, ((0, ((12, True),)), (0, ((12, False),))))
+
+def test_replay_uses_the_recorded_profile():
+    profile = Profile('vm', None, 'VM', {}, {(0, 8)})
+    compiled_config = CompiledConfig({}, set(), {}, [profile], [create_macro()], {59: MOD_CTRL})
+    down = KIND_ACTIVE | KIND_DOWN
+    records = [
+        (1000, 0, 0, 0, 8, 0, PASSTHROUGH, down, 1),
+        # The default keymap passes it.
+        (2000, 0, 0, 0, 8, 0, PASS, down, 0),
+        # The macro sequence is matched in every profile.
+        (3000, 0, 0, 0, 59, MOD_CTRL, PASS, down, 1),
+        (4000, 0, 0, 0, 11, MOD_CTRL, PASS, down, 1),
+        (5000, 0, 0, 0, 11, MOD_CTRL, PASS, KIND_ACTIVE, 1),
+        (6000, 0, 0, 0, 59, 0, PASS, KIND_ACTIVE, 1),
+        (7000, 0, 0, 0, 8, 0, MACRO, down, 1),
+    ]
+    out = io.StringIO()
+    transitions = replay_records(records, compiled_config, out)
+    assert transitions == {(PASS, PASS): 5, (PASSTHROUGH, PASSTHROUGH): 1, (MACRO, MACRO): 1}
+    assert out.getvalue().startswith('recorded -> replayed')
+
+def test_replay_applies_the_sequence_timeout():
+    compiled_config = CompiledConfig({}, set(), {'hotkey_sequence_timeout': 1.0}, [], [create_macro()])
+    down = KIND_ACTIVE | KIND_DOWN
+    records = [
+        (1, 0, 0, 0, 11, MOD_CTRL, PASS, down, 0),
+        (2 * 10 ** 9, 0, 0, 0, 8, 0, MACRO, down, 0),
+    ]
+    transitions = replay_records(records, compiled_config, io.StringIO())
+    assert transitions == {(PASS, PASS): 1, (MACRO, PASS): 1}
@@ -0,0 +1,97 @@
+import ctypes
+
+import pytest
+
+from benchmarks import stubs
+from moonlight_desktop.win_hook import KeyboardHook, KBDLLHOOKSTRUCT, HC_ACTION, LLKHF_INJECTED, INJECTED_EXTRA_INFO
+
+from fakes import RecordingInjector
+
+WM_KEYDOWN = 0x100
+WM_KEYUP = 0x101
+WM_MOUSEMOVE = 0x200
+F17 = stubs.WIN_KEYS['f17']
+CTRL = stubs.WIN_KEYS['ctrl']
+A = 0x41
+
+CONFIG = '''
+remap_keys:
+  - from: '<f17>'
+    to: '<ctrl>'
+'''
+
+def dispatch(hook, msg, vk, flags=0, extra_info=0, n_code=HC_ACTION):
+    data = KBDLLHOOKSTRUCT(vk, 0, flags, 0, extra_info)
+    return hook.dispatch(n_code, msg, ctypes.addressof(data))
+
+@pytest.fixture
+def user32():
+    return stubs.FakeUser32()
+
+@pytest.fixture
+def app(stub_platform, tmp_path, monkeypatch):
+    stub_platform('win32')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    monkeypatch.setenv('LOCALAPPDATA', str(tmp_path))
+    from moonlight_desktop.win_app import WinApp
+
+    class RecordingWinApp(WinApp):
+        def _create_base_injector(self):
+            return RecordingInjector()
+
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text(CONFIG)
+    app = RecordingWinApp(str(tmp_path / 'moonlight-desktop.log'), ['main', str(config_path)])
+    app._load_config()
+    return app
+
+@pytest.fixture
+def hook(app, user32):
+    return KeyboardHook(app._handle_key_event, user32, user32)
+
+def test_remapped_key_is_swallowed(app, hook, user32):
+    assert dispatch(hook, WM_KEYDOWN, F17) == 1
+    assert dispatch(hook, WM_KEYUP, F17) == 1
+    assert user32.next_hook_calls == 0
+    assert app._injector.batches == [((CTRL, True),), ((CTRL, False),)]
+
+def test_other_keys_go_down_the_chain(app, hook, user32):
+    assert dispatch(hook, WM_KEYDOWN, A) == 0
+    assert user32.next_hook_calls == 1
+    assert app._injector.batches == []
+
+def test_our_injected_keys_are_skipped(app, hook, user32):
+    assert dispatch(hook, WM_KEYDOWN, F17, LLKHF_INJECTED, INJECTED_EXTRA_INFO) == 0
+    assert user32.next_hook_calls == 1
+    assert app._injector.batches == []
+
+def test_keys_injected_by_the_host_are_remapped(app, hook, user32):
+    assert dispatch(hook, WM_KEYDOWN, F17, LLKHF_INJECTED) == 1
+    assert app._injector.batches == [((CTRL, True),)]
+
+def test_other_hook_codes_are_not_handled(user32):
+    handled = []
+    hook = KeyboardHook(lambda msg, data: handled.append(msg) or True, user32, user32)
+    assert dispatch(hook, WM_KEYDOWN, A, n_code=HC_ACTION + 3) == 0
+    assert handled == []
+    assert user32.next_hook_calls == 1
+
+def test_failing_handler_lets_the_event_through(user32):
+    def handler(msg, data):
+        raise ValueError(data.vkCode)
+
+    hook = KeyboardHook(handler, user32, user32)
+    assert dispatch(hook, WM_KEYDOWN, A) == 0
+    assert user32.next_hook_calls == 1
+
+def test_installed_hook_gets_the_events(user32):
+    handled = []
+    hook = KeyboardHook(lambda msg, data: handled.append((msg, data.vkCode)) or data.vkCode == F17, user32, user32)
+    hook.start()
+    try:
+        assert user32.send(WM_KEYDOWN, F17)
+        assert not user32.send(WM_KEYDOWN, A)
+    finally:
+        hook.stop()
+    assert handled == [(WM_KEYDOWN, F17), (WM_KEYDOWN, A)]
+    assert user32.proc is None
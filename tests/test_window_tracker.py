@@ -0,0 +1,118 @@
+from threading import Event
+
+import pytest
+
+from moonlight_desktop.window_tracker import WindowTracker, WindowState, DISABLED_WINDOW_STATE
+
+from fakes import FakeWindowProvider
+
+FULL_SCREEN = {'X': 0, 'Y': 0, 'Width': 1920, 'Height': 1080}
+WINDOWED = {'X': 100, 'Y': 40, 'Width': 800, 'Height': 600}
+
+@pytest.fixture
+def provider():
+    return FakeWindowProvider(target_pid=42)
+
+@pytest.fixture
+def states():
+    return []
+
+@pytest.fixture
+def tracker(provider, states, clock):
+    return WindowTracker(provider, states.append, min_interval=0.05, max_interval=1.0, clock=clock)
+
+def test_enabled_only_while_target_is_frontmost_and_full_screen(provider, tracker, states):
+    assert not tracker.refresh()
+    assert tracker.state == DISABLED_WINDOW_STATE
+
+    provider.set(42, FULL_SCREEN)
+    assert tracker.refresh()
+    assert states[-1] == WindowState(True, FULL_SCREEN, 42)
+
+    provider.set(42, WINDOWED)
+    assert tracker.refresh()
+    assert states[-1] == WindowState(False, WINDOWED, 42)
+
+    provider.set(7)
+    assert tracker.refresh()
+    assert states[-1] == DISABLED_WINDOW_STATE
+    assert len(states) == 3
+
+def test_unchanged_state_is_not_reported(provider, tracker, states):
+    provider.set(42, FULL_SCREEN)
+    assert tracker.refresh()
+    assert not tracker.refresh()
+    assert len(states) == 1
+
+def test_other_app_keeps_its_app_id_and_target_keeps_its_title(provider, tracker, states):
+    provider.set(7, app_id='com.example.editor')
+    tracker.refresh()
+    assert states[-1] == WindowState(False, None, None, 'com.example.editor')
+
+    provider.set(42, FULL_SCREEN, app_id='com.moonlight-stream.Moonlight', title='host')
+    tracker.refresh()
+    assert states[-1] == WindowState(True, FULL_SCREEN, 42, 'com.moonlight-stream.Moonlight', 'host')
+
+def test_target_pid_is_cached_while_frontmost(provider, tracker):
+    provider.set(42, FULL_SCREEN)
+    tracker.refresh()
+    provider.target_pid = 43
+    tracker.refresh()
+    # Still frontmost, the cached PID is kept.
+    assert tracker.state.pid == 42
+
+    provider.set(43, FULL_SCREEN)
+    tracker.refresh()
+    assert tracker.state.pid == 43
+
+def test_polls_with_backoff_only_while_target_is_frontmost(provider, tracker):
+    # What start() does, without the thread.
+    tracker._has_notifications = provider.subscribe(tracker.notify)
+    # Nothing to poll for, notifications will wake the tracker.
+    assert tracker.next_timeout(False) is None
+
+    provider.set(42, FULL_SCREEN)
+    tracker.refresh()
+    assert tracker.next_timeout(True) == 0.05
+    assert tracker.next_timeout(False) == 0.1
+    assert tracker.next_timeout(False) == 0.2
+    for _ in range(10):
+        timeout = tracker.next_timeout(False)
+    assert timeout == 1.0
+    assert tracker.next_timeout(True) == 0.05
+
+def test_polls_without_notifications(provider, tracker):
+    provider.has_notifications = False
+    tracker._has_notifications = provider.subscribe(tracker.notify)
+    assert tracker.next_timeout(False) == 0.1
+
+def test_change_latency_is_measured_from_the_notification(provider, tracker, clock):
+    provider.subscribe(tracker.notify)
+    clock.now = 10.0
+    provider.set(42, FULL_SCREEN)
+    clock.now = 10.002
+    tracker.refresh()
+    assert abs(tracker.last_change_latency - 0.002) < 1e-9
+
+def test_notification_wakes_the_tracker_thread(provider):
+    changed = Event()
+    states = []
+
+    def on_change(state):
+        states.append(state)
+        changed.set()
+
+    tracker = WindowTracker(provider, on_change)
+    tracker.start()
+    try:
+        provider.set(42, FULL_SCREEN)
+        assert changed.wait(1)
+        assert states[-1].enabled
+    finally:
+        tracker.stop()
+
+def test_refresh_starts_with_the_active_pid(provider, tracker):
+    provider.set(42, FULL_SCREEN, title='Desktop')
+    tracker.refresh()
+    tracker.refresh()
+    assert provider.calls == ['active_pid', 'bounds', 'title'] * 2